@@ -1,3 +1,23 @@
 from django.contrib import admin
+from .models import DeviceToken
+from .authentication import invalidate_user
 
-# Register your models here.
+@admin.register(DeviceToken)
+class DeviceTokenAdmin(admin.ModelAdmin):
+    list_display = ['user__username', 'name', 'created_at', 'expires_at']
+    search_fields = ['user__username', 'name']
+    readonly_fields = ['user', 'key', 'name', 'created_at']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_user(obj.user_id)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_user(obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        for user_id in user_ids:
+            invalidate_user(user_id)
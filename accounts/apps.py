@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from arsongsapi.instrumentation import register_collector
+        from .authentication import token_cache
+        register_collector(token_cache.collect)
@@ -0,0 +1,136 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from config import CONFIG
+from songs.versions import auth_scope, bump_version, get_version, is_shared
+
+from .models import DeviceToken
+
+# Token authentication without the per-request token and user query.
+#
+# Each worker process keeps the users of recently seen tokens in a bounded
+# LRU. An entry is used while it is younger than AUTH_CACHE_TTL and the
+# user's auth version (songs.versions.auth_scope) has not moved since it was
+# read, so invalidate_user, called on logout and password reset, reaches
+# every process through the shared cache. Other changes, e.g. a user
+# deactivated in the admin, take effect within AUTH_CACHE_TTL.
+#
+# When the default cache is kept per process (songs.versions.is_shared), an
+# invalidation would reach only the process that made it, so tokens are
+# looked up on every request like TokenAuthentication does.
+
+AUTH_CACHE_SIZE = CONFIG.get("AUTH_CACHE_SIZE", 10000)
+AUTH_CACHE_TTL = CONFIG.get("AUTH_CACHE_TTL", 300)
+
+
+class TokenCache:
+    """Token key -> (user, token, auth version), least recently used first, for at most `ttl` seconds."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counts = {'hit': 0, 'miss': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[3] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[:3]
+
+    def set(self, key, user, token, version):
+        with self._lock:
+            self._entries[key] = (user, token, version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry[0].pk == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counts = {'hit': 0, 'miss': 0}
+
+    def count(self, result):
+        with self._lock:
+            self._counts[result] += 1
+
+    def counts(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def collect(self):
+        with self._lock:
+            samples = [
+                ('token_auth_cache_requests_total', {'result': result}, count)
+                for result, count in sorted(self._counts.items())
+            ]
+            size = len(self._entries)
+        yield 'token_auth_cache_requests_total', 'counter', "Token authentications by cache result.", samples
+        yield 'token_auth_cache_entries', 'gauge', "Tokens in the authentication cache.", [('token_auth_cache_entries', {}, size)]
+
+
+# Registered with /metrics in AccountsConfig.ready; DRF imports this module
+# while loading rest_framework.views, which the instrumentation module needs
+token_cache = TokenCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+def invalidate_user(user_id):
+    """Drop the cached authentications of every token of the user, in every process."""
+    token_cache.discard_user(user_id)
+    bump_version(auth_scope(user_id))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication for both the shared Token and DeviceToken keys,
+    answered from token_cache when it can be. Unknown keys are not cached.
+    """
+
+    def authenticate_credentials(self, key):
+        if not is_shared():
+            return self.load_credentials(key)
+
+        entry = token_cache.get(key)
+        if entry is not None:
+            user, token, version = entry
+            if get_version(auth_scope(user.pk)) == version and not self.is_expired(token):
+                token_cache.count('hit')
+                # A copy, so nothing a view sets on request.user outlives the request
+                return copy.copy(user), token
+        token_cache.count('miss')
+
+        user, token = self.load_credentials(key)
+        # Read after the token; an invalidation in between lasts until the TTL
+        token_cache.set(key, user, token, get_version(auth_scope(user.pk)))
+        return copy.copy(user), token
+
+    def load_credentials(self, key):
+        model = DeviceToken if len(key) == DeviceToken.KEY_LENGTH else Token
+        try:
+            token = model.objects.select_related('user').get(key=key)
+        except model.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if self.is_expired(token):
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user, token
+
+    def is_expired(self, token):
+        return isinstance(token, DeviceToken) and token.is_expired()
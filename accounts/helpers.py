@@ -4,3 +4,15 @@ from config import CONFIG
 def generateOTP(length=None):
     length = length or CONFIG["OTP_LENGTH"]
     return get_random_string(length=length, allowed_chars=CONFIG["OTP_ALLOWED_CHARS"])
+
+def get_account_config(user):
+    userData = {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+    } if user else None
+
+    return {
+        "user": userData,
+        "SRC_URI": CONFIG["SRC_URI"],
+    }
@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+from accounts.authentication import CachedTokenAuthentication, token_cache
+from accounts.models import DeviceToken
+from songs.versions import is_shared
+
+
+class UncachedTokenAuthentication(CachedTokenAuthentication):
+    """The lookups of CachedTokenAuthentication without its cache, the baseline for device tokens."""
+
+    def authenticate_credentials(self, key):
+        return self.load_credentials(key)
+
+
+class Command(BaseCommand):
+    help = "Benchmark TokenAuthentication against CachedTokenAuthentication on a skewed stream of requests from existing users. Creates tokens for users without one."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20000, help="Authentications per run.")
+        parser.add_argument('--users', type=int, default=500, help="Number of existing active users to authenticate as.")
+        parser.add_argument('--skew', type=float, default=1.0, help="Zipf exponent of requests per user; 0 spreads them evenly.")
+        parser.add_argument('--cache-size', type=int, default=None, help="Entries of the token cache, AUTH_CACHE_SIZE by default.")
+        parser.add_argument('--device-tokens', action='store_true', help="Authenticate with device tokens, deleted after the run.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **kwargs):
+        rng = random.Random(kwargs['seed'])
+        users = list(User.objects.filter(is_active=True).order_by('id')[:kwargs['users']])
+        if not users:
+            self.stdout.write(self.style.ERROR("The benchmark needs at least one active user."))
+            return
+        if not is_shared():
+            self.stdout.write(self.style.ERROR(
+                "The default cache is kept per process, so CachedTokenAuthentication does not cache; "
+                "set CACHES to a shared backend."
+            ))
+            return
+
+        if kwargs['device_tokens']:
+            tokens = [DeviceToken.issue(user, 'bench_token_auth') for user in users]
+        else:
+            tokens = [Token.objects.get_or_create(user=user)[0] for user in users]
+        factory = APIRequestFactory()
+        requests = [factory.get('/', HTTP_AUTHORIZATION=f'Token {token.key}') for token in tokens]
+        weights = [1 / (rank + 1) ** kwargs['skew'] for rank in range(len(requests))]
+        stream = rng.choices(requests, weights=weights, k=kwargs['requests'])
+
+        size = token_cache.size
+        if kwargs['cache_size'] is not None:
+            token_cache.size = kwargs['cache_size']
+        try:
+            token_cache.clear()
+            # TokenAuthentication does not know device tokens
+            plain = self.run(UncachedTokenAuthentication() if kwargs['device_tokens'] else TokenAuthentication(), stream)
+            token_cache.clear()
+            cached = self.run(CachedTokenAuthentication(), stream)
+            counts = token_cache.counts()
+        finally:
+            token_cache.size = size
+            token_cache.clear()
+            if kwargs['device_tokens']:
+                DeviceToken.objects.filter(id__in=[token.id for token in tokens]).delete()
+
+        self.stdout.write(
+            f"{len(stream)} authentications, {len(tokens)} tokens, skew {kwargs['skew']}, "
+            f"cache size {kwargs['cache_size'] or size}"
+        )
+        for name, (timings, queries) in [("uncached", plain), ("cached", cached)]:
+            self.stdout.write(
+                f"{name:>8}: median {statistics.median(timings) * 1e6:7.1f}us  "
+                f"p95 {statistics.quantiles(timings, n=20)[-1] * 1e6:7.1f}us  "
+                f"{queries / len(stream):.3f} queries/request  "
+                f"({sum(plain[0]) / sum(timings):.1f}x)"
+            )
+        self.stdout.write(f"Cache hit rate {counts['hit'] / len(stream):.1%} ({counts['miss']} misses).")
+
+    def run(self, authentication, stream):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        timings = []
+        with connection.execute_wrapper(count):
+            for request in stream:
+                start = time.perf_counter()
+                authentication.authenticate(request)
+                timings.append(time.perf_counter() - start)
+        return timings, queries
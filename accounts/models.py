@@ -1,3 +1,36 @@
+import secrets
+from datetime import timedelta
+from django.conf import settings
 from django.db import models
+from django.utils.timezone import now
+from config import CONFIG
 
-# Create your models here.
+# Days a device token stays valid after login; 0 or None for no expiry
+DEVICE_TOKEN_TTL_DAYS = CONFIG.get("DEVICE_TOKEN_TTL_DAYS", 90)
+
+
+class DeviceToken(models.Model):
+    """
+    A login token for one device, issued when the login request names the
+    device. Unlike the shared authtoken Token, logging out of one device
+    revokes only its token, and the token expires. The key is longer than a
+    Token key, which is how CachedTokenAuthentication tells them apart.
+    """
+    KEY_LENGTH = 64
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='device_tokens')
+    key = models.CharField(max_length=KEY_LENGTH, unique=True)
+    name = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def issue(cls, user, name):
+        expires_at = now() + timedelta(days=DEVICE_TOKEN_TTL_DAYS) if DEVICE_TOKEN_TTL_DAYS else None
+        return cls.objects.create(user=user, key=secrets.token_hex(cls.KEY_LENGTH // 2), name=name, expires_at=expires_at)
+
+    def is_expired(self):
+        return self.expires_at is not None and self.expires_at <= now()
+
+    def __str__(self):
+        return f'{self.user} ({self.name})'
@@ -8,6 +8,7 @@ from config import CONFIG
 class LoginWithUsernameAPISerializer(serializers.Serializer):
     username = serializers.CharField(required=True)  # Use CharField for username
     password = serializers.CharField(required=True, write_only=True)  # Hide password in responses
+    device_name = serializers.CharField(required=False, max_length=100)  # Issues a DeviceToken for this device
 
 class RegisterAPISerializer(serializers.Serializer):
     username = serializers.CharField(required=True, max_length=150, validators=[UniqueValidator(queryset=User.objects.all())])
@@ -1,3 +1,113 @@
-from django.test import TestCase
+import tempfile
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import override_settings
+from django.utils.timezone import now
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from config import CONFIG
 
-# Create your tests here.
+from .authentication import invalidate_user, token_cache
+from .models import DeviceToken
+
+
+class DeviceTokenTests(APITestCase):
+    password = 'Listen-pass-1'
+
+    def setUp(self):
+        # A cache the worker processes share, which CachedTokenAuthentication needs to cache
+        location = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }))
+        cache.clear()
+        token_cache.clear()
+        self.user = User.objects.create_user('listener', 'listener@example.com', self.password)
+
+    def login(self, **extra):
+        response = self.client.post('/auth/username/login', {'username': 'listener', 'password': self.password, **extra}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data['token']
+
+    def get_liked_songs(self, key):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        return self.client.get('/content/liked-songs').status_code
+
+    def logout(self, key, **data):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        return self.client.post('/auth/logout', data, format='json').status_code
+
+    def test_device_login_authenticates_api_calls(self):
+        key = self.login(device_name='phone')
+        self.assertEqual(len(key), DeviceToken.KEY_LENGTH)
+        self.assertEqual(self.get_liked_songs(key), 200)
+        # The second request is answered from the cache
+        self.assertEqual(self.get_liked_songs(key), 200)
+        self.assertEqual(token_cache.counts(), {'hit': 1, 'miss': 1})
+
+    def test_login_without_a_device_keeps_the_shared_token(self):
+        key = self.login()
+        self.assertEqual(key, Token.objects.get(user=self.user).key)
+        self.assertEqual(self.get_liked_songs(key), 200)
+
+    def test_logout_revokes_only_that_device(self):
+        phone, laptop = self.login(device_name='phone'), self.login(device_name='laptop')
+        self.assertEqual(self.get_liked_songs(phone), 200)
+
+        self.assertEqual(self.logout(phone), 200)
+        self.assertEqual(self.get_liked_songs(phone), 401)
+        self.assertEqual(self.get_liked_songs(laptop), 200)
+
+    def test_logout_all_devices_revokes_every_token(self):
+        keys = [self.login(), self.login(device_name='phone'), self.login(device_name='laptop')]
+        for key in keys:
+            self.assertEqual(self.get_liked_songs(key), 200)
+
+        self.assertEqual(self.logout(keys[1], logout_all_devices=True), 200)
+        for key in keys:
+            self.assertEqual(self.get_liked_songs(key), 401)
+
+    def test_password_reset_drops_cached_authentications(self):
+        key = self.login(device_name='phone')
+        self.assertEqual(self.get_liked_songs(key), 200)
+        # Invisible to the cache until the user is invalidated
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.get_liked_songs(key), 200)
+
+        otp = '1' * CONFIG["OTP_LENGTH"]
+        cache.set(f'fp-{self.user.email}', otp)
+        self.client.credentials()
+        response = self.client.post('/auth/reset-password-with-email', {
+            'email': self.user.email, 'password': 'New-listen-pass-2', 'OTP': otp,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_liked_songs(key), 401)
+
+    def test_invalidation_reaches_other_processes(self):
+        key = self.login(device_name='phone')
+        self.assertEqual(self.get_liked_songs(key), 200)
+        entry = token_cache.get(key)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_user(self.user.pk)
+        # Another process still holds the entry; the shared auth version has moved past it
+        token_cache.set(key, *entry)
+        self.assertEqual(self.get_liked_songs(key), 401)
+
+    def test_expired_device_token_is_rejected(self):
+        key = self.login(device_name='phone')
+        self.assertEqual(self.get_liked_songs(key), 200)
+        DeviceToken.objects.filter(key=key).update(expires_at=now() - timedelta(seconds=1))
+        token_cache.clear()
+        self.assertEqual(self.get_liked_songs(key), 401)
+
+    def test_unknown_device_key_is_rejected(self):
+        self.assertEqual(self.get_liked_songs('0' * DeviceToken.KEY_LENGTH), 401)
+
+    def test_process_local_cache_is_not_used(self):
+        key = self.login(device_name='phone')
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(self.get_liked_songs(key), 200)
+            self.assertEqual(self.get_liked_songs(key), 200)
+        self.assertEqual(token_cache.counts(), {'hit': 0, 'miss': 0})
@@ -8,23 +8,15 @@ from rest_framework.permissions import IsAuthenticated
 from django.contrib.auth import authenticate
 from django.core.cache import cache
 from .emailfunctions import verify_email_otp_email, email_verified_email, otp_to_reset_password_email, password_reset_successfully_email, email_verified_email
-from .helpers import generateOTP
+from .helpers import generateOTP, get_account_config
+from .models import DeviceToken
+from .authentication import invalidate_user
 from config import CONFIG
 
 class AccountConfigView(APIView):
     def post(self, request):
         user = request.user if request.user.is_authenticated else None
-
-        userData = {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-        } if user else None
-
-        return Response({
-            "user": userData,
-            "SRC_URI": CONFIG["SRC_URI"],
-        }, status=status.HTTP_200_OK)
+        return Response(get_account_config(user), status=status.HTTP_200_OK)
 
 class LoginWithUsernameAPIView(APIView):
     def post(self, request):
@@ -37,7 +29,10 @@ class LoginWithUsernameAPIView(APIView):
             user = authenticate(request, username=username, password=password)
 
             if (user):
-                token, created = Token.objects.get_or_create(user=user)
+                if (data.get('device_name')):
+                    token, created = DeviceToken.issue(user, data['device_name']), True
+                else:
+                    token, created = Token.objects.get_or_create(user=user)
                 return Response({
                     "user": {
                         "id": user.id,
@@ -151,6 +146,7 @@ class ResetPasswordRequestAPIView(APIView):
                 user = User.objects.get(email=email)
                 user.set_password(password)
                 user.save()
+                invalidate_user(user.id)
                 cache.delete(f'fp-{email}')
                 password_reset_successfully_email(user)
                 return Response({"message": "Password reset successfully."}, status=status.HTTP_200_OK)
@@ -162,13 +158,17 @@ class LogoutAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        try:
-            serializer = LogoutAPISerializer(data=request.data)
-            if (serializer.is_valid()):
-                data = serializer.validated_data
-                if (data['logout_all_devices']):
-                    token = Token.objects.get(user=request.user)
-                    token.delete()
-            return Response({"message": "Logged out successfully."}, status=status.HTTP_200_OK)
-        except Token.DoesNotExist:
-            return Response({"logout": ["Invalid token or already logged out."]}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = LogoutAPISerializer(data=request.data)
+        if (serializer.is_valid()):
+            data = serializer.validated_data
+            if (data['logout_all_devices']):
+                deleted, _ = Token.objects.filter(user=request.user).delete()
+                deleted += DeviceToken.objects.filter(user=request.user).delete()[0]
+                if (not deleted):
+                    return Response({"logout": ["Invalid token or already logged out."]}, status=status.HTTP_400_BAD_REQUEST)
+                invalidate_user(request.user.id)
+            elif (isinstance(request.auth, DeviceToken)):
+                # Only this device's token; the shared token is dropped by the client
+                request.auth.delete()
+                invalidate_user(request.user.id)
+        return Response({"message": "Logged out successfully."}, status=status.HTTP_200_OK)
@@ -0,0 +1,224 @@
+import bisect
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+from django.db import connections
+from django.http import HttpResponse
+from rest_framework import permissions
+from rest_framework.serializers import BaseSerializer
+from rest_framework.views import APIView
+from config import CONFIG
+
+# Per-request timing of database queries, serialization and rendering.
+#
+# PerformanceMiddleware times each request, sends the phases back in a
+# Server-Timing header and folds them into per-route histograms kept in
+# process memory. MetricsView serves the histograms, plus whatever other
+# modules register with register_collector, in the Prometheus text format.
+# Each worker process keeps its own numbers; the scraper sums them.
+
+SERVER_TIMING_HEADER = CONFIG.get("SERVER_TIMING_HEADER", True)
+
+# Histogram bucket upper bounds, seconds for latencies and queries for counts
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+_timings = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    __slots__ = ('queries', 'db', 'serialize', 'render', 'render_start', 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.render_start = None
+        self.serializing = False
+
+
+def _time_query(execute, sql, params, many, context):
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.queries += 1
+
+
+def _install_serializer_timing():
+    """Time BaseSerializer.data, the point where DRF serializers do their work."""
+    if getattr(BaseSerializer.data, '_timed', False):
+        return
+    data = BaseSerializer.data.fget
+
+    def timed_data(self):
+        timings = _timings.get()
+        # Serializers build nested serializers' data inside their own; only the outermost is timed
+        if timings is None or timings.serializing or hasattr(self, '_data'):
+            return data(self)
+        timings.serializing = True
+        start = time.perf_counter()
+        try:
+            return data(self)
+        finally:
+            timings.serialize += time.perf_counter() - start
+            timings.serializing = False
+
+    timed_property = property(timed_data)
+    timed_property.fget._timed = True
+    BaseSerializer.data = timed_property
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket', {**labels, 'le': str(bound)}, cumulative
+        yield f'{name}_sum', labels, self.sum
+        yield f'{name}_count', labels, cumulative
+
+
+class RouteMetrics:
+    """Latency, query count and phase histograms per (method, route)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def observe(self, method, route, status, total, timings):
+        with self._lock:
+            histograms = self._routes.get((method, route))
+            if histograms is None:
+                histograms = self._routes[(method, route)] = {
+                    'latency': Histogram(LATENCY_BUCKETS),
+                    'db': Histogram(LATENCY_BUCKETS),
+                    'serialize': Histogram(LATENCY_BUCKETS),
+                    'render': Histogram(LATENCY_BUCKETS),
+                    'queries': Histogram(QUERY_BUCKETS),
+                    'errors': 0,
+                }
+            histograms['latency'].observe(total)
+            histograms['db'].observe(timings.db)
+            histograms['serialize'].observe(timings.serialize)
+            histograms['render'].observe(timings.render)
+            histograms['queries'].observe(timings.queries)
+            if status >= 500:
+                histograms['errors'] += 1
+
+    def collect(self):
+        with self._lock:
+            families = {
+                'http_request_duration_seconds': ('histogram', "Request latency by route.", []),
+                'http_request_db_seconds': ('histogram', "Time spent in database queries per request.", []),
+                'http_request_serialize_seconds': ('histogram', "Time spent in serializers per request.", []),
+                'http_request_render_seconds': ('histogram', "Time spent rendering responses per request.", []),
+                'http_request_queries': ('histogram', "Database queries per request.", []),
+                'http_request_errors_total': ('counter', "Responses with a 5xx status.", []),
+            }
+            for (method, route), histograms in self._routes.items():
+                labels = {'method': method, 'route': route}
+                for name, key in (
+                    ('http_request_duration_seconds', 'latency'), ('http_request_db_seconds', 'db'),
+                    ('http_request_serialize_seconds', 'serialize'), ('http_request_render_seconds', 'render'),
+                    ('http_request_queries', 'queries'),
+                ):
+                    families[name][2].extend(histograms[key].samples(name, labels))
+                families['http_request_errors_total'][2].append(('http_request_errors_total', labels, histograms['errors']))
+        for name, (kind, help, samples) in families.items():
+            yield name, kind, help, samples
+
+
+route_metrics = RouteMetrics()
+
+_collectors = [route_metrics.collect]
+
+
+def register_collector(collect):
+    """
+    Add a source of metrics to MetricsView. `collect()` yields
+    (name, type, help, samples), samples being (sample_name, labels, value).
+    """
+    _collectors.append(collect)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render_metrics():
+    lines = []
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+                lines.append(f'{sample_name}{{{label_text}}} {value}' if label_text else f'{sample_name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class PerformanceMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _install_serializer_timing()
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(_time_query))
+                response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        total = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match else 'unmatched'
+        route_metrics.observe(request.method, route, response.status_code, total, timings)
+
+        if SERVER_TIMING_HEADER:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={timings.db * 1000:.2f};desc="{timings.queries} queries"',
+                f'serialize;dur={timings.serialize * 1000:.2f}',
+                f'render;dur={timings.render * 1000:.2f}',
+                f'total;dur={total * 1000:.2f}',
+            ])
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses render right after this hook returns
+        timings = _timings.get()
+        if timings is not None:
+            timings.render_start = time.perf_counter()
+
+            def rendered(response):
+                timings.render = time.perf_counter() - timings.render_start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+
+class MetricsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -51,6 +51,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'arsongsapi.instrumentation.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -93,6 +94,22 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/ref/settings/#caches
+#
+# songs.versions keeps its version counters in the default cache, and ETags,
+# cached responses and cached token authentication are only invalidated
+# through them. With more than one worker process the default cache must be
+# shared by all of them (Redis, Memcached, the database cache); the default
+# LocMemCache is per process, so CachedTokenAuthentication stops caching and
+# `manage.py check --deploy` warns about it.
+
+CACHES = CONFIG.get("CACHES", {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+})
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -135,7 +152,15 @@ STATIC_URL = CONFIG['STATIC_URL']
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-REST_FRAMEWORK = CONFIG["REST_FRAMEWORK"]
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': ['rest_framework.authentication.TokenAuthentication'],
+    **CONFIG["REST_FRAMEWORK"],
+}
+# CachedTokenAuthentication accepts every key TokenAuthentication does, plus device tokens
+REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES'] = [
+    'accounts.authentication.CachedTokenAuthentication' if name == 'rest_framework.authentication.TokenAuthentication' else name
+    for name in REST_FRAMEWORK['DEFAULT_AUTHENTICATION_CLASSES']
+]
 
 STATIC_ROOT = CONFIG['COLLECT_STATIC_PATH']
 CORS_ALLOWED_ORIGINS = CONFIG['CORS_ALLOWED_ORIGINS']
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.urls import path, include
+from .instrumentation import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),  # Admin panel
@@ -7,4 +8,5 @@ urlpatterns = [
     path('auth/', include('accounts.urls')),  # Include the URLs from the songs app
     path('song-requests/', include('songrequest.urls')),  # Include the URLs from the songs app
     path('share/', include('share.urls')),  # Include the URLs from the songs app
+    path('metrics', MetricsView.as_view(), name='metrics'),  # Staff-only per-route performance metrics
 ]
@@ -0,0 +1,41 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from share.pages import PAGE_PATHS, SHARE_PAGES_DIR, page_file, render_all
+
+
+class Command(BaseCommand):
+    help = "Pre-render the Open Graph share pages of every song, playlist, artist and album to static files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output', type=str, default=SHARE_PAGES_DIR,
+            help="Directory to write pages to, laid out like the share/ URLs (defaults to SHARE_PAGES_DIR)."
+        )
+        parser.add_argument(
+            '--kinds', type=str, default=','.join(PAGE_PATHS),
+            help="Comma separated kinds to render, among SONG, PLAYLIST, ARTIST and ALBUM."
+        )
+
+    def handle(self, *args, **kwargs):
+        output = kwargs['output']
+        if not output:
+            raise CommandError("Pass --output or set SHARE_PAGES_DIR.")
+        kinds = [kind.strip().upper() for kind in kwargs['kinds'].split(',')]
+        unknown = set(kinds) - set(PAGE_PATHS)
+        if unknown:
+            raise CommandError(f"Unknown kinds: {', '.join(sorted(unknown))}")
+
+        for kind in kinds:
+            start = time.perf_counter()
+            os.makedirs(os.path.join(output, PAGE_PATHS[kind]), exist_ok=True)
+            rendered = 0
+            for id, html in render_all(kind):
+                path = page_file(output, kind, id)
+                # Write then rename so the proxy never serves a partial page
+                with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                    f.write(html)
+                os.replace(f"{path}.tmp", path)
+                rendered += 1
+            elapsed = time.perf_counter() - start
+            self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} {kind.lower()} pages in {elapsed:.2f}s."))
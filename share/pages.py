@@ -0,0 +1,128 @@
+import os
+from django.core.cache import cache
+from django.db.models import Count, Prefetch
+from config import CONFIG
+from songs.models import Song, SongArtist, Playlist, PlaylistSummary, Artist, Album
+
+from .helpers import GET_APP_REDIRECT_URI, GET_SRC_URI, SHARE_API_MAPS, make_og_tags, format_time
+
+# Rendered Open Graph pages, cached per (kind, id) and dropped by share.signals
+# whenever the rows a page is built from change. When SHARE_PAGES_DIR is set,
+# the render_share_pages command writes the same pages there for a front proxy
+# to serve, and invalidation removes the stale file so the proxy falls back to
+# the app until the next render.
+
+SHARE_PAGE_TIMEOUT = CONFIG.get("SHARE_PAGE_TIMEOUT", 24 * 60 * 60)
+SHARE_PAGES_DIR = CONFIG.get("SHARE_PAGES_DIR")
+
+# URL path of each kind under share/, as in share.urls
+PAGE_PATHS = {
+    "SONG": "content/songs",
+    "PLAYLIST": "content/playlists",
+    "ARTIST": "content/artists",
+    "ALBUM": "content/albums",
+}
+
+
+def song_meta(song):
+    first_artist = next(iter(song.song_artists.all()), None)
+    return {
+        "title": song.original_name,
+        "description": f"{song.album.title} • {song.album.year} • {first_artist.artist.name if first_artist else ''} • {format_time(song.duration)}",
+        "image": GET_SRC_URI(song.album.thumbnail300x300),
+        "type": "music.song",
+    }
+
+
+def playlist_meta(playlist):
+    summary = PlaylistSummary.for_playlist(playlist)
+    return {
+        "title": playlist.name,
+        "description": f"Playlist • {summary.songs_count} songs • {playlist.privacy_type} • @{playlist.user.username}",
+        "image": GET_SRC_URI(summary.thumbnail or ""),
+        "type": "music.playlist",
+    }
+
+
+def artist_meta(artist):
+    return {
+        "title": artist.name,
+        "description": f"Artist • {artist.songs_count} songs • 0 followers",
+        "image": GET_SRC_URI(artist.thumbnail300x300),
+        "type": "music.artist",
+    }
+
+
+def album_meta(album):
+    return {
+        "title": album.title,
+        "description": f"Album • {album.songs_count} songs • 0 followers",
+        "image": GET_SRC_URI(album.thumbnail300x300),
+        "type": "music.album",
+    }
+
+
+# Each kind loads everything its page needs in one query (two for songs)
+PAGE_SOURCES = {
+    "SONG": (lambda: Song.objects.select_related('album').prefetch_related(
+        Prefetch('song_artists', queryset=SongArtist.objects.select_related('artist').order_by('id'))
+    ), song_meta),
+    "PLAYLIST": (lambda: Playlist.objects.select_related('user', 'summary'), playlist_meta),
+    "ARTIST": (lambda: Artist.objects.annotate(songs_count=Count('artist_songs')), artist_meta),
+    "ALBUM": (lambda: Album.objects.annotate(songs_count=Count('songs')), album_meta),
+}
+
+
+def _cache_key(kind, id):
+    return f"share:{kind}:{id}"
+
+
+def _render(kind, obj):
+    meta = PAGE_SOURCES[kind][1](obj)
+    meta["url"] = GET_APP_REDIRECT_URI(SHARE_API_MAPS[kind](obj.id))
+    return make_og_tags(meta)
+
+
+def get_page(kind, id):
+    """Return the OG page of one song, playlist, artist or album, or None if it does not exist."""
+    key = _cache_key(kind, id)
+    html = cache.get(key)
+    if html is not None:
+        return html
+
+    obj = PAGE_SOURCES[kind][0]().filter(id=id).first()
+    if obj is None:
+        return None
+    html = _render(kind, obj)
+    cache.set(key, html, SHARE_PAGE_TIMEOUT)
+    return html
+
+
+def render_all(kind, batch_size=1000):
+    """Yield (id, html) for every object of `kind`, rendering in id order batches."""
+    queryset = PAGE_SOURCES[kind][0]().order_by('id')
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        for obj in batch:
+            yield obj.id, _render(kind, obj)
+        last_id = batch[-1].id
+
+
+def page_file(directory, kind, id):
+    return os.path.join(directory, PAGE_PATHS[kind], f"{id}.html")
+
+
+def invalidate(kind, ids):
+    ids = list(ids)
+    if not ids:
+        return
+    cache.delete_many([_cache_key(kind, id) for id in ids])
+    if SHARE_PAGES_DIR:
+        for id in ids:
+            try:
+                os.remove(page_file(SHARE_PAGES_DIR, kind, id))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from songs.models import Album, Artist, Song, SongArtist, Playlist, PlaylistSummary
+from songs.signals import playlist_songs_changed, is_counter_update
+
+from .pages import invalidate
+
+
+def invalidate_on_commit(kind, ids):
+    # Dropped after commit so a concurrent request cannot re-cache the old rows
+    ids = list(ids)
+    transaction.on_commit(lambda: invalidate(kind, ids))
+
+
+@receiver(post_save, sender=Song)
+@receiver(post_delete, sender=Song)
+def song_changed(sender, instance, update_fields=None, **kwargs):
+    if is_counter_update(update_fields):
+        return
+    invalidate_on_commit("SONG", [instance.id])
+    invalidate_on_commit("ALBUM", [instance.album_id])
+
+@receiver(post_save, sender=SongArtist)
+@receiver(post_delete, sender=SongArtist)
+def song_artist_changed(sender, instance, **kwargs):
+    invalidate_on_commit("SONG", [instance.song_id])
+    invalidate_on_commit("ARTIST", [instance.artist_id])
+
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Album)
+def album_changed(sender, instance, **kwargs):
+    invalidate_on_commit("ALBUM", [instance.id])
+    if kwargs.get('signal') is post_save:
+        invalidate_on_commit("SONG", instance.songs.values_list('id', flat=True))
+
+@receiver(post_save, sender=Artist)
+@receiver(post_delete, sender=Artist)
+def artist_changed(sender, instance, **kwargs):
+    invalidate_on_commit("ARTIST", [instance.id])
+    if kwargs.get('signal') is post_save:
+        invalidate_on_commit("SONG", instance.artist_songs.values_list('song_id', flat=True))
+
+@receiver(post_save, sender=Playlist)
+@receiver(post_delete, sender=Playlist)
+@receiver(post_save, sender=PlaylistSummary)
+def playlist_changed(sender, instance, **kwargs):
+    invalidate_on_commit("PLAYLIST", [instance.pk if sender is Playlist else instance.playlist_id])
+
+@receiver(playlist_songs_changed)
+def playlist_songs_updated(sender, playlist_id, **kwargs):
+    invalidate_on_commit("PLAYLIST", [playlist_id])
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created=False, **kwargs):
+    # Playlist pages show the owner's username
+    if not created:
+        invalidate_on_commit("PLAYLIST", instance.playlists.values_list('id', flat=True))
@@ -1,20 +1,35 @@
 from typing import Any
 from django.contrib import admin
 from django.http.request import HttpRequest
-from .models import Album, Artist, Tag, Song, SongArtist, SongTag, UserSongHistory, UserLikedSong, Playlist, PlaylistSong
+from .models import Album, Artist, Tag, Song, SongArtist, SongTag, UserSongHistory, UserLikedSong, Playlist, PlaylistSong, AssetJob
 from django.utils.safestring import mark_safe
 from config import CONFIG
 from .admin_forms import SongAdminForm, AlbumAdminForm, ArtistAdminForm
+from .assets import refresh_asset_status
+from .versions import bump_version, user_scope
+from django.utils.timezone import now
+
+class UserSongAdminMixin:
+    """Likes and history deletes skip model signals; move the owners' versions here."""
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_version(user_scope(obj.user_id))
+
+    def delete_queryset(self, request, queryset):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        bump_version(*(user_scope(user_id) for user_id in user_ids))
 
 # Register Album model
 @admin.register(UserSongHistory)
-class UserSongHistoryAdmin(admin.ModelAdmin):
+class UserSongHistoryAdmin(UserSongAdminMixin, admin.ModelAdmin):
     list_display = ['user__username', 'song__original_name', 'accessed_at', 'count']
     sortable_by = ['accessed_at', 'count']
     readonly_fields = ['user', 'song', 'accessed_at', 'count']
 
 @admin.register(UserLikedSong)
-class UserLikedSongAdmin(admin.ModelAdmin):
+class UserLikedSongAdmin(UserSongAdminMixin, admin.ModelAdmin):
     list_display = ['user__username', 'song__original_name', 'liked_at']
     sortable_by = ['liked_at']
     readonly_fields = ['user', 'song', 'liked_at']
@@ -23,19 +38,20 @@ class UserLikedSongAdmin(admin.ModelAdmin):
 @admin.register(Album)
 class AlbumAdmin(admin.ModelAdmin):
     form = AlbumAdminForm
-    list_display = ['code', 'title', 'year', 'custom_thumbnail300x300', 'custom_thumbnail1200x1200']
+    list_display = ['code', 'title', 'year', 'custom_thumbnail300x300', 'custom_thumbnail1200x1200', 'asset_status']
+    list_filter = ['asset_status']
     search_fields = ['title', 'code']
 
     def get_fields(self, request, obj=None):
         if obj:  # Editing or viewing an existing Album
-            return ['code', 'title', 'year', 'thumbnail300x300', 'thumbnail1200x1200', 'custom_thumbnailpreview']
+            return ['code', 'title', 'year', 'thumbnail300x300', 'thumbnail1200x1200', 'custom_thumbnailpreview', 'asset_status']
         else:  # Adding a new Album
             return ['code', 'title', 'year', 'image_file']  # image_file should be included when creating
 
         
     def get_readonly_fields(self, request, obj):
         if obj:  # Editing or viewing an existing Song
-            return ['code', 'title', 'year', 'thumbnail300x300', 'thumbnail1200x1200', 'custom_thumbnailpreview']
+            return ['code', 'title', 'year', 'thumbnail300x300', 'thumbnail1200x1200', 'custom_thumbnailpreview', 'asset_status']
         else:  # Adding a new Song
             return ['thumbnail300x300', 'thumbnail1200x1200', 'custom_thumbnailpreview']
 
@@ -63,19 +79,20 @@ class AlbumAdmin(admin.ModelAdmin):
 @admin.register(Artist)
 class ArtistAdmin(admin.ModelAdmin):
     form = ArtistAdminForm
-    list_display = ['name', 'custom_thumbnail300x300', 'custom_thumbnail1200x1200']
+    list_display = ['name', 'custom_thumbnail300x300', 'custom_thumbnail1200x1200', 'asset_status']
+    list_filter = ['asset_status']
     search_fields = ['name']
 
     def get_fields(self, request, obj=None):
         if obj:  # Editing or viewing an existing Album
-            return ['name', 'thumbnail300x300', 'thumbnail1200x1200', 'custom_thumbnailpreview']
+            return ['name', 'thumbnail300x300', 'thumbnail1200x1200', 'custom_thumbnailpreview', 'asset_status']
         else:  # Adding a new Album
             return ['name', 'image_file']
 
         
     def get_readonly_fields(self, request, obj):
         if obj:  # Editing or viewing an existing Song
-            return ['name', 'thumbnail300x300', 'thumbnail1200x1200', 'custom_thumbnailpreview']
+            return ['name', 'thumbnail300x300', 'thumbnail1200x1200', 'custom_thumbnailpreview', 'asset_status']
         else:  # Adding a new Song
             return ['thumbnail300x300', 'thumbnail1200x1200', 'custom_thumbnailpreview']
 
@@ -118,20 +135,21 @@ class SongTagInline(admin.TabularInline):
 @admin.register(Song)
 class SongAdmin(admin.ModelAdmin):
     form = SongAdminForm
-    list_display = ['original_name', 'album_name', 'album__year', 'custom_url', 'count', 'liked_count']  # Add 'artist_names' to list_display
+    list_display = ['original_name', 'album_name', 'album__year', 'custom_url', 'count', 'liked_count', 'asset_status']  # Add 'artist_names' to list_display
+    list_filter = ['asset_status']
     search_fields = ['original_name']
     sortable_by = ['original_name', 'album__year', 'count', 'liked_count']
     inlines = [SongArtistInline, SongTagInline]  # Show SongArtists and SongTags as inlines
 
     def get_fields(self, request, obj=None):
         if obj:  # Editing or viewing an existing Song
-            return ['title', 'original_name', 'album_name', 'custom_lyrics', 'url', 'audio_preview', 'duration']
+            return ['title', 'original_name', 'album_name', 'custom_lyrics', 'url', 'audio_preview', 'duration', 'asset_status']
         else:  # Adding a new Song
             return ['original_name', 'album', 'mp3_file', 'duration']
         
     def get_readonly_fields(self, request, obj):
         if obj:  # Editing or viewing an existing Song
-            return ['audio_preview', 'custom_lyrics', 'title', 'url', 'original_name', 'album_name', 'count', 'duration']
+            return ['audio_preview', 'custom_lyrics', 'title', 'url', 'original_name', 'album_name', 'count', 'duration', 'asset_status']
         else:  # Adding a new Song
             return ['count', 'liked_count']
 
@@ -175,4 +193,19 @@ class PlaylistAdmin(admin.ModelAdmin):
 
 @admin.register(PlaylistSong)
 class PlaylistAdmin(admin.ModelAdmin):
-    list_display = ('playlist__name', 'song__original_name', 'playlist__user__username')
\ No newline at end of file
+    list_display = ('playlist__name', 'song__original_name', 'playlist__user__username')
+
+@admin.register(AssetJob)
+class AssetJobAdmin(admin.ModelAdmin):
+    list_display = ('path', 'operation', 'entity', 'object_id', 'status', 'attempts', 'next_attempt_at', 'updated_at')
+    list_filter = ('status', 'operation', 'entity')
+    search_fields = ('path',)
+    readonly_fields = ('entity', 'object_id', 'operation', 'path', 'spool_path', 'message', 'attempts', 'last_error', 'created_at', 'updated_at')
+    actions = ['retry_jobs']
+
+    @admin.action(description="Retry selected jobs now")
+    def retry_jobs(self, request, queryset):
+        jobs = list(queryset.exclude(status='Done').values_list('entity', 'object_id').distinct())
+        queryset.exclude(status='Done').update(status='Pending', attempts=0, next_attempt_at=now())
+        for entity, object_id in jobs:
+            refresh_asset_status(entity, object_id)
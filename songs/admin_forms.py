@@ -1,13 +1,60 @@
-from github import Github
+import logging
 from django import forms
 from django.core.validators import FileExtensionValidator
 from .models import Song, Album, Artist
-from config import CONFIG
-from PIL import Image
-import os
-from io import BytesIO
-
-class SongAdminForm(forms.ModelForm):
+from .assets import spool, enqueue_uploads
+from .images import build_derivatives, open_square
+from .mp3 import Mp3Probe, Mp3Error
+from urllib.parse import unquote
+
+logger = logging.getLogger(__name__)
+
+class AssetUploadFormMixin:
+    """
+    Spools uploaded files during save() and queues them for the
+    process_asset_uploads worker once the row has been saved.
+    """
+
+    def spool_assets(self, instance, files):
+        # files: [(function giving the storage path of the saved instance, content, commit message)]
+        self.spooled_assets = [(path_for, spool(content), message) for path_for, content, message in files]
+        instance.asset_status = 'Pending'
+
+    def _save_m2m(self):
+        # Runs after the instance is saved, on commit=True and from the admin's save_related
+        super()._save_m2m()
+        files = getattr(self, 'spooled_assets', None)
+        if files:
+            enqueue_uploads(self.instance, [
+                (path_for(self.instance), spool_path, message) for path_for, spool_path, message in files
+            ])
+            self.spooled_assets = []
+
+    def spool_thumbnails(self, instance, derivatives):
+        instance.thumbnail_sizes = sorted({size for size, format in derivatives.files})
+        self.spool_assets(instance, [
+            (
+                lambda obj, size=size, format=format: obj.thumbnail_path(size, format),
+                content,
+                f"Upload {size}x{size} {format} thumbnail of {instance}",
+            )
+            for (size, format), content in derivatives.files.items()
+        ])
+
+    def clean_image_file(self):
+        image_file = self.cleaned_data.get('image_file')
+        if image_file:
+            try:
+                open_square(image_file.read())
+            except ValueError as e:
+                raise forms.ValidationError(str(e))
+            except Exception:
+                raise forms.ValidationError("The uploaded file is not a valid image.")
+            finally:
+                image_file.seek(0)
+        return image_file
+
+class SongAdminForm(AssetUploadFormMixin, forms.ModelForm):
     mp3_file = forms.FileField(
         required=False,
         label="Upload MP3 File",
@@ -24,40 +71,37 @@ class SongAdminForm(forms.ModelForm):
         # Handle the MP3 file upload
         mp3_file = self.cleaned_data.get('mp3_file')
         if mp3_file:
-            # Prepare the custom filename
-            album_code = instance.album.code  # Assuming the album model has a `code` field
-            filename = f"{album_code} - {instance.original_name}.mp3"
-
-            # Prepare GitHub API details
-            github_token = CONFIG["GITHUB_TOKEN"]
-            branch_name = CONFIG["BRANCH_NAME"]
-            github_repo_name = CONFIG["GITHUB_REPO_NAME"]
-            github = Github(github_token)
-            repo = github.get_user().get_repo(github_repo_name)
-
-            # Prepare file content and path
-            file_path = f'songs-file/{filename}'
-            content = mp3_file.read()  # Ensure proper encoding for binary files
-
-            # Upload to GitHub
-            try:
-                repo.create_file(
-                    path=file_path,
-                    message=f"Upload MP3 file {filename}",
-                    content=content,
-                    branch=branch_name
-                )
-                print(f"Successfully uploaded {filename} to GitHub at {file_path}")
-            except Exception as e:
-                print(f"Failed to upload {filename} to GitHub: {e}")
+            # The file lands at the path Song.set_file_paths gives it once the song is saved
+            filename = f"{instance.album.code} - {instance.original_name}.mp3"
+            self.spool_assets(instance, [(lambda song: unquote(song.url), mp3_file.chunks(), f"Upload MP3 file {filename}")])
+            # Read in clean_mp3_file, which rejects files without a duration
+            instance.duration = round(self.mp3_info.duration, 3)
+            instance.bitrate = self.mp3_info.bitrate
+            instance.content_hash = self.mp3_info.content_hash
 
         # Save the instance to generate an ID if not already present
         if commit:
             instance.save()  # Save the instance first to generate the ID
+            self._save_m2m()  # Queues the spooled upload
 
         return instance
 
-class AlbumAdminForm(forms.ModelForm):
+    def clean_mp3_file(self):
+        mp3_file = self.cleaned_data.get('mp3_file')
+        if mp3_file:
+            # The whole upload is hashed; only the tag header and the first frames are kept
+            probe = Mp3Probe()
+            for chunk in mp3_file.chunks():
+                probe.update(chunk)
+            try:
+                self.mp3_info = probe.finish()
+            except Mp3Error:
+                raise forms.ValidationError("The uploaded file is not a valid MP3.")
+            finally:
+                mp3_file.seek(0)
+        return mp3_file
+
+class AlbumAdminForm(AssetUploadFormMixin, forms.ModelForm):
     image_file = forms.FileField(
         required=False,
         label="Upload Image File (1:1 aspect ratio)",
@@ -74,64 +118,18 @@ class AlbumAdminForm(forms.ModelForm):
         # Handle the image file upload
         image_file = self.cleaned_data.get('image_file')
         if image_file:
-            # Open the image
-            img = Image.open(image_file)
-
-            # Ensure the image has a 1:1 aspect ratio
-            width, height = img.size
-            if width != height:
-                raise ValueError("The uploaded image must have a 1:1 aspect ratio.")
-
-            # Resizing logic
-            target_sizes = [(300, 300), (1200, 1200)]
-            buffers = {}
-
-            for size in target_sizes:
-                resized_img = img.copy()
-
-                # Resize image to the exact dimensions
-                resized_img = resized_img.resize(size, Image.Resampling.LANCZOS)
-                
-                # Save resized image to buffer
-                buffer = BytesIO()
-                resized_img.save(buffer, format='PNG')
-                buffer.seek(0)  # Reset buffer position
-                buffers[size] = buffer
-
-            # Upload to GitHub
-            github_token = CONFIG["GITHUB_TOKEN"]
-            branch_name = CONFIG["BRANCH_NAME"]
-            github_repo_name = CONFIG["GITHUB_REPO_NAME"]
-
-            github = Github(github_token)
-            repo = github.get_user().get_repo(github_repo_name)
-
-            _, extension = os.path.splitext(image_file.name)
-            filename = f'{instance.code} - {instance.title} ({instance.year}).png'
-
-            for size, buffer in buffers.items():
-                file_path = f'album-images/{size[0]}x{size[1]}/{filename}'
-                buffer.seek(0)  # Ensure buffer is at the start for reading
-                content = buffer.read()
-
-                try:
-                    repo.create_file(
-                        path=file_path,
-                        message=f"Upload {os.path.basename(file_path)}",
-                        content=content,
-                        branch=branch_name
-                    )
-                    print(f"Successfully uploaded {file_path} to GitHub.")
-                except Exception as e:
-                    print(f"Failed to upload {file_path} to GitHub: {e}")
+            derivatives = build_derivatives(image_file.read())
+            logger.info("Rendered thumbnails of %s: %s", image_file.name, derivatives.summary())
+            self.spool_thumbnails(instance, derivatives)
 
         # Save the instance
         if commit:
             instance.save()
+            self._save_m2m()
         return instance
 
 
-class ArtistAdminForm(forms.ModelForm):
+class ArtistAdminForm(AssetUploadFormMixin, forms.ModelForm):
     image_file = forms.FileField(
         required=False,
         label="Upload Image File (1:1 aspect ratio)",
@@ -148,58 +146,12 @@ class ArtistAdminForm(forms.ModelForm):
         # Handle the image file upload
         image_file = self.cleaned_data.get('image_file')
         if image_file:
-            # Open the image
-            img = Image.open(image_file)
-
-            # Ensure the image has a 1:1 aspect ratio
-            width, height = img.size
-            if width != height:
-                raise ValueError("The uploaded image must have a 1:1 aspect ratio.")
-
-            # Resizing logic
-            target_sizes = [(300, 300), (1200, 1200)]
-            buffers = {}
-
-            for size in target_sizes:
-                resized_img = img.copy()
-
-                # Resize image to the exact dimensions
-                resized_img = resized_img.resize(size, Image.Resampling.LANCZOS)
-                
-                # Save resized image to buffer
-                buffer = BytesIO()
-                resized_img.save(buffer, format='PNG')
-                buffer.seek(0)  # Reset buffer position
-                buffers[size] = buffer
-
-            # Upload to GitHub
-            github_token = CONFIG["GITHUB_TOKEN"]
-            branch_name = CONFIG["BRANCH_NAME"]
-            github_repo_name = CONFIG["GITHUB_REPO_NAME"]
-
-            github = Github(github_token)
-            repo = github.get_user().get_repo(github_repo_name)
-
-            _, extension = os.path.splitext(image_file.name)
-            filename = f'{instance.name}.png'
-
-            for size, buffer in buffers.items():
-                file_path = f'artist-images/{size[0]}x{size[1]}/{filename}'
-                buffer.seek(0)  # Ensure buffer is at the start for reading
-                content = buffer.read()
-
-                try:
-                    repo.create_file(
-                        path=file_path,
-                        message=f"Upload {os.path.basename(file_path)}",
-                        content=content,
-                        branch=branch_name
-                    )
-                    print(f"Successfully uploaded {file_path} to GitHub.")
-                except Exception as e:
-                    print(f"Failed to upload {file_path} to GitHub: {e}")
+            derivatives = build_derivatives(image_file.read())
+            logger.info("Rendered thumbnails of %s: %s", image_file.name, derivatives.summary())
+            self.spool_thumbnails(instance, derivatives)
 
         # Save the instance
         if commit:
             instance.save()
+            self._save_m2m()
         return instance
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class SongsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'songs'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import build_missing_tables
+        post_migrate.connect(build_missing_tables, sender=self)
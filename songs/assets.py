@@ -0,0 +1,334 @@
+import logging
+import os
+import posixpath
+import random
+import threading
+import uuid
+from datetime import timedelta
+from urllib.parse import quote, unquote
+
+import requests
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils.timezone import now
+from github import Github, GithubException, InputGitTreeElement
+from config import CONFIG
+
+from .models import Album, Artist, Song, AssetJob
+from .images import THUMBNAIL_SIZES, IMAGE_FORMATS
+from .versions import CATALOG, bump_version, album_scope, artist_scope
+from . import catalog
+
+# Files uploaded through the admin are spooled here until a worker stores them
+ASSET_SPOOL_DIR = CONFIG.get("ASSET_SPOOL_DIR", "asset_spool")
+# "github" stores assets in the GitHub repo served from SRC_URI, "local" under ASSET_LOCAL_DIR
+ASSET_STORAGE = CONFIG.get("ASSET_STORAGE", "github")
+ASSET_LOCAL_DIR = CONFIG.get("ASSET_LOCAL_DIR", "assets")
+
+ASSET_UPLOAD_MAX_ATTEMPTS = CONFIG.get("ASSET_UPLOAD_MAX_ATTEMPTS", 6)
+ASSET_RETRY_BASE_DELAY = CONFIG.get("ASSET_RETRY_BASE_DELAY", 30)
+ASSET_RETRY_MAX_DELAY = CONFIG.get("ASSET_RETRY_MAX_DELAY", 60 * 60)
+# Deletions removed from storage in one commit
+ASSET_DELETE_BATCH_SIZE = CONFIG.get("ASSET_DELETE_BATCH_SIZE", 500)
+
+logger = logging.getLogger(__name__)
+
+ENTITY_MODELS = {'song': Song, 'album': Album, 'artist': Artist}
+SCOPES = {'album': album_scope, 'artist': artist_scope}
+
+
+class GithubAssetStorage:
+    """Assets committed to the GitHub repo; one client is shared by every upload."""
+
+    def __init__(self, token=None, repo_name=None, branch=None):
+        self.token = token or CONFIG["GITHUB_TOKEN"]
+        self.repo_name = repo_name or CONFIG["GITHUB_REPO_NAME"]
+        self.branch = branch or CONFIG["BRANCH_NAME"]
+        self._repo = None
+        self._lock = threading.Lock()
+
+    @property
+    def repo(self):
+        with self._lock:
+            if self._repo is None:
+                self._repo = Github(self.token).get_user().get_repo(self.repo_name)
+            return self._repo
+
+    def put(self, path, content, message):
+        try:
+            self.repo.create_file(path=path, message=message, content=content, branch=self.branch)
+        except GithubException as e:
+            # 422: the file exists, e.g. an earlier attempt succeeded but was not recorded
+            if e.status != 422:
+                raise
+            existing = self.repo.get_contents(path, ref=self.branch)
+            self.repo.update_file(path, message, content, existing.sha, branch=self.branch)
+
+    def get(self, path):
+        # Served from SRC_URI; the contents API does not return files over 1 MB
+        response = requests.get(f'{CONFIG["SRC_URI"]}{quote(path)}', timeout=30)
+        response.raise_for_status()
+        return response.content
+
+    def get_range(self, path, start, length):
+        """`length` bytes of a file from `start`, and the size of the whole file."""
+        response = requests.get(
+            f'{CONFIG["SRC_URI"]}{quote(path)}', headers={'Range': f'bytes={start}-{start + length - 1}'}, timeout=30
+        )
+        response.raise_for_status()
+        if response.status_code == 206:
+            # Content-Range: bytes 0-65535/4012345
+            return response.content, int(response.headers['Content-Range'].rsplit('/', 1)[1])
+        # The server ignored the range and sent the whole file
+        return response.content[start:start + length], len(response.content)
+
+    def delete_many(self, paths, message):
+        """
+        Remove `paths` in a single commit through the Git data API, falling
+        back to one commit per file in path order. Files already gone count
+        as deleted. Returns {path: error} for the files that could not be removed.
+        """
+        for attempt in range(2):
+            try:
+                self._delete_in_one_commit(paths, message)
+                return {}
+            except GithubException as e:
+                # 422 also covers the branch moving between reading and updating the ref
+                logger.warning("Failed to delete %d files in one commit (attempt %d): %s", len(paths), attempt + 1, e)
+
+        failures = {}
+        for path in sorted(paths):
+            try:
+                existing = self.repo.get_contents(path, ref=self.branch)
+                self.repo.delete_file(path, message, existing.sha, branch=self.branch)
+            except GithubException as e:
+                if e.status != 404:
+                    failures[path] = e
+            except Exception as e:
+                failures[path] = e
+        return failures
+
+    def _delete_in_one_commit(self, paths, message):
+        ref = self.repo.get_git_ref(f"heads/{self.branch}")
+        parent = self.repo.get_git_commit(ref.object.sha)
+        # Removing a path that is not in the tree fails the whole request, e.g. a
+        # WebP thumbnail of an image uploaded before they were written
+        paths = self._existing_paths(parent.tree, paths)
+        if not paths:
+            return
+        # A tree entry with a null sha removes the path from the base tree
+        tree = self.repo.create_git_tree(
+            [InputGitTreeElement(path, '100644', 'blob', sha=None) for path in paths],
+            base_tree=parent.tree,
+        )
+        if tree.sha == parent.tree.sha:
+            return
+        commit = self.repo.create_git_commit(message, tree, [parent])
+        ref.edit(commit.sha)
+
+    def _existing_paths(self, root, paths):
+        # One tree listing per directory involved, instead of a lookup per file
+        listings = {}
+
+        def listing(directory):
+            if directory not in listings:
+                if directory:
+                    parent, name = posixpath.split(directory)
+                    sha = listing(parent).get(name)
+                else:
+                    sha = root.sha
+                listings[directory] = {entry.path: entry.sha for entry in self.repo.get_git_tree(sha).tree} if sha else {}
+            return listings[directory]
+
+        return [path for path in paths if posixpath.basename(path) in listing(posixpath.dirname(path))]
+
+
+class LocalAssetStorage:
+    """Assets written under a directory, for development and tests."""
+
+    def __init__(self, root=None):
+        self.root = root or ASSET_LOCAL_DIR
+
+    def put(self, path, content, message):
+        target = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(f"{target}.tmp", 'wb') as f:
+            f.write(content)
+        os.replace(f"{target}.tmp", target)
+
+    def get(self, path):
+        with open(os.path.join(self.root, path), 'rb') as f:
+            return f.read()
+
+    def get_range(self, path, start, length):
+        with open(os.path.join(self.root, path), 'rb') as f:
+            f.seek(start)
+            return f.read(length), os.fstat(f.fileno()).st_size
+
+    def delete_many(self, paths, message):
+        failures = {}
+        for path in sorted(paths):
+            try:
+                os.remove(os.path.join(self.root, path))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                failures[path] = e
+        return failures
+
+
+def get_storage():
+    if ASSET_STORAGE == "local":
+        return LocalAssetStorage()
+    return GithubAssetStorage()
+
+
+def spool(content):
+    """
+    Write uploaded bytes, or an iterable of byte chunks, to the spool
+    directory and return the spool file's path.
+    """
+    os.makedirs(ASSET_SPOOL_DIR, exist_ok=True)
+    spool_path = os.path.join(ASSET_SPOOL_DIR, uuid.uuid4().hex)
+    with open(f"{spool_path}.tmp", 'wb') as f:
+        for chunk in [content] if isinstance(content, bytes) else content:
+            f.write(chunk)
+    os.replace(f"{spool_path}.tmp", spool_path)
+    return spool_path
+
+
+def enqueue_uploads(instance, files):
+    """
+    Queue `files`, a list of (path, spool_path, message), for upload and mark
+    `instance` as pending. Call once the instance has been saved.
+    """
+    entity = instance._meta.model_name
+    AssetJob.objects.bulk_create([
+        AssetJob(entity=entity, object_id=instance.pk, path=path, spool_path=spool_path, message=message)
+        for path, spool_path, message in files
+    ])
+    type(instance).objects.filter(pk=instance.pk).update(asset_status='Pending')
+    instance.asset_status = 'Pending'
+
+
+def asset_paths(instance):
+    """Storage paths of the files belonging to a song, album or artist."""
+    if isinstance(instance, Song):
+        return [unquote(instance.url)] if instance.url else []
+    return [instance.thumbnail_path(size, format) for size in THUMBNAIL_SIZES for format in IMAGE_FORMATS]
+
+
+def queue_deletion(instance):
+    """
+    Queue removal of a deleted row's files. Called from post_delete, so the
+    jobs commit or roll back with the deletion; the worker removes every
+    queued path in one storage commit.
+    """
+    entity = instance._meta.model_name
+    if instance.asset_status == 'Pending':
+        # Uploads that have not run yet would only bring the files back
+        cancelled = AssetJob.objects.filter(entity=entity, object_id=instance.pk, operation='Upload', status='Pending')
+        spool_paths = list(cancelled.values_list('spool_path', flat=True))
+        if spool_paths:
+            cancelled.delete()
+            transaction.on_commit(lambda: _remove_spool_files(spool_paths))
+    AssetJob.objects.bulk_create([
+        AssetJob(entity=entity, object_id=instance.pk, operation='Delete', path=path, message=f"Delete {path}")
+        for path in asset_paths(instance)
+    ])
+
+
+def _remove_spool_files(spool_paths):
+    for spool_path in spool_paths:
+        try:
+            os.remove(spool_path)
+        except OSError:
+            pass
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, in seconds, after `attempts` failed tries."""
+    delay = min(ASSET_RETRY_MAX_DELAY, ASSET_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_due_jobs(limit, operation='Upload'):
+    """Mark up to `limit` due jobs of `operation` as running and return them."""
+    with transaction.atomic():
+        ids = list(
+            AssetJob.objects.filter(operation=operation, status='Pending', next_attempt_at__lte=now())
+            .order_by('next_attempt_at', 'id').values_list('id', flat=True)[:limit]
+        )
+        # Another worker may have claimed some of them in the meantime
+        AssetJob.objects.filter(id__in=ids, status='Pending').update(status='Running', updated_at=now())
+    return list(AssetJob.objects.filter(id__in=ids, status='Running'))
+
+
+def requeue_stale_jobs(older_than):
+    """Return jobs left running by a worker that died to the queue."""
+    return AssetJob.objects.filter(status='Running', updated_at__lt=now() - older_than).update(status='Pending')
+
+
+def upload(storage, job):
+    with open(job.spool_path, 'rb') as f:
+        storage.put(job.path, f.read(), job.message)
+
+
+def delete_files(storage, jobs):
+    """Remove the files of a batch of delete jobs; returns {path: error} for failures."""
+    paths = sorted({job.path for job in jobs})
+    noun = "file" if len(paths) == 1 else "files"
+    return storage.delete_many(paths, f"Delete {len(paths)} {noun}")
+
+
+def deletions_done(jobs):
+    """Mark delete jobs done in one query; their rows are gone, so there is no status to refresh."""
+    AssetJob.objects.filter(id__in=[job.id for job in jobs]).update(
+        status='Done', attempts=F('attempts') + 1, last_error='', updated_at=now()
+    )
+
+
+def job_succeeded(job):
+    job.status = 'Done'
+    job.attempts += 1
+    job.last_error = ''
+    job.save(update_fields=['status', 'attempts', 'last_error', 'updated_at'])
+    if job.spool_path:
+        _remove_spool_files([job.spool_path])
+    refresh_asset_status(job.entity, job.object_id)
+
+
+def job_failed(job, error, max_attempts=ASSET_UPLOAD_MAX_ATTEMPTS):
+    job.attempts += 1
+    job.last_error = str(error)
+    if job.attempts >= max_attempts:
+        job.status = 'Failed'
+    else:
+        job.status = 'Pending'
+        job.next_attempt_at = now() + timedelta(seconds=retry_delay(job.attempts))
+    job.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'updated_at'])
+    refresh_asset_status(job.entity, job.object_id)
+
+
+def refresh_asset_status(entity, object_id):
+    """Derive a row's asset_status from the latest job of each of its paths."""
+    model = ENTITY_MODELS.get(entity)
+    if model is None or object_id is None:
+        return
+    jobs = AssetJob.objects.filter(entity=entity, object_id=object_id)
+    # A retry or a new upload of a path supersedes its older jobs, failed ones included
+    latest_ids = jobs.values('path').annotate(latest_id=Max('id')).values('latest_id')
+    statuses = set(AssetJob.objects.filter(id__in=latest_ids).values_list('status', flat=True))
+    if 'Failed' in statuses:
+        status = 'Failed'
+    elif statuses - {'Done'}:
+        status = 'Pending'
+    else:
+        status = 'Ready'
+    changed = model.objects.filter(pk=object_id).exclude(asset_status=status).update(asset_status=status)
+    if changed and entity in SCOPES:
+        # Synced catalogs hold the thumbnail map, which follows asset_status
+        catalog.record_change(entity, object_id)
+    if changed and status == 'Ready' and entity in SCOPES:
+        # Serialized albums and artists switch to the new thumbnail ladder
+        bump_version(CATALOG, SCOPES[entity](object_id))
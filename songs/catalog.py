@@ -0,0 +1,174 @@
+import gzip
+import json
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils.timezone import now
+from config import CONFIG
+
+from .models import Album, Artist, Tag, Song, SongArtist, SongTag, CatalogChange
+
+# Whole-catalog sync for offline clients.
+#
+# Every write to an album, artist, tag or song appends a CatalogChange row
+# (songs.signals for admin writes, record_changes for bulk writes), and the id
+# of the newest row is the catalog version. A client downloads the snapshot,
+# the whole catalog as gzipped JSON with the version it was built at, and
+# then asks for the changes since that version to stay current. Rows are
+# lists in the column order of FIELDS, so the payload does not repeat keys.
+#
+# Bulk loads that would log one change per row record a Reset instead, and
+# clients whose version is older than a Reset, or older than what
+# prune_catalog_changes kept, have to download the snapshot again.
+
+SNAPSHOT_CACHE_TIMEOUT = CONFIG.get("CATALOG_SNAPSHOT_CACHE_TIMEOUT", 24 * 60 * 60)
+# Most change log rows read per changes request
+CHANGES_PAGE_SIZE = CONFIG.get("CATALOG_CHANGES_PAGE_SIZE", 5000)
+CHANGES_RETENTION_DAYS = CONFIG.get("CATALOG_CHANGES_RETENTION_DAYS", 90)
+
+# Keys of the entity sections in payloads
+SECTIONS = {'album': 'albums', 'artist': 'artists', 'tag': 'tags', 'song': 'songs'}
+# Columns of the rows in each section
+FIELDS = {
+    'albums': ['id', 'code', 'title', 'year', 'thumbnails'],
+    'artists': ['id', 'name', 'thumbnails'],
+    'tags': ['id', 'name'],
+    'songs': ['id', 'title', 'url', 'original_name', 'lyrics', 'album_id', 'duration', 'artist_ids', 'tag_ids'],
+}
+
+
+class ResyncRequired(Exception):
+    """The change log no longer covers the client's version."""
+
+
+def record_change(entity, object_id, operation='Upsert'):
+    CatalogChange.objects.create(entity=entity, object_id=object_id, operation=operation)
+
+
+def record_changes(entity, object_ids, operation='Upsert', batch_size=1000):
+    """Log a bulk write that skipped the model signals."""
+    CatalogChange.objects.bulk_create(
+        [CatalogChange(entity=entity, object_id=object_id, operation=operation) for object_id in object_ids],
+        batch_size=batch_size,
+    )
+
+
+def record_reset():
+    """Log a bulk load too large to describe row by row; clients download the snapshot again."""
+    CatalogChange.objects.create(operation='Reset')
+
+
+def current_version():
+    return CatalogChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def _album_rows(ids=None):
+    albums = Album.objects.order_by('id')
+    if ids is not None:
+        albums = albums.filter(id__in=ids)
+    return [[album.id, album.code, album.title, album.year, album.thumbnail_map()] for album in albums.iterator()]
+
+
+def _artist_rows(ids=None):
+    artists = Artist.objects.order_by('id')
+    if ids is not None:
+        artists = artists.filter(id__in=ids)
+    return [[artist.id, artist.name, artist.thumbnail_map()] for artist in artists.iterator()]
+
+
+def _tag_rows(ids=None):
+    tags = Tag.objects.order_by('id')
+    if ids is not None:
+        tags = tags.filter(id__in=ids)
+    return [list(row) for row in tags.values_list('id', 'name')]
+
+
+def _song_rows(ids=None):
+    songs = Song.objects.order_by('id')
+    song_artists = SongArtist.objects.order_by('id')
+    song_tags = SongTag.objects.order_by('id')
+    if ids is not None:
+        songs = songs.filter(id__in=ids)
+        song_artists = song_artists.filter(song_id__in=ids)
+        song_tags = song_tags.filter(song_id__in=ids)
+
+    artist_ids = defaultdict(list)
+    for song_id, artist_id in song_artists.values_list('song_id', 'artist_id').iterator():
+        artist_ids[song_id].append(artist_id)
+    tag_ids = defaultdict(list)
+    for song_id, tag_id in song_tags.values_list('song_id', 'tag_id').iterator():
+        tag_ids[song_id].append(tag_id)
+
+    return [
+        [*row, artist_ids.get(row[0], []), tag_ids.get(row[0], [])]
+        for row in songs.values_list('id', 'title', 'url', 'original_name', 'lyrics', 'album_id', 'duration').iterator()
+    ]
+
+
+ROWS = {'album': _album_rows, 'artist': _artist_rows, 'tag': _tag_rows, 'song': _song_rows}
+
+
+def build_snapshot(version):
+    """The whole catalog as gzipped JSON. Rows are read after `version`, so changes past it may show up twice."""
+    data = {'version': version, 'fields': FIELDS}
+    for entity, rows in ROWS.items():
+        data[SECTIONS[entity]] = rows()
+    return gzip.compress(json.dumps(data, separators=(',', ':')).encode(), compresslevel=6)
+
+
+def get_snapshot(version):
+    """The gzipped snapshot at `version`, built once per version."""
+    key = f"catalog_snapshot:{version}"
+    payload = cache.get(key)
+    if payload is None:
+        payload = build_snapshot(version)
+        cache.set(key, payload, SNAPSHOT_CACHE_TIMEOUT)
+    return payload
+
+
+def changes_since(version, limit=CHANGES_PAGE_SIZE):
+    """
+    Rows changed and ids deleted after `version`, from at most `limit` log
+    rows. Raises ResyncRequired when the log cannot bring `version` up to date.
+    """
+    changes = list(
+        CatalogChange.objects.filter(id__gt=version).order_by('id')
+        .values_list('id', 'entity', 'object_id', 'operation')[:limit + 1]
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    if changes and changes[0][0] != version + 1 and version < _oldest_version():
+        raise ResyncRequired()
+
+    # The last operation on a row wins
+    latest = {}
+    for change_id, entity, object_id, operation in changes:
+        if operation == 'Reset':
+            raise ResyncRequired()
+        latest[(entity, object_id)] = operation
+
+    upserted, deleted = defaultdict(list), defaultdict(list)
+    for (entity, object_id), operation in latest.items():
+        (upserted if operation == 'Upsert' else deleted)[entity].append(object_id)
+
+    return {
+        'version': changes[-1][0] if changes else version,
+        'has_more': has_more,
+        'fields': FIELDS,
+        'changed': {SECTIONS[entity]: ROWS[entity](ids) for entity, ids in upserted.items()},
+        'deleted': {SECTIONS[entity]: sorted(ids) for entity, ids in deleted.items()},
+    }
+
+
+def _oldest_version():
+    """Versions below the oldest kept log row minus one have lost changes to pruning."""
+    oldest = CatalogChange.objects.order_by('id').values_list('id', flat=True).first()
+    return oldest - 1 if oldest else 0
+
+
+def prune(days=CHANGES_RETENTION_DAYS):
+    """Drop log rows older than `days`, always keeping the newest so the version never goes back."""
+    newest = current_version()
+    deleted, _ = CatalogChange.objects.filter(created_at__lt=now() - timedelta(days=days), id__lt=newest).delete()
+    return deleted
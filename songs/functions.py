@@ -5,8 +5,16 @@
 #     return random.sample(CONFIG["slides"], 3)
 
 from config import CONFIG
+from django.core.cache import cache
 import random
 
+from .models import Song, PlaylistSummary
+from .serializers import SongSerializer
+from .versions import CATALOG, get_version
+
+# Seconds the most played songs are cached for; play counts do not bump the catalog version
+TOP_SONGS_TIMEOUT = CONFIG.get("TOP_SONGS_TIMEOUT", 300)
+
 def get_slides(request):
     interested_ids = CONFIG["interested_slide_ids"]
     slides = CONFIG["slides"]
@@ -22,3 +30,42 @@ def get_slides(request):
     selected_slides = interested_slides + random.sample(remaining_slides, num_to_pick)
 
     return selected_slides
+
+def get_latest_playlists(user, limit=12):
+    response_data = []
+
+    liked_songs = user.liked_songs.select_related('song__album')
+    liked_songs_count = liked_songs.count()
+    if (liked_songs_count):
+        response_data.append({
+            "id": "liked_songs",
+            "name": "Liked Songs",
+            "privacy_type": "Private",
+            "songs_count": liked_songs_count,
+            "thumbnail": liked_songs.first().song.album.thumbnail300x300
+        })
+        limit-=1
+
+    playlists = user.playlists.select_related('summary')[:limit]
+
+    for playlist in playlists:
+        summary = PlaylistSummary.for_playlist(playlist)
+        if (summary.songs_count):
+            response_data.append({
+                "id": playlist.id,
+                "name": playlist.name,
+                "privacy_type": playlist.privacy_type,
+                "songs_count": summary.songs_count,
+                "thumbnail": summary.thumbnail,
+            })
+    return response_data
+
+def get_top_songs(limit=12):
+    """Serialized most played songs, shared by every user and cached per catalog version."""
+    key = f"top_songs:{limit}:{get_version(CATALOG)}"
+    top_songs = cache.get(key)
+    if top_songs is None:
+        songs = SongSerializer.setup_eager_loading(Song.objects.order_by('-count', '-id'))[:limit]
+        top_songs = SongSerializer(songs, many=True).data
+        cache.set(key, top_songs, TOP_SONGS_TIMEOUT)
+    return top_songs
@@ -0,0 +1,122 @@
+import time
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from io import BytesIO
+
+from PIL import Image
+from config import CONFIG
+
+# Square thumbnail sizes, in pixels, rendered for every album and artist image.
+# 300 and 1200 are always included; their PNGs back thumbnail300x300 and thumbnail1200x1200.
+THUMBNAIL_SIZES = tuple(sorted(set(CONFIG.get("THUMBNAIL_SIZES", (64, 150, 300, 600, 1200))) | {300, 1200}))
+# Encodings written for each size; PNG keeps the paths clients already use
+IMAGE_FORMATS = tuple(CONFIG.get("IMAGE_FORMATS", ("png", "webp")))
+WEBP_QUALITY = CONFIG.get("WEBP_QUALITY", 82)
+
+# Above this ratio between steps, a resize goes through an intermediate size for quality
+_MAX_STEP = 3.0
+
+
+class Derivatives:
+    """Encoded thumbnails of one source image, with what it cost to make them."""
+
+    def __init__(self, files, source_bytes, elapsed):
+        # {(size, format): bytes}
+        self.files = files
+        self.source_bytes = source_bytes
+        self.elapsed = elapsed
+
+    @property
+    def output_bytes(self):
+        return sum(len(content) for content in self.files.values())
+
+    def bytes_by_format(self):
+        totals = {}
+        for (size, format), content in self.files.items():
+            totals[format] = totals.get(format, 0) + len(content)
+        return totals
+
+    def summary(self):
+        formats = ', '.join(f'{format} {size / 1024:.0f} KiB' for format, size in self.bytes_by_format().items())
+        return f"{self.source_bytes / 1024:.0f} KiB in, {formats} out in {self.elapsed * 1000:.0f} ms"
+
+
+def open_square(content):
+    """Open an image from bytes, checking it is square without decoding the pixels."""
+    img = Image.open(BytesIO(content))
+    width, height = img.size
+    if width != height:
+        raise ValueError("The uploaded image must have a 1:1 aspect ratio.")
+    return img
+
+
+def build_derivatives(content, sizes=THUMBNAIL_SIZES, formats=IMAGE_FORMATS):
+    """
+    Render `content` at each of `sizes` in each of `formats`.
+
+    JPEG sources are decoded straight at the smallest scale that still
+    covers the largest size, and every smaller size is resized from the
+    one before it rather than from the full source.
+    """
+    start = time.perf_counter()
+    img = open_square(content)
+    largest = max(sizes)
+    if img.format == 'JPEG':
+        img.draft('RGB', (largest, largest))
+    img.load()
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if img.mode in ('P', 'LA', 'PA') or 'transparency' in img.info else 'RGB')
+
+    files = {}
+    current = img
+    for size in sorted(sizes, reverse=True):
+        # Upscaling small sources keeps every path populated, as before
+        while current.width > size * _MAX_STEP:
+            step = int(current.width / _MAX_STEP)
+            current = current.resize((step, step), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if current.width != size:
+            current = current.resize((size, size), Image.Resampling.LANCZOS)
+        for format in formats:
+            files[(size, format)] = encode(current, format)
+
+    return Derivatives(files, len(content), time.perf_counter() - start)
+
+
+def encode(img, format):
+    buffer = BytesIO()
+    if format == 'webp':
+        img.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+    elif format == 'png':
+        img.save(buffer, format='PNG')
+    else:
+        raise ValueError(f"Unsupported image format {format}")
+    return buffer.getvalue()
+
+
+def build_derivatives_many(contents, sizes=THUMBNAIL_SIZES, formats=IMAGE_FORMATS, workers=None):
+    """
+    Render source images from the iterable `contents` in a process pool,
+    reading ahead only a few images per worker. Yields (index, Derivatives
+    or the exception raised) in completion order.
+    """
+    workers = workers or os.cpu_count() or 1
+    contents = iter(contents)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        submitted = 0
+        while True:
+            for content in contents:
+                pending[executor.submit(build_derivatives, content, sizes, formats)] = submitted
+                submitted += 1
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = e
+                yield index, result
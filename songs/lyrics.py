@@ -0,0 +1,120 @@
+import bisect
+import re
+from django.core.cache import cache
+from django.db import transaction
+from config import CONFIG
+
+from .models import SongLyrics
+from . import search
+from .versions import bump_version, get_version, lyrics_scope
+
+# Synced lyrics parsed from LRC files.
+#
+# A song's lyrics are stored once, parsed, as two parallel lists: line start
+# times in milliseconds, sorted, and line texts. Reads go through the cache,
+# keyed by the song's lyrics version, and a playback position is mapped to
+# its line with a binary search over the times.
+
+LYRICS_CACHE_TIMEOUT = CONFIG.get("LYRICS_CACHE_TIMEOUT", 24 * 60 * 60)
+
+# [mm:ss], [mm:ss.xx] or [mm:ss:xx]
+TIME_TAG_RE = re.compile(r'\[(\d{1,3}):(\d{1,2})(?:[.:](\d{1,3}))?\]')
+OFFSET_TAG_RE = re.compile(r'\[offset:\s*([+-]?\d+)\s*\]', re.IGNORECASE)
+# Word timings of enhanced LRC, <mm:ss.xx>
+WORD_TAG_RE = re.compile(r'<\d{1,3}:\d{1,2}(?:[.:]\d{1,3})?>')
+
+# Cached stand-in for songs without lyrics, so misses are cached too
+_MISSING = 'missing'
+
+
+class Lyrics:
+    __slots__ = ('times', 'lines')
+
+    def __init__(self, times, lines):
+        self.times = times
+        self.lines = lines
+
+    def __len__(self):
+        return len(self.times)
+
+    def line_at(self, position_ms):
+        """Index of the line playing at `position_ms`, -1 before the first line."""
+        return bisect.bisect_right(self.times, position_ms) - 1
+
+    def around(self, position_ms, before=2, after=5):
+        """The line playing at `position_ms` with up to `before` lines before it and `after` after it."""
+        index = self.line_at(position_ms)
+        start = max(0, index - before)
+        end = min(len(self.times), max(index, -1) + after + 1)
+        return {
+            'index': index,
+            'lines': [{'index': i, 'time': self.times[i], 'text': self.lines[i]} for i in range(start, end)],
+            'next_time': self.times[index + 1] if index + 1 < len(self.times) else None,
+        }
+
+    def to_dict(self):
+        return {'times': self.times, 'lines': self.lines}
+
+
+def parse_lrc(text):
+    """
+    Parse LRC text into Lyrics. Lines with several time tags are repeated at
+    each time, word timings are dropped and an [offset:] tag is applied.
+    Lines without a time tag (metadata, credits) are skipped.
+    """
+    offset_match = OFFSET_TAG_RE.search(text)
+    # A positive offset makes the lyrics appear sooner
+    offset = int(offset_match.group(1)) if offset_match else 0
+
+    entries = []
+    for raw_line in text.splitlines():
+        position = 0
+        times = []
+        while True:
+            match = TIME_TAG_RE.match(raw_line, position)
+            if not match:
+                break
+            minutes, seconds, fraction = match.groups()
+            fraction_ms = int(fraction.ljust(3, '0')) if fraction else 0
+            times.append(max(0, (int(minutes) * 60 + int(seconds)) * 1000 + fraction_ms - offset))
+            position = match.end()
+        if not times:
+            continue
+        line = WORD_TAG_RE.sub('', raw_line[position:]).strip()
+        entries.extend((time, line) for time in times)
+
+    # Stable, so lines sharing a time keep their file order
+    entries.sort(key=lambda entry: entry[0])
+    return Lyrics([time for time, _ in entries], [line for _, line in entries])
+
+
+def _cache_key(song_id):
+    return f"lyrics:{song_id}:{get_version(lyrics_scope(song_id))}"
+
+
+def get_lyrics(song_id):
+    """The song's Lyrics, or None when it has none."""
+    key = _cache_key(song_id)
+    cached = cache.get(key)
+    if cached is None:
+        row = SongLyrics.objects.filter(song_id=song_id).values_list('times', 'lines').first()
+        cached = row or _MISSING
+        cache.set(key, cached, LYRICS_CACHE_TIMEOUT)
+    if cached == _MISSING:
+        return None
+    return Lyrics(*cached)
+
+
+def store_lyrics(songs_lyrics):
+    """Save {song_id: Lyrics} in one upsert, re-index their lines and invalidate their cached copies."""
+    if not songs_lyrics:
+        return
+    with transaction.atomic():
+        SongLyrics.objects.bulk_create(
+            [SongLyrics(song_id=song_id, times=lyrics.times, lines=lyrics.lines) for song_id, lyrics in songs_lyrics.items()],
+            update_conflicts=True,
+            unique_fields=['song'],
+            update_fields=['times', 'lines', 'updated_at'],
+        )
+        search.index_lyrics(songs_lyrics)
+    bump_version(*(lyrics_scope(song_id) for song_id in songs_lyrics))
@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from songs.models import Song, PlaylistSummary
+from songs.assets import get_storage
+from songs import catalog
+from songs.mp3 import HEADER_WINDOW, Mp3Error, id3v2_size, parse_audio, parse_header
+from songs.versions import CATALOG, bump_version, album_scope
+from tqdm import tqdm
+
+# First request per file; covers the ID3v2 tag of most files, cover art included
+FIRST_READ = 64 * 1024
+
+
+def probe(storage, path):
+    """Read the duration of a stored MP3 with one or two range requests."""
+    head, total_size = storage.get_range(path, 0, FIRST_READ)
+    try:
+        return parse_header(head, total_size)
+    except Mp3Error:
+        audio_start = id3v2_size(head)
+        if audio_start < len(head):
+            raise
+    # The tag is longer than the first read; fetch the bytes after it
+    audio, _ = storage.get_range(path, audio_start, HEADER_WINDOW)
+    return parse_audio(audio, audio_start, total_size)
+
+
+class Command(BaseCommand):
+    help = "Fill in the duration and bitrate of songs from the headers of their stored MP3 files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true', help="Read every song, not only those without a duration."
+        )
+        parser.add_argument(
+            '--workers', type=int, default=16, help="Files read at the same time."
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500, help="Songs read and written per batch."
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None, help="Read at most this many songs."
+        )
+
+    def handle(self, *args, **kwargs):
+        songs = Song.objects.order_by('id')
+        if not kwargs['all']:
+            songs = songs.filter(Q(duration=0) | Q(duration__isnull=True))
+        songs = list(songs.values_list('id', 'url', 'album_id')[:kwargs['limit']])
+        storage = get_storage()
+        batch_size = kwargs['batch_size']
+
+        def read(song):
+            song_id, url, album_id = song
+            try:
+                return song, probe(storage, unquote(url))
+            except Exception as e:
+                return song, e
+
+        start = time.perf_counter()
+        updated = failed = 0
+        album_ids = set()
+        with ThreadPoolExecutor(max_workers=kwargs['workers']) as executor, \
+                tqdm(total=len(songs), desc="songs", unit="song") as bar:
+            for batch_start in range(0, len(songs), batch_size):
+                results = []
+                for (song_id, url, album_id), info in executor.map(read, songs[batch_start:batch_start + batch_size]):
+                    if isinstance(info, Exception):
+                        self.stderr.write(f"Failed to read {unquote(url)}: {info}")
+                        failed += 1
+                        continue
+                    results.append(Song(id=song_id, duration=round(info.duration, 3), bitrate=info.bitrate))
+                    album_ids.add(album_id)
+                # bulk_update skips Song.save, which would reload every row
+                with transaction.atomic():
+                    Song.objects.bulk_update(results, ['duration', 'bitrate'])
+                    catalog.record_changes('song', [song.id for song in results])
+                updated += len(results)
+                bar.update(min(batch_size, len(songs) - batch_start))
+
+        if updated:
+            # Playlist durations are denormalized from song durations
+            with transaction.atomic():
+                PlaylistSummary.rebuild_all()
+            bump_version(CATALOG, *(album_scope(album_id) for album_id in album_ids))
+
+        elapsed = time.perf_counter() - start
+        rate = (updated + failed) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {updated} songs, {failed} failed, in {elapsed:.1f}s ({rate:.0f} songs/s)."
+        ))
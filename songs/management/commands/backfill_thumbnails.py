@@ -0,0 +1,94 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from songs.models import Album, Artist
+from songs.assets import get_storage, spool, enqueue_uploads
+from songs.images import THUMBNAIL_SIZES, IMAGE_FORMATS, build_derivatives_many
+
+MODELS = {'album': Album, 'artist': Artist}
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the thumbnail ladder (THUMBNAIL_SIZES in IMAGE_FORMATS) of albums and artists that lack it, "
+        "from their 1200x1200 PNGs, and queue the files for process_asset_uploads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kinds', type=str, default='album,artist', help="Comma separated kinds to backfill."
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None, help="Render processes (defaults to the number of CPUs)."
+        )
+        parser.add_argument(
+            '--downloads', type=int, default=8, help="Source images downloaded at the same time."
+        )
+        parser.add_argument(
+            '--limit', type=int, default=None, help="Backfill at most this many images per kind."
+        )
+        parser.add_argument(
+            '--force', action='store_true', help="Render every image again, not only those missing sizes."
+        )
+
+    def handle(self, *args, **kwargs):
+        storage = get_storage()
+        ladder = list(THUMBNAIL_SIZES)
+        for kind in kwargs['kinds'].split(','):
+            model = MODELS[kind]
+            rows = [
+                row for row in model.objects.exclude(asset_status='Pending').order_by('id')
+                if kwargs['force'] or row.thumbnail_sizes != ladder
+            ][:kwargs['limit']]
+            self.stdout.write(f"Backfilling {len(rows)} {kind} images...")
+            self.backfill(storage, rows, kwargs['workers'], kwargs['downloads'])
+
+    def backfill(self, storage, rows, workers, downloads):
+        start = time.perf_counter()
+        fetched = []
+        rendered = source_bytes = output_bytes = failed = 0
+
+        def fetch(row):
+            try:
+                return row, storage.get(row.thumbnail_path(1200))
+            except Exception as e:
+                return row, e
+
+        def sources():
+            nonlocal failed
+            # Downloads run in threads, in chunks, so only a few images are held in memory
+            with ThreadPoolExecutor(max_workers=downloads) as executor:
+                for chunk_start in range(0, len(rows), downloads * 4):
+                    for row, content in executor.map(fetch, rows[chunk_start:chunk_start + downloads * 4]):
+                        if isinstance(content, Exception):
+                            self.stderr.write(f"Failed to download the source image of {row}: {content}")
+                            failed += 1
+                            continue
+                        fetched.append(row)
+                        yield content
+
+        for index, result in build_derivatives_many(sources(), THUMBNAIL_SIZES, IMAGE_FORMATS, workers=workers):
+            row = fetched[index]
+            if isinstance(result, Exception):
+                self.stderr.write(f"Failed to render thumbnails of {row}: {result}")
+                failed += 1
+                continue
+            files = [
+                (row.thumbnail_path(size, format), spool(content), f"Upload {size}x{size} {format} thumbnail of {row}")
+                for (size, format), content in result.files.items()
+                # The source itself is already in storage
+                if (size, format) != (1200, 'png')
+            ]
+            enqueue_uploads(row, files)
+            type(row).objects.filter(pk=row.pk).update(thumbnail_sizes=sorted({size for size, _ in result.files}))
+            rendered += 1
+            source_bytes += result.source_bytes
+            output_bytes += result.output_bytes
+            self.stdout.write(f"{row}: {result.summary()}")
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered} images "
+            f"({source_bytes / 1024 / 1024:.1f} MiB in, {output_bytes / 1024 / 1024:.1f} MiB out) "
+            f"in {elapsed:.1f}s, {failed} failed. Run process_asset_uploads to store them."
+        ))
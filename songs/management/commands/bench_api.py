@@ -0,0 +1,362 @@
+import io
+import json
+import statistics
+import subprocess
+import time
+from types import SimpleNamespace
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment, override_settings
+from django.urls import get_resolver
+from django.utils.timezone import now
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from songs.models import Song, SongArtist, SongTag, Playlist, PlaylistSong, PlaylistSummary, SongLyrics
+from songs.lyrics import parse_lrc, store_lyrics
+from songs import catalog
+from songs.playevents import play_events
+from songrequest.models import SongRequest
+
+# URL prefixes of the apps the suite covers, as included in arsongsapi.urls
+COVERED_PREFIXES = ('content/', 'auth/', 'song-requests/', 'share/')
+
+
+class Endpoint:
+    """
+    One request of the suite. `path` and `data` may be callables taking the
+    suite context, `capture` stores ids from the response for later requests.
+    GET requests are repeated for timing; other methods run once. `headers`
+    (a dict or a callable) are sent as request META, and `cold=False` keeps
+    the cache, and so the versions behind ETags, from the previous request.
+    """
+
+    def __init__(self, name, method, path, budget, data=None, client='user', status=200, capture=None,
+                 headers=None, cold=True):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.budget = budget
+        self.data = data
+        self.client = client
+        self.status = status
+        self.capture = capture
+        self.headers = headers
+        self.cold = cold
+
+
+def store(key, field='id'):
+    def capture(c, response):
+        setattr(c, key, response.json()[field])
+    return capture
+
+
+def store_header(key, header):
+    def capture(c, response):
+        setattr(c, key, response[header])
+    return capture
+
+
+# Query budgets are the counts the endpoints need today, with every cache
+# empty and the token lookup included; raise them deliberately, never to
+# make a regression pass.
+ENDPOINTS = [
+    Endpoint('albums list', 'get', '/content/albums/', 2, capture=store_header('albums_etag', 'ETag')),
+    Endpoint('albums list revalidated', 'get', '/content/albums/', 1, status=304, cold=False,
+             headers=lambda c: {'HTTP_IF_NONE_MATCH': c.albums_etag}),
+    Endpoint('album detail', 'get', lambda c: f'/content/albums/{c.album_id}/', 2),
+    Endpoint('album songs', 'get', lambda c: f'/content/albums/{c.album_id}/songs/', 6),
+    Endpoint('artists list', 'get', '/content/artists/', 2),
+    Endpoint('artist detail', 'get', lambda c: f'/content/artists/{c.artist_id}/', 2),
+    Endpoint('artist songs', 'get', lambda c: f'/content/artists/{c.artist_id}/songs/', 6),
+    Endpoint('tags list', 'get', '/content/tags/', 2),
+    Endpoint('tag detail', 'get', lambda c: f'/content/tags/{c.tag_id}/', 2),
+    Endpoint('songs list', 'get', '/content/songs/', 4),
+    Endpoint('song detail', 'get', lambda c: f'/content/songs/{c.song_id}/', 5),
+    Endpoint('random song', 'get', '/content/songs/random/', 6),
+    Endpoint('random album song', 'get', lambda c: f'/content/songs/random/?album={c.album_id}', 6),
+    Endpoint('related songs', 'get', lambda c: f'/content/songs/{c.song_id}/related_songs/', 4),
+    Endpoint('song lyrics', 'get', lambda c: f'/content/songs/{c.song_id}/lyrics/?t=61.5', 2),
+    Endpoint('slides', 'get', '/content/get-slides', 1),
+    Endpoint('home feed', 'get', '/content/home', 10),
+    Endpoint('latest playlists', 'get', '/content/latest-playlists', 4),
+    Endpoint('history', 'get', '/content/songs-history/', 5),
+    Endpoint('history cursor', 'get', '/content/songs-history/?cursor=', 4),
+    Endpoint('liked songs', 'get', '/content/liked-songs', 5, capture=store_header('liked_etag', 'ETag')),
+    Endpoint('liked songs revalidated', 'get', '/content/liked-songs', 1, status=304, cold=False,
+             headers=lambda c: {'HTTP_IF_NONE_MATCH': c.liked_etag}),
+    Endpoint('liked song detail', 'get', lambda c: f'/content/liked-songs/{c.liked_id}', 4),
+    Endpoint('catalog snapshot', 'get', '/content/catalog/snapshot', 8),
+    Endpoint('catalog changes', 'get', lambda c: f'/content/catalog/changes?since={c.catalog_since}', 6),
+    # The worst case, with every section filled: the token, the ranked song
+    # ids, history and likes (ids, rows and two prefetches each), songs (rows
+    # and two prefetches), three entity searches and their rows, lyrics
+    # (matches, lines, songs and two prefetches) and playlists
+    Endpoint('global search', 'get', lambda c: f'/content/global-search?q={c.word}', 25),
+    Endpoint('song filter', 'get', lambda c: f'/content/filter?q={c.word}&searchby=0&sortby=0', 7),
+    Endpoint('playlists list', 'get', '/content/playlists/', 2),
+    Endpoint('playlists containing song', 'get', lambda c: f'/content/playlists/?song_id={c.song_id}', 2),
+    Endpoint('playlist detail', 'get', lambda c: f'/content/playlists/{c.playlist_id}/', 2),
+    Endpoint('playlist songs', 'get', lambda c: f'/content/playlists/{c.playlist_id}/songs/', 6),
+    Endpoint('playlist songs cursor', 'get', lambda c: f'/content/playlists/{c.playlist_id}/songs/?cursor=', 5),
+    Endpoint('seeker playlists list', 'get', '/content/playlistseeker/', 2),
+    Endpoint('seeker playlist detail', 'get', lambda c: f'/content/playlistseeker/{c.public_playlist_id}/', 2),
+    Endpoint('seeker playlist songs', 'get', lambda c: f'/content/playlistseeker/{c.public_playlist_id}/songs/', 6),
+    Endpoint('seeker random', 'get', lambda c: f'/content/playlistseeker/{c.public_playlist_id}/random/', 7),
+    Endpoint('seeker seek', 'get', lambda c: f'/content/playlistseeker/{c.public_playlist_id}/seek/?playlistsong_id={c.playlistsong_id}&window=10&loop=1', 7),
+    Endpoint('share song', 'get', lambda c: f'/share/content/songs/{c.song_id}', 2, client='bot'),
+    Endpoint('share playlist', 'get', lambda c: f'/share/content/playlists/{c.public_playlist_id}', 1, client='bot'),
+    Endpoint('share artist', 'get', lambda c: f'/share/content/artists/{c.artist_id}', 1, client='bot'),
+    Endpoint('share album', 'get', lambda c: f'/share/content/albums/{c.album_id}', 1, client='bot'),
+    Endpoint('song requests list', 'get', '/song-requests/handle/', 3),
+    Endpoint('song request detail', 'get', lambda c: f'/song-requests/handle/{c.song_request_id}/', 2),
+
+    # Writes, in an order where each one finds what it needs
+    Endpoint('create playlist', 'post', '/content/playlists/', 7, status=201,
+             data=lambda c: {'name': 'Bench', 'privacy_type': 'Private', 'songs_id': c.song_ids[:20]}, capture=store('new_playlist_id')),
+    Endpoint('add playlist songs', 'post', lambda c: f'/content/playlists/{c.new_playlist_id}/add_songs/', 8,
+             data=lambda c: {'songs_id': c.song_ids[20:40]}),
+    Endpoint('move playlist song', 'post', lambda c: f'/content/playlists/{c.new_playlist_id}/move/', 13,
+             data=lambda c: {'playlistsong_id': c.new_playlistsong_ids()[-1], 'after_id': None}),
+    Endpoint('reorder playlist', 'post', lambda c: f'/content/playlists/{c.new_playlist_id}/reorder/', 12,
+             data=lambda c: {'playlistsong_ids': c.new_playlistsong_ids()[::-1]}),
+    Endpoint('remove playlist songs', 'post', lambda c: f'/content/playlists/{c.new_playlist_id}/remove_songs/', 12,
+             data=lambda c: {'songs_id': c.song_ids[:10]}),
+    Endpoint('rename playlist', 'patch', lambda c: f'/content/playlists/{c.new_playlist_id}/', 3, data={'name': 'Bench renamed'}),
+    Endpoint('delete playlist', 'delete', lambda c: f'/content/playlists/{c.new_playlist_id}/', 8, status=204),
+    Endpoint('like song', 'post', '/content/liked-songs', 6, status=201, data=lambda c: {'song_id': c.unliked_song_id}),
+    Endpoint('unlike song', 'delete', '/content/liked-songs', 7, status=204, data=lambda c: {'song_id': c.unliked_song_id}),
+    Endpoint('delete history entry', 'delete', '/content/songs-history/', 3, status=204, data=lambda c: {'id': c.history_id}),
+    Endpoint('create song request', 'post', '/song-requests/handle/', 2, status=201,
+             data={'name': 'Bench request', 'description': 'Generated by bench_api'}, capture=store('new_song_request_id')),
+    Endpoint('update song request', 'patch', lambda c: f'/song-requests/handle/{c.new_song_request_id}/', 3, data={'description': 'Updated'}),
+    Endpoint('reopen song request', 'post', lambda c: f'/song-requests/handle/{c.new_song_request_id}/reopen/', 3),
+    Endpoint('delete song request', 'delete', lambda c: f'/song-requests/handle/{c.new_song_request_id}/', 3, status=204),
+
+    # Account flows; OTPs are read back from the cache like the email would carry them
+    Endpoint('account config', 'post', '/auth/config', 1),
+    Endpoint('login', 'post', '/auth/username/login', 2, client='anon', data=lambda c: {'username': c.user.username, 'password': c.password}),
+    Endpoint('register', 'post', '/auth/register', 3, client='anon', data=lambda c: c.registration),
+    Endpoint('verify email', 'post', '/auth/verify-email-and-activate-account', 3, client='anon',
+             data=lambda c: {'email': c.registration['email'], 'OTP': cache.get(c.registration['email'])}),
+    Endpoint('resend email otp', 'post', '/auth/resend-email-otp', 1, client='anon', data=lambda c: {'email': c.registration['email']}),
+    Endpoint('request password otp', 'post', '/auth/request-password-change-email-otp', 1, client='anon', data=lambda c: {'email': c.registration['email']}),
+    Endpoint('reset password', 'post', '/auth/reset-password-with-email', 3, client='anon',
+             data=lambda c: {'email': c.registration['email'], 'OTP': cache.get(f"fp-{c.registration['email']}"), 'password': 'Bench-pass-2'}),
+    Endpoint('logout', 'post', '/auth/logout', 1, data={'logout_all_devices': False}),
+]
+
+
+class Command(BaseCommand):
+    help = "Run every API route against a generated dataset, recording queries, time and size, and fail on query budgets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help="Users in the generated dataset.")
+        parser.add_argument('--songs', type=int, default=3000, help="Songs in the generated dataset.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs of each GET endpoint.")
+        parser.add_argument('--report', type=str, default='bench_api_report.json', help="Where to write the JSON report.")
+        parser.add_argument('--baseline', type=str, default=None, help="A previous report to print differences against.")
+        parser.add_argument('--current-db', action='store_true',
+                            help="Run against the configured database instead of a generated test database. Writes to it.")
+        parser.add_argument('--no-budgets', action='store_true', help="Report without failing on budgets.")
+
+    def handle(self, *args, **kwargs):
+        old_name = None
+        setup_test_environment()
+        try:
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-api'}}):
+                if not kwargs['current_db']:
+                    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                    self.stdout.write("Generating dataset...")
+                    call_command('generate_dataset', users=kwargs['users'], songs=kwargs['songs'], seed=kwargs['seed'], stdout=io.StringIO())
+                    call_command('build_related_songs', stdout=io.StringIO())
+                results = self.run_suite(self.context(), kwargs['repeat'])
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'created_at': now().isoformat(),
+            'commit': self.git_commit(),
+            'dataset': {'users': kwargs['users'], 'songs': kwargs['songs'], 'seed': kwargs['seed']} if not kwargs['current_db'] else 'current',
+            'endpoints': results,
+        }
+        with open(kwargs['report'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.print_results(results, kwargs['baseline'])
+        self.stdout.write(f"Report written to {kwargs['report']}")
+
+        uncovered = self.uncovered_routes(self.requested)
+        if uncovered:
+            self.stdout.write(self.style.WARNING(f"Routes without an endpoint in the suite: {', '.join(uncovered)}"))
+
+        failures = [
+            f"{result['name']}: {result['queries']} queries > budget {result['budget']}"
+            for result in results if result['queries'] > result['budget'] and not kwargs['no_budgets']
+        ] + [
+            f"{result['name']}: status {result['status']}, expected {result['expected_status']}"
+            for result in results if result['status'] != result['expected_status']
+        ]
+        if failures:
+            raise CommandError("API benchmark failed:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS(f"All {len(results)} endpoints within budget."))
+
+    def context(self):
+        c = SimpleNamespace()
+        c.user = User.objects.annotate(
+            playlists_count=Count('playlists', distinct=True), likes_count=Count('liked_songs', distinct=True)
+        ).filter(playlists_count__gt=0, likes_count__gt=0, song_history__isnull=False).order_by('-playlists_count', 'id').first()
+        if c.user is None:
+            raise CommandError("The database needs a user with playlists, likes and history.")
+        c.password = 'Bench-pass-1'
+        c.user.set_password(c.password)
+        c.user.save()
+        c.token = Token.objects.get_or_create(user=c.user)[0].key
+
+        c.song_ids = list(Song.objects.order_by('-count').values_list('id', flat=True)[:40])
+        c.song_id = c.song_ids[0]
+        c.album_id = Song.objects.get(id=c.song_id).album_id
+        c.artist_id = SongArtist.objects.filter(song_id=c.song_id).values_list('artist_id', flat=True).first()
+        c.tag_id = SongTag.objects.filter(song_id=c.song_id).values_list('tag_id', flat=True).first()
+        c.word = Song.objects.get(id=c.song_id).original_name.split()[0][:4]
+        # A delta of a hundred song edits and one album edit
+        c.catalog_since = catalog.current_version()
+        catalog.record_changes('song', Song.objects.order_by('id').values_list('id', flat=True)[:100])
+        catalog.record_change('album', c.album_id)
+        if not SongLyrics.objects.filter(song_id=c.song_id).exists():
+            store_lyrics({c.song_id: parse_lrc('\n'.join(f'[{i // 60:02d}:{i % 60:02d}.00]Bench line {i}' for i in range(0, 240, 4)))})
+
+        c.playlist_id = c.user.playlists.filter(playlist_songs__isnull=False).values_list('id', flat=True).first()
+        # Seeks start from the second song and read a window of 10 without wrapping around
+        public = Playlist.objects.filter(privacy_type='Public').annotate(
+            songs_count=Count('playlist_songs')
+        ).filter(songs_count__gte=12).order_by('id').first()
+        if public is None:
+            # Small datasets may have no public playlist that long
+            public = Playlist.objects.create(user=c.user, name='Bench public', privacy_type='Public')
+            PlaylistSong.objects.bulk_create([
+                PlaylistSong(playlist=public, song_id=song_id, position=(index + 1) * PlaylistSong.POSITION_STEP)
+                for index, song_id in enumerate(c.song_ids[:12])
+            ])
+            PlaylistSummary.refresh(public)
+        c.public_playlist_id = public.id
+        c.playlistsong_id = public.playlist_songs.values_list('id', flat=True)[1]
+        c.new_playlistsong_ids = lambda: list(Playlist.objects.get(id=c.new_playlist_id).playlist_songs.values_list('id', flat=True))
+
+        c.liked_id = c.user.liked_songs.values_list('id', flat=True).first()
+        c.unliked_song_id = Song.objects.exclude(liked_by__user=c.user).values_list('id', flat=True).first()
+        c.history_id = c.user.song_history.values_list('id', flat=True).first()
+        c.song_request_id = (
+            c.user.song_requests.values_list('id', flat=True).first()
+            or SongRequest.objects.create(user=c.user, name='Bench', description='Bench').id
+        )
+
+        suffix = int(time.time())
+        c.registration = {
+            'username': f'benchapi{suffix}', 'email': f'benchapi{suffix}@example.com', 'password': 'Bench-pass-1',
+            'first_name': 'Bench', 'last_name': 'Api',
+        }
+        return c
+
+    def run_suite(self, c, repeat):
+        clients = {
+            'user': APIClient(HTTP_AUTHORIZATION=f'Token {c.token}'),
+            'anon': APIClient(),
+            'bot': APIClient(HTTP_USER_AGENT='facebookexternalhit/1.1'),
+        }
+        results = []
+        self.requested = set()
+        for endpoint in ENDPOINTS:
+            path = endpoint.path(c) if callable(endpoint.path) else endpoint.path
+            data = endpoint.data(c) if callable(endpoint.data) else endpoint.data
+            headers = (endpoint.headers(c) if callable(endpoint.headers) else endpoint.headers) or {}
+            client = clients[endpoint.client]
+            send = getattr(client, endpoint.method)
+            is_read = endpoint.method == 'get'
+            if is_read and endpoint.cold:
+                # Budgets hold with every cache cold
+                cache.clear()
+
+            timings = []
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = send(path, data, format='json', **headers) if data is not None else send(path, **headers)
+                timings.append(time.perf_counter() - start)
+            cold_queries = len(queries)
+            self.requested.add(response.resolver_match.route)
+            if endpoint.capture and response.status_code == endpoint.status:
+                endpoint.capture(c, response)
+
+            warm_queries = cold_queries
+            for _ in range(repeat - 1 if is_read else 0):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    send(path, **headers)
+                    timings.append(time.perf_counter() - start)
+                warm_queries = len(queries)
+
+            results.append({
+                'name': endpoint.name,
+                'method': endpoint.method.upper(),
+                'path': path,
+                'status': response.status_code,
+                'expected_status': endpoint.status,
+                'queries': cold_queries,
+                'warm_queries': warm_queries,
+                'budget': endpoint.budget,
+                'time_ms': {
+                    'min': round(min(timings) * 1000, 2),
+                    'median': round(statistics.median(timings) * 1000, 2),
+                    'max': round(max(timings) * 1000, 2),
+                },
+                'bytes': len(response.content),
+            })
+        play_events.flush()
+        return results
+
+    def print_results(self, results, baseline_path):
+        baseline = {}
+        if baseline_path:
+            with open(baseline_path) as f:
+                baseline = {result['name']: result for result in json.load(f)['endpoints']}
+
+        self.stdout.write(f"{'endpoint':32} {'status':>6} {'queries':>8} {'budget':>6} {'warm':>5} {'median ms':>10} {'bytes':>8}")
+        for result in results:
+            line = (
+                f"{result['name']:32} {result['status']:>6} {result['queries']:>8} {result['budget']:>6} "
+                f"{result['warm_queries']:>5} {result['time_ms']['median']:>10.2f} {result['bytes']:>8}"
+            )
+            previous = baseline.get(result['name'])
+            if previous:
+                line += f"  ({result['queries'] - previous['queries']:+d} queries, {result['time_ms']['median'] - previous['time_ms']['median']:+.2f} ms)"
+            style = self.style.ERROR if result['queries'] > result['budget'] or result['status'] != result['expected_status'] else str
+            self.stdout.write(style(line))
+
+    def uncovered_routes(self, requested):
+        """Routes of the covered apps that no endpoint of the suite requested."""
+        def walk(patterns, prefix=''):
+            for pattern in patterns:
+                # Joined like ResolverMatch.route, which drops the ^ of nested regex patterns
+                route = prefix + str(pattern.pattern).removeprefix('^')
+                if hasattr(pattern, 'url_patterns'):
+                    yield from walk(pattern.url_patterns, route)
+                else:
+                    yield route
+
+        return sorted(
+            route for route in set(walk(get_resolver().url_patterns)) - requested
+            # Router API roots and format suffix variants are not endpoints of their own
+            if route.startswith(COVERED_PREFIXES) and route not in COVERED_PREFIXES and 'format' not in route
+        )
+
+    def git_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
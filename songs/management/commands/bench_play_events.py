@@ -0,0 +1,90 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections, OperationalError
+from django.utils.timezone import now
+from django.contrib.auth.models import User
+from songs.models import Song, UserSongHistory
+from songs.playevents import PlayEventBuffer
+
+
+def legacy_record_play(user, song):
+    # The per-play writes the views used to do before the play-event buffer
+    user_song_history, created = UserSongHistory.objects.update_or_create(
+        user=user,
+        song=song,
+        defaults={'accessed_at': now()}
+    )
+    if not created:
+        user_song_history.count += 1
+    else:
+        user_song_history.count = 1
+    user_song_history.save()
+
+    song.count += 1
+    song.save()
+
+
+class Command(BaseCommand):
+    help = "Benchmark plays per second for the legacy per-play writes against the play-event buffer. Writes real history rows, run it against a scratch database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plays', type=int, default=2000, help="Number of plays per run.")
+        parser.add_argument('--threads', type=int, default=4, help="Concurrent listeners.")
+        parser.add_argument('--users', type=int, default=50, help="Number of existing users to play as.")
+        parser.add_argument('--songs', type=int, default=500, help="Number of existing songs to play.")
+        parser.add_argument('--max-pending', type=int, default=500, help="Buffer size threshold for the buffered run.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **kwargs):
+        rng = random.Random(kwargs['seed'])
+        users = list(User.objects.all()[:kwargs['users']])
+        songs = list(Song.objects.all()[:kwargs['songs']])
+        if not users or not songs:
+            self.stdout.write(self.style.ERROR("The benchmark needs at least one user and one song."))
+            return
+
+        plays = [(rng.choice(users), rng.choice(songs)) for _ in range(kwargs['plays'])]
+        threads = kwargs['threads']
+
+        legacy, legacy_errors = self.run(plays, threads, lambda user, song: legacy_record_play(user, Song.objects.get(pk=song.pk)))
+
+        immediate_buffer = PlayEventBuffer(mode="immediate")
+        immediate, immediate_errors = self.run(plays, threads, lambda user, song: immediate_buffer.record(user.id, song.id))
+
+        buffered_buffer = PlayEventBuffer(mode="buffered", flush_interval=1.0, max_pending=kwargs['max_pending'])
+        buffered, buffered_errors = self.run(plays, threads, lambda user, song: buffered_buffer.record(user.id, song.id), buffered_buffer.flush)
+
+        self.stdout.write(f"{len(plays)} plays, {threads} threads")
+        runs = [
+            ("legacy", legacy, legacy_errors),
+            ("immediate", immediate, immediate_errors),
+            ("buffered", buffered, buffered_errors),
+        ]
+        for name, elapsed, errors in runs:
+            self.stdout.write(
+                f"{name:>10}: {elapsed:8.3f}s  {(len(plays) - errors) / elapsed:10.1f} plays/s  "
+                f"({legacy / elapsed:.1f}x)  {errors} failed (database is locked)"
+            )
+
+    def run(self, plays, threads, play, finish=None):
+        def worker(chunk):
+            errors = 0
+            try:
+                for user, song in chunk:
+                    try:
+                        play(user, song)
+                    except OperationalError:
+                        errors += 1
+            finally:
+                connections.close_all()
+            return errors
+
+        chunks = [plays[i::threads] for i in range(threads)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            errors = sum(executor.map(worker, chunks))
+        if finish:
+            finish()
+        return time.perf_counter() - start, errors
@@ -0,0 +1,118 @@
+import itertools
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from songs.search import SONG_COLUMNS, SONG_COLUMN_WEIGHTS, TOKENIZE, build_match
+
+SYLLABLES = ['ka', 'ri', 'mo', 'shi', 'na', 'te', 'lu', 'zor', 'pa', 'dil', 'ven', 'to', 'ya', 'bel', 'an', 'qui']
+
+# The song query GlobalSearchAPIView ran before the full-text index
+LIKE_QUERY = """
+    SELECT DISTINCT s.id FROM song s
+    JOIN album a ON a.id = s.album_id
+    LEFT JOIN songartist sa ON sa.song_id = s.id LEFT JOIN artist ar ON ar.id = sa.artist_id
+    LEFT JOIN songtag st ON st.song_id = s.id LEFT JOIN tag t ON t.id = st.tag_id
+    WHERE s.name LIKE ? OR a.title LIKE ? OR ar.name LIKE ? OR t.name LIKE ?
+    ORDER BY s.id DESC LIMIT ?
+"""
+
+
+class Command(BaseCommand):
+    help = "Benchmark icontains search against the FTS5 index on a synthetic catalog in a temporary database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=100000, help="Number of synthetic songs.")
+        parser.add_argument('--queries', type=int, default=50, help="Number of search queries per method.")
+        parser.add_argument('--limit', type=int, default=10, help="Results per query.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **kwargs):
+        rng = random.Random(kwargs['seed'])
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        try:
+            conn = sqlite3.connect(path)
+            start = time.perf_counter()
+            self.build_catalog(conn, rng, kwargs['songs'])
+            self.stdout.write(f"Built {kwargs['songs']} songs in {time.perf_counter() - start:.1f}s")
+
+            # Typed prefixes of catalog words, picked uniformly so most are rare like real queries
+            queries = [rng.choice(self.words)[:rng.randint(3, 6)] for _ in range(kwargs['queries'])]
+            limit = kwargs['limit']
+
+            like_time = self.time_queries(conn, queries, lambda q: conn.execute(LIKE_QUERY, [f'%{q}%'] * 4 + [limit]).fetchall())
+            fts_time = self.time_queries(conn, queries, lambda q: conn.execute(
+                "SELECT rowid FROM song_fts WHERE song_fts MATCH ? ORDER BY rank LIMIT ?", [build_match(q), limit]
+            ).fetchall())
+
+            self.stdout.write(f"{len(queries)} queries, {limit} results each")
+            self.stdout.write(f"  icontains: {like_time * 1000 / len(queries):9.2f} ms/query")
+            self.stdout.write(f"  fts5:      {fts_time * 1000 / len(queries):9.2f} ms/query  ({like_time / fts_time:.0f}x)")
+            conn.close()
+        finally:
+            os.remove(path)
+
+    def time_queries(self, conn, queries, run):
+        start = time.perf_counter()
+        for q in queries:
+            run(q)
+        return time.perf_counter() - start
+
+    def build_catalog(self, conn, rng, total_songs):
+        albums = max(total_songs // 10, 1)
+        artists = max(total_songs // 20, 1)
+        tags = 50
+        # Word frequencies follow Zipf's law like natural titles and names
+        self.words = sorted({''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(20000)})
+        rng.shuffle(self.words)
+        cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(self.words) + 1)))
+        phrase = lambda n: ' '.join(rng.choices(self.words, cum_weights=cum_weights, k=n))
+
+        conn.executescript("""
+            CREATE TABLE album (id INTEGER PRIMARY KEY, title TEXT, code TEXT);
+            CREATE TABLE artist (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE tag (id INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE song (id INTEGER PRIMARY KEY, name TEXT, album_id INTEGER);
+            CREATE TABLE songartist (id INTEGER PRIMARY KEY, song_id INTEGER, artist_id INTEGER);
+            CREATE TABLE songtag (id INTEGER PRIMARY KEY, song_id INTEGER, tag_id INTEGER);
+            CREATE INDEX songartist_song ON songartist (song_id);
+            CREATE INDEX songtag_song ON songtag (song_id);
+        """)
+        conn.execute(f"CREATE VIRTUAL TABLE song_fts USING fts5({', '.join(SONG_COLUMNS)}, {TOKENIZE})")
+        conn.execute(
+            "INSERT INTO song_fts(song_fts, rank) VALUES ('rank', ?)",
+            [f"bm25({', '.join(str(weight) for weight in SONG_COLUMN_WEIGHTS)})"]
+        )
+
+        album_rows = [(i, phrase(2), f'A{i}') for i in range(1, albums + 1)]
+        artist_rows = [(i, f'{phrase(1)} {phrase(1)}') for i in range(1, artists + 1)]
+        tag_rows = [(i, phrase(1)) for i in range(1, tags + 1)]
+        conn.executemany("INSERT INTO album VALUES (?, ?, ?)", album_rows)
+        conn.executemany("INSERT INTO artist VALUES (?, ?)", artist_rows)
+        conn.executemany("INSERT INTO tag VALUES (?, ?)", tag_rows)
+
+        songs, song_artists, song_tags, documents = [], [], [], []
+        for song_id in range(1, total_songs + 1):
+            album_id = rng.randint(1, albums)
+            artist_ids = rng.sample(range(1, artists + 1), min(2, artists))
+            tag_id = rng.randint(1, tags)
+            name = phrase(rng.randint(1, 4))
+            songs.append((song_id, name, album_id))
+            song_artists.extend((song_id, artist_id) for artist_id in artist_ids)
+            song_tags.append((song_id, tag_id))
+            album = album_rows[album_id - 1]
+            documents.append((
+                song_id, name, f'{album[1]} {album[2]}',
+                ' '.join(artist_rows[artist_id - 1][1] for artist_id in artist_ids),
+                tag_rows[tag_id - 1][1],
+            ))
+
+        conn.executemany("INSERT INTO song VALUES (?, ?, ?)", songs)
+        conn.executemany("INSERT INTO songartist (song_id, artist_id) VALUES (?, ?)", song_artists)
+        conn.executemany("INSERT INTO songtag (song_id, tag_id) VALUES (?, ?)", song_tags)
+        conn.executemany("INSERT INTO song_fts(rowid, name, album, artists, tags) VALUES (?, ?, ?, ?, ?)", documents)
+        conn.execute("INSERT INTO song_fts(song_fts) VALUES ('optimize')")
+        conn.commit()
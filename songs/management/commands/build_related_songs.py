@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from songs.models import Song
+from songs.related import build_related_songs, update_related_songs
+
+
+class Command(BaseCommand):
+    help = "Precompute the related songs of every song, or refresh them incrementally for some songs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--songs', type=str, help="Comma separated song IDs that were added or changed; refreshes them and the songs they may relate to."
+        )
+        parser.add_argument(
+            '--missing', action='store_true', help="Only compute songs that have no related songs yet."
+        )
+        parser.add_argument(
+            '--top', type=int, default=24, help="Number of related songs kept per song."
+        )
+
+    def handle(self, *args, **kwargs):
+        top_n = kwargs['top']
+        start = time.perf_counter()
+
+        if kwargs['songs']:
+            try:
+                song_ids = [int(song_id) for song_id in kwargs['songs'].split(',')]
+            except ValueError:
+                raise CommandError("--songs must be a comma separated list of song IDs.")
+            written = update_related_songs(song_ids, top_n=top_n)
+        elif kwargs['missing']:
+            song_ids = list(Song.objects.filter(neighbours__isnull=True).values_list('id', flat=True))
+            written = update_related_songs(song_ids, top_n=top_n) if song_ids else 0
+        else:
+            written = build_related_songs(top_n=top_n)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"Computed related songs for {written} songs in {elapsed:.1f}s."))
@@ -0,0 +1,258 @@
+import time
+from datetime import timedelta
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max
+from django.utils.timezone import now
+from songs.models import Album, Artist, Tag, Song, SongArtist, SongTag, UserSongHistory, UserLikedSong, Playlist, PlaylistSong, PlaylistSummary
+from songs import search, catalog
+from songs.versions import CATALOG, bump_version
+from songrequest.models import SongRequest
+
+SYLLABLES = ['ka', 'ri', 'mo', 'shi', 'na', 'te', 'lu', 'zor', 'pa', 'dil', 'ven', 'to', 'ya', 'bel', 'an', 'qui']
+
+# History, likes and playlists span this many days before now
+SPAN_DAYS = 365
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic world of users, catalog, history, likes, playlists and song requests for benchmarking."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Number of users to create.")
+        parser.add_argument('--songs', type=int, default=10000, help="Number of songs to create; 0 reuses the existing catalog.")
+        parser.add_argument('--history', type=int, default=100, help="Average distinct songs in each user's history.")
+        parser.add_argument('--likes', type=int, default=30, help="Average liked songs per user.")
+        parser.add_argument('--playlists', type=int, default=3, help="Average playlists per user.")
+        parser.add_argument('--playlist-songs', type=int, default=25, help="Average songs per playlist.")
+        parser.add_argument('--requests', type=float, default=0.5, help="Average song requests per user.")
+        parser.add_argument('--zipf', type=float, default=1.0, help="Exponent of the Zipf distribution of song popularity.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed generates the same world.")
+        parser.add_argument('--prefix', type=str, default='bench', help="Prefix of generated usernames and catalog names.")
+        parser.add_argument('--batch-size', type=int, default=20000, help="Rows inserted per transaction.")
+
+    def handle(self, *args, **kwargs):
+        self.rng = np.random.default_rng(kwargs['seed'])
+        self.prefix = kwargs['prefix']
+        self.batch_size = kwargs['batch_size']
+        self.now = now()
+        self.rows = 0
+        self.search_failed = False
+        start = time.perf_counter()
+
+        if kwargs['songs']:
+            song_ids = self.step("catalog", self.create_catalog, kwargs['songs'])
+        else:
+            song_ids = np.asarray(Song.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+        if not len(song_ids):
+            raise CommandError("There are no songs; pass --songs to generate a catalog.")
+
+        # Popularity follows Zipf's law over a random ranking of the songs
+        ranks = self.rng.permutation(len(song_ids)) + 1
+        weights = 1.0 / ranks ** kwargs['zipf']
+        self.song_ids = song_ids
+        self.cdf = np.cumsum(weights / weights.sum())
+        self.plays = np.zeros(len(song_ids), dtype=np.int64)
+        self.liked = np.zeros(len(song_ids), dtype=np.int64)
+
+        user_ids = self.step("users", self.create_users, kwargs['users'])
+        self.step("history", self.create_history, user_ids, kwargs['history'])
+        self.step("likes", self.create_likes, user_ids, kwargs['likes'])
+        self.step("playlists", self.create_playlists, user_ids, kwargs['playlists'], kwargs['playlist_songs'])
+        self.step("song requests", self.create_song_requests, user_ids, kwargs['requests'])
+        self.step("song counters", self.update_song_counters)
+
+        # Bulk inserts skip the signals that keep derived data in sync
+        self.step("playlist summaries", PlaylistSummary.rebuild_all)
+        self.step("search index", self.rebuild_search_index)
+        catalog.record_reset()
+        bump_version(CATALOG)
+
+        elapsed = time.perf_counter() - start
+        if self.search_failed:
+            raise CommandError(f"Generated {self.rows} rows, but the search index is out of date; run rebuild_search_index.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {self.rows} rows in {elapsed:.1f}s ({self.rows / elapsed:.0f} rows/s)."
+        ))
+
+    def step(self, name, function, *args):
+        self.stdout.write(f"Generating {name}...")
+        start, rows = time.perf_counter(), self.rows
+        result = function(*args)
+        self.stdout.write(f"  {self.rows - rows} rows in {time.perf_counter() - start:.1f}s")
+        return result
+
+    def sample_songs(self, size):
+        """Indexes into self.song_ids drawn by popularity, with replacement."""
+        return np.searchsorted(self.cdf, self.rng.random(size), side='right').clip(max=len(self.cdf) - 1)
+
+    def sample_counts(self, mean, size):
+        # Geometric counts: most users are light, a few are heavy
+        if mean <= 0:
+            return np.zeros(size, dtype=np.int64)
+        return self.rng.geometric(1 / (mean + 1), size) - 1
+
+    def timestamps(self, size):
+        seconds = self.rng.integers(0, SPAN_DAYS * 24 * 3600, size)
+        now = connection.ops.adapt_datetimefield_value(self.now)
+        if not size:
+            return []
+        if isinstance(now, str):
+            # Backends storing text (SQLite, MySQL) get the same format, built without datetime objects
+            values = np.datetime64(now, 'us') - seconds.astype('timedelta64[s]')
+            return np.char.replace(np.datetime_as_string(values, unit='us'), 'T', ' ').tolist()
+        return [connection.ops.adapt_datetimefield_value(self.now - timedelta(seconds=int(s))) for s in seconds]
+
+    def words(self, count):
+        syllables = self.rng.integers(0, len(SYLLABLES), (count, 3))
+        return [''.join(SYLLABLES[i] for i in row).capitalize() for row in syllables]
+
+    def next_id(self, model):
+        return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+    def insert(self, model, fields, rows):
+        """Insert `rows` (tuples in `fields` order) with executemany, one transaction per batch."""
+        quote = connection.ops.quote_name
+        sql = (
+            f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(model._meta.get_field(field).column) for field in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))})"
+        )
+        for start in range(0, len(rows), self.batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, rows[start:start + self.batch_size])
+        self.rows += len(rows)
+
+    def create_catalog(self, n_songs):
+        n_albums = max(n_songs // 10, 1)
+        n_artists = max(n_songs // 20, 1)
+        n_tags = 50
+        album_id, artist_id, tag_id, song_id = (self.next_id(model) for model in (Album, Artist, Tag, Song))
+
+        albums = []
+        for offset, title in enumerate(self.words(n_albums)):
+            album = Album(id=album_id + offset, code=f"{self.prefix}{album_id + offset}", title=f"{title} {album_id + offset}", year=int(self.rng.integers(1970, 2025)))
+            album.set_thumbnail_paths()
+            albums.append(album)
+        artists = []
+        for offset, name in enumerate(self.words(n_artists)):
+            artist = Artist(id=artist_id + offset, name=f"{name} {artist_id + offset}")
+            artist.set_thumbnail_paths()
+            artists.append(artist)
+        tags = [Tag(id=tag_id + offset, name=f"{name} {tag_id + offset}") for offset, name in enumerate(self.words(n_tags))]
+
+        song_albums = self.rng.integers(0, n_albums, n_songs)
+        durations = self.rng.uniform(120, 360, n_songs).round(2)
+        songs = []
+        for offset, name in enumerate(self.words(n_songs)):
+            album = albums[song_albums[offset]]
+            song = Song(id=song_id + offset, original_name=f"{name} {song_id + offset}", album_id=album.id, duration=float(durations[offset]))
+            song.set_file_paths(album.code)
+            songs.append(song)
+
+        # One or two artists and one tag per song
+        song_artists = []
+        for offset in range(n_songs):
+            for artist in set(self.rng.integers(0, n_artists, self.rng.integers(1, 3))):
+                song_artists.append(SongArtist(song_id=song_id + offset, artist_id=artist_id + int(artist)))
+        song_tags = [SongTag(song_id=song_id + offset, tag_id=tag_id + int(tag)) for offset, tag in enumerate(self.rng.integers(0, n_tags, n_songs))]
+
+        for model, objs in ((Album, albums), (Artist, artists), (Tag, tags), (Song, songs), (SongArtist, song_artists), (SongTag, song_tags)):
+            with transaction.atomic():
+                model.objects.bulk_create(objs, batch_size=self.batch_size)
+            self.rows += len(objs)
+        return np.arange(song_id, song_id + n_songs, dtype=np.int64)
+
+    def create_users(self, n_users):
+        first_id = self.next_id(User)
+        # Hashing is deliberately slow, so every generated user shares one password
+        password = make_password(self.prefix)
+        joined = connection.ops.adapt_datetimefield_value(self.now - timedelta(days=SPAN_DAYS))
+        self.insert(User, ['id', 'username', 'email', 'password', 'first_name', 'last_name', 'is_staff', 'is_active', 'is_superuser', 'date_joined'], [
+            (id, f"{self.prefix}{id}", f"{self.prefix}{id}@example.com", password, '', '', False, True, False, joined)
+            for id in range(first_id, first_id + n_users)
+        ])
+        return list(range(first_id, first_id + n_users))
+
+    def for_user_batches(self, user_ids, counts):
+        """Yield (user_ids, counts) slices holding about batch_size rows each."""
+        start = 0
+        while start < len(user_ids):
+            stop, rows = start, 0
+            while stop < len(user_ids) and (rows == 0 or rows + counts[stop] <= self.batch_size):
+                rows += counts[stop]
+                stop += 1
+            yield user_ids[start:stop], counts[start:stop]
+            start = stop
+
+    def create_history(self, user_ids, mean):
+        # Each user plays songs by popularity; repeated plays become the history count
+        plays_per_user = (self.sample_counts(mean, len(user_ids)) * 1.5).astype(np.int64)
+        fields = ['user', 'song', 'accessed_at', 'count']
+        for users, counts in self.for_user_batches(user_ids, plays_per_user):
+            rows = []
+            for user_id, plays in zip(users, counts):
+                indexes, repeats = np.unique(self.sample_songs(plays), return_counts=True)
+                np.add.at(self.plays, indexes, repeats)
+                rows.extend(zip([user_id] * len(indexes), self.song_ids[indexes].tolist(), self.timestamps(len(indexes)), repeats.tolist()))
+            self.insert(UserSongHistory, fields, rows)
+
+    def create_likes(self, user_ids, mean):
+        counts = self.sample_counts(mean, len(user_ids))
+        for users, batch_counts in self.for_user_batches(user_ids, counts):
+            rows = []
+            for user_id, likes in zip(users, batch_counts):
+                indexes = np.unique(self.sample_songs(likes))
+                self.liked[indexes] += 1
+                rows.extend(zip([user_id] * len(indexes), self.song_ids[indexes].tolist(), self.timestamps(len(indexes))))
+            self.insert(UserLikedSong, ['user', 'song', 'liked_at'], rows)
+
+    def create_playlists(self, user_ids, mean, mean_songs):
+        counts = self.sample_counts(mean, len(user_ids))
+        playlist_id = self.next_id(Playlist)
+        for users, batch_counts in self.for_user_batches(user_ids, counts * max(mean_songs, 1)):
+            playlists, playlist_songs = [], []
+            names = iter(self.words(int(batch_counts.sum())))
+            for user_id, n_playlists in zip(users, batch_counts // max(mean_songs, 1)):
+                for created_at in self.timestamps(n_playlists):
+                    playlists.append((playlist_id, user_id, next(names), str(self.rng.choice(['Private', 'Public'])), created_at, created_at))
+                    indexes = np.unique(self.sample_songs(max(1, int(self.sample_counts(mean_songs, 1)[0]))))
+                    self.rng.shuffle(indexes)
+                    playlist_songs.extend(
+                        (playlist_id, song_id, position * PlaylistSong.POSITION_STEP)
+                        for position, song_id in enumerate(self.song_ids[indexes].tolist(), start=1)
+                    )
+                    playlist_id += 1
+            self.insert(Playlist, ['id', 'user', 'name', 'privacy_type', 'created_at', 'updated_at'], playlists)
+            self.insert(PlaylistSong, ['playlist', 'song', 'position'], playlist_songs)
+
+    def create_song_requests(self, user_ids, mean):
+        counts = self.rng.poisson(mean, len(user_ids))
+        statuses = [status for status, _ in SongRequest.STATUS_CHOICES]
+        names = iter(self.words(int(counts.sum())))
+        rows = []
+        for user_id, n_requests in zip(user_ids, counts):
+            for created_at in self.timestamps(n_requests):
+                status = statuses[int(self.rng.integers(0, len(statuses)))]
+                rows.append((user_id, next(names), "Generated request", status, None if status == "Pending" else "Generated answer", created_at, created_at))
+        self.insert(SongRequest, ['user', 'name', 'description', 'status', 'answer', 'created_at', 'updated_at'], rows)
+
+    def update_song_counters(self):
+        changed = np.flatnonzero(self.plays | self.liked)
+        quote = connection.ops.quote_name
+        sql = f"UPDATE {quote(Song._meta.db_table)} SET count = count + %s, liked_count = liked_count + %s WHERE id = %s"
+        rows = list(zip(self.plays[changed].tolist(), self.liked[changed].tolist(), self.song_ids[changed].tolist()))
+        for start in range(0, len(rows), self.batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, rows[start:start + self.batch_size])
+
+    def rebuild_search_index(self):
+        if connection.vendor != 'sqlite':
+            return
+        try:
+            search.rebuild()
+        except DatabaseError as e:
+            self.stderr.write(f"Failed to rebuild the search index: {e}")
+            self.search_failed = True
@@ -0,0 +1,58 @@
+import os
+import re
+import time
+from django.core.management.base import BaseCommand, CommandError
+from songs.models import Song
+from songs.lyrics import parse_lrc, store_lyrics
+from tqdm import tqdm
+
+# Files are named after the song, like the lrc/{id}.lrc paths in Song.lyrics
+FILENAME_RE = re.compile(r'^(\d+)\.lrc$', re.IGNORECASE)
+
+
+class Command(BaseCommand):
+    help = "Parse a directory of {song id}.lrc files and store them as synced lyrics."
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help="Directory holding the LRC files.")
+        parser.add_argument(
+            '--batch-size', type=int, default=500, help="Songs written per upsert."
+        )
+
+    def handle(self, *args, **kwargs):
+        directory = kwargs['directory']
+        if not os.path.isdir(directory):
+            raise CommandError(f"{directory} is not a directory.")
+        batch_size = kwargs['batch_size']
+
+        files = {}
+        for name in os.listdir(directory):
+            match = FILENAME_RE.match(name)
+            if match:
+                files[int(match.group(1))] = os.path.join(directory, name)
+        known = set(Song.objects.filter(id__in=files).values_list('id', flat=True))
+        song_ids = sorted(known)
+        skipped = len(files) - len(known)
+
+        start = time.perf_counter()
+        stored = lines = empty = 0
+        with tqdm(total=len(song_ids), desc="lyrics", unit="file") as bar:
+            for batch_start in range(0, len(song_ids), batch_size):
+                batch = {}
+                for song_id in song_ids[batch_start:batch_start + batch_size]:
+                    with open(files[song_id], encoding='utf-8-sig', errors='replace') as f:
+                        lyrics = parse_lrc(f.read())
+                    if not len(lyrics):
+                        empty += 1
+                        continue
+                    batch[song_id] = lyrics
+                    lines += len(lyrics)
+                store_lyrics(batch)
+                stored += len(batch)
+                bar.update(min(batch_size, len(song_ids) - batch_start))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored lyrics of {stored} songs ({lines} lines) in {elapsed:.1f}s; "
+            f"{empty} files had no timed lines, {skipped} did not match a song."
+        ))
@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from songs.assets import (
+    ASSET_UPLOAD_MAX_ATTEMPTS, ASSET_DELETE_BATCH_SIZE, get_storage, claim_due_jobs, requeue_stale_jobs,
+    upload, delete_files, deletions_done, job_succeeded, job_failed,
+)
+
+
+class Command(BaseCommand):
+    help = "Upload files queued by the admin forms and remove files of deleted rows, retrying failures with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4, help="Uploads running at the same time."
+        )
+        parser.add_argument(
+            '--max-attempts', type=int, default=ASSET_UPLOAD_MAX_ATTEMPTS,
+            help="Attempts before a job is marked as failed."
+        )
+        parser.add_argument(
+            '--loop', action='store_true', help="Keep polling for new jobs instead of exiting once the queue is empty."
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5.0, help="Seconds between polls with --loop."
+        )
+        parser.add_argument(
+            '--stale-after', type=int, default=600,
+            help="Seconds after which a running job is assumed to belong to a dead worker and is queued again."
+        )
+
+    def handle(self, *args, **kwargs):
+        workers = kwargs['workers']
+        max_attempts = kwargs['max_attempts']
+        requeued = requeue_stale_jobs(timedelta(seconds=kwargs['stale_after']))
+        if requeued:
+            self.stdout.write(f"Queued {requeued} stale jobs again.")
+
+        # One storage client for the whole run; uploads share its connection
+        storage = get_storage()
+        uploaded = deleted = failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                # Deletions go first, as one commit, so no upload moves the branch underneath them
+                delete_jobs = claim_due_jobs(ASSET_DELETE_BATCH_SIZE, operation='Delete')
+                if delete_jobs:
+                    start = time.perf_counter()
+                    try:
+                        failures = delete_files(storage, delete_jobs)
+                    except Exception as e:
+                        failures = {job.path: e for job in delete_jobs}
+                    for job in delete_jobs:
+                        if job.path in failures:
+                            self.stderr.write(f"Failed to delete {job.path} (attempt {job.attempts + 1}): {failures[job.path]}")
+                            job_failed(job, failures[job.path], max_attempts)
+                            failed += 1
+                    done = [job for job in delete_jobs if job.path not in failures]
+                    deletions_done(done)
+                    deleted += len(done)
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f"Processed {len(delete_jobs)} deletions in {elapsed:.2f}s.")
+
+                jobs = claim_due_jobs(workers * 4)
+                if not jobs:
+                    if delete_jobs:
+                        continue
+                    if not kwargs['loop']:
+                        break
+                    time.sleep(kwargs['interval'])
+                    continue
+
+                start = time.perf_counter()
+                futures = [(job, executor.submit(upload, storage, job)) for job in jobs]
+                # Job rows are updated here, so the upload threads never touch the database
+                for job, future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.stderr.write(f"Failed to upload {job.path} (attempt {job.attempts + 1}): {e}")
+                        job_failed(job, e, max_attempts)
+                        failed += 1
+                    else:
+                        job_succeeded(job)
+                        uploaded += 1
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"Processed {len(jobs)} jobs in {elapsed:.2f}s.")
+
+        self.stdout.write(self.style.SUCCESS(f"Uploaded {uploaded} files, deleted {deleted}, {failed} failed attempts."))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from songs import catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete catalog change log rows older than --days. Clients synced before the oldest kept row "
+        "download the catalog snapshot again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=catalog.CHANGES_RETENTION_DAYS, help="Days of changes to keep."
+        )
+
+    def handle(self, *args, **kwargs):
+        deleted = catalog.prune(kwargs['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} catalog changes; the catalog is at version {catalog.current_version()}."
+        ))
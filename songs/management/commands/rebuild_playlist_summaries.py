@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from songs.models import PlaylistSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized song count, cover and total duration of every playlist."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000, help="Number of playlists rebuilt per query."
+        )
+
+    def handle(self, *args, **kwargs):
+        start = time.perf_counter()
+        with transaction.atomic():
+            rebuilt = PlaylistSummary.rebuild_all(batch_size=kwargs['batch_size'])
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} playlist summaries in {elapsed:.2f}s."))
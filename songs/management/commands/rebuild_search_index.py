@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from songs import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of songs, albums, artists, tags and lyric lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=2000, help="Number of songs indexed per batch."
+        )
+
+    def handle(self, *args, **kwargs):
+        if connection.vendor != 'sqlite':
+            raise CommandError("Full-text search needs SQLite with FTS5.")
+
+        start = time.perf_counter()
+        try:
+            with transaction.atomic():
+                indexed = search.rebuild(batch_size=kwargs['batch_size'])
+        except DatabaseError as e:
+            raise CommandError(f"Failed to rebuild the search index: {e}")
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} songs in {elapsed:.2f}s."))
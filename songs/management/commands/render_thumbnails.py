@@ -0,0 +1,70 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from songs.images import THUMBNAIL_SIZES, IMAGE_FORMATS, build_derivatives_many
+
+
+class Command(BaseCommand):
+    help = "Render thumbnails of many square source images in parallel, e.g. before a bulk catalog import."
+
+    def add_arguments(self, parser):
+        parser.add_argument('sources', nargs='+', help="Source images, or directories of them.")
+        parser.add_argument(
+            '--output', type=str, required=True,
+            help="Directory the thumbnails are written to, as <size>x<size>/<source name>.<format>."
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None, help="Worker processes (defaults to the number of CPUs)."
+        )
+        parser.add_argument(
+            '--sizes', type=str, default=','.join(map(str, THUMBNAIL_SIZES)), help="Comma separated sizes."
+        )
+        parser.add_argument(
+            '--formats', type=str, default=','.join(IMAGE_FORMATS), help="Comma separated formats (png, webp)."
+        )
+
+    def handle(self, *args, **kwargs):
+        paths = []
+        for source in kwargs['sources']:
+            if os.path.isdir(source):
+                paths.extend(
+                    os.path.join(source, name) for name in sorted(os.listdir(source))
+                    if name.lower().endswith(('.jpg', '.jpeg', '.png'))
+                )
+            elif os.path.exists(source):
+                paths.append(source)
+            else:
+                raise CommandError(f"{source} does not exist.")
+        sizes = [int(size) for size in kwargs['sizes'].split(',')]
+        formats = kwargs['formats'].split(',')
+
+        def contents():
+            for path in paths:
+                with open(path, 'rb') as f:
+                    yield f.read()
+
+        start = time.perf_counter()
+        source_bytes = output_bytes = failed = 0
+        results = build_derivatives_many(contents(), sizes, formats, workers=kwargs['workers'])
+        for index, result in results:
+            path = paths[index]
+            if isinstance(result, Exception):
+                self.stderr.write(f"Failed to render {path}: {result}")
+                failed += 1
+                continue
+            name = os.path.splitext(os.path.basename(path))[0]
+            for (size, format), content in result.files.items():
+                target = os.path.join(kwargs['output'], f'{size}x{size}', f'{name}.{format}')
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as f:
+                    f.write(content)
+            source_bytes += result.source_bytes
+            output_bytes += result.output_bytes
+            self.stdout.write(f"{path}: {result.summary()}")
+
+        elapsed = time.perf_counter() - start
+        rendered = len(paths) - failed
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {rendered} images ({source_bytes / 1024 / 1024:.1f} MiB in, "
+            f"{output_bytes / 1024 / 1024:.1f} MiB out) in {elapsed:.1f}s, {failed} failed."
+        ))
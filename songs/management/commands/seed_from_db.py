@@ -1,84 +1,270 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+import json
+import os
 import sqlite3
-from songs.models import Album, Artist, Tag, Song, SongArtist, SongTag
+import time
+from songs.models import Album, Artist, Tag, Song, SongArtist, SongTag, PlaylistSummary
+from songs import search, catalog
+from songs.signals import playlist_songs_changed
+from songs.versions import CATALOG, bump_version, album_scope, artist_scope, tag_scope
 from config import CONFIG
 from tqdm import tqdm  # Import tqdm for progress bars
 
+# Source tables in dependency order: (table, columns, model)
+TABLES = [
+    ("albums", "id, code, title, year", Album),
+    ("artists", "id, name", Artist),
+    ("tags", "id, name", Tag),
+    ("songs", "id, title, url, original_name, lyrics, album_id", Song),
+    ("songartists", "song_id, artist_id", SongArtist),
+    ("songtags", "song_id, tag_id", SongTag),
+]
+
+# Columns overwritten when a source row is imported again; play counts and durations stay
+UPDATE_FIELDS = {
+    Album: ['code', 'title', 'year', 'thumbnail300x300', 'thumbnail1200x1200'],
+    Artist: ['name', 'thumbnail300x300', 'thumbnail1200x1200'],
+    Tag: ['name'],
+    Song: ['title', 'url', 'original_name', 'lyrics', 'album'],
+}
+
+
 class Command(BaseCommand):
     help = "Seed data from another SQLite database"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source', type=str, default=None, help="Source SQLite database (defaults to SEED_DB_PATH)."
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=2000, help="Rows read, written and committed per batch."
+        )
+        parser.add_argument(
+            '--checkpoint', type=str, default=None,
+            help="Checkpoint file (defaults to SEED_CHECKPOINT_PATH, or seed_checkpoint.json)."
+        )
+        parser.add_argument(
+            '--resume', action='store_true', help="Continue an interrupted import from the checkpoint."
+        )
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help="Only import rows added (or, for tables with an updated_at column, changed) since the last completed import."
+        )
+
     def handle(self, *args, **kwargs):
-        # Connect to the source SQLite database
-        source_conn = sqlite3.connect(CONFIG["SEED_DB_PATH"])  # Replace with your source DB path
-        cursor = source_conn.cursor()
+        source_path = kwargs['source'] or CONFIG["SEED_DB_PATH"]
+        self.checkpoint_path = kwargs['checkpoint'] or CONFIG.get("SEED_CHECKPOINT_PATH", "seed_checkpoint.json")
+        self.batch_size = kwargs['batch_size']
+        self.incremental = kwargs['incremental']
+        if not os.path.exists(source_path):
+            raise CommandError(f"Source database {source_path} does not exist.")
 
-        try:
-            # Seed Albums
-            self.stdout.write("Seeding Albums...")
-            cursor.execute("SELECT id, code, title, year, thumbnail300x300, thumbnail1200x1200 FROM albums")
-            albums = cursor.fetchall()
-            for id, code, title, year, thumb300, thumb1200 in tqdm(albums, desc="Albums", unit="album"):
-                Album.objects.get_or_create(
-                    id=id,
-                    code=code,
-                    title=title,
-                    year=year,
-                    thumbnail300x300=thumb300,
-                    thumbnail1200x1200=thumb1200,
-                )
-
-            # Seed Artists
-            self.stdout.write("Seeding Artists...")
-            cursor.execute("SELECT id, name, thumbnail300x300, thumbnail1200x1200 FROM artists")
-            artists = cursor.fetchall()
-            for artist_id, name, thumb300, thumb1200 in tqdm(artists, desc="Artists", unit="artist"):
-                Artist.objects.get_or_create(
-                    id=artist_id,
-                    name=name,
-                    thumbnail300x300=thumb300,
-                    thumbnail1200x1200=thumb1200,
-                )
-
-            # Seed Tags
-            self.stdout.write("Seeding Tags...")
-            cursor.execute("SELECT id, name FROM tags")
-            tags = cursor.fetchall()
-            for tag_id, name in tqdm(tags, desc="Tags", unit="tag"):
-                Tag.objects.get_or_create(id=tag_id, name=name)
-
-            # Seed Songs
-            self.stdout.write("Seeding Songs...")
-            cursor.execute("SELECT id, title, url, original_name, lyrics, album_id FROM songs")
-            songs = cursor.fetchall()
-            for song_id, title, url, original_name, lyrics, album_id in tqdm(songs, desc="Songs", unit="song"):
-                album = Album.objects.get(pk=album_id)  # Resolve foreign key for album
-                song = Song.objects.get_or_create(
-                    id=song_id,
-                    title=title,
-                    url=url,
-                    original_name=original_name,
-                    lyrics=lyrics,
-                    album=album,
-                )[0]
-
-                # Seed Song-Artist Relationship (Many-to-Many)
-                cursor.execute("SELECT artist_id FROM songartists WHERE song_id = ?", (song_id,))
-                artist_ids = cursor.fetchall()
-                for artist_id, in artist_ids:
-                    artist = Artist.objects.get(id=artist_id)  # Resolve artist by ID
-                    SongArtist.objects.get_or_create(song=song, artist=artist)
-
-                # Seed Song-Tag Relationship (Many-to-Many)
-                cursor.execute("SELECT tag_id FROM songtags WHERE song_id = ?", (song_id,))
-                tag_ids = cursor.fetchall()
-                for tag_id, in tag_ids:
-                    tag = Tag.objects.get(id=tag_id)  # Resolve tag by ID
-                    SongTag.objects.get_or_create(song=song, tag=tag)
-
-            self.stdout.write(self.style.SUCCESS("Data seeded successfully!"))
-
-        except Exception as e:
-            self.stderr.write(f"Error occurred: {e}")
+        self.checkpoint = self.load_checkpoint()
+        if not kwargs['resume']:
+            # A new run; `watermarks` from the last completed run are kept for --incremental
+            self.checkpoint["run"] = {}
+
+        # Target ids known to exist, so foreign keys resolve without a query per row
+        self.known = {
+            Album: set(Album.objects.values_list('id', flat=True)),
+            Artist: set(Artist.objects.values_list('id', flat=True)),
+            Tag: set(Tag.objects.values_list('id', flat=True)),
+            Song: set(Song.objects.values_list('id', flat=True)),
+        }
+        self.album_codes = dict(Album.objects.values_list('id', 'code'))
+        # Rows written by this run, including the batches before an interruption when resuming
+        touched = self.checkpoint["run"].get("touched", {})
+        self.touched = {model: set(touched.get(model.__name__, ())) for model in (Album, Artist, Tag, Song)}
+        self.song_album_ids = set(touched.get("song_albums", ()))
 
+        source_conn = sqlite3.connect(source_path)
+        try:
+            for table, columns, model in TABLES:
+                self.import_table(source_conn, table, columns, model)
         finally:
             source_conn.close()
+
+        # Before the run is closed, so a resume after a failure here refreshes the same rows
+        self.search_failed = False
+        self.refresh_derived_data()
+
+        run = self.checkpoint.pop("run")
+        run.pop("touched", None)
+        self.checkpoint["watermarks"].update(run)
+        self.checkpoint["run"] = {}
+        self.save_checkpoint()
+        if self.search_failed:
+            raise CommandError("Data seeded, but the search index is out of date; run rebuild_search_index.")
+        self.stdout.write(self.style.SUCCESS("Data seeded successfully!"))
+
+    def load_checkpoint(self):
+        checkpoint = {"run": {}, "watermarks": {}}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint.update(json.load(f))
+        return checkpoint
+
+    def save_checkpoint(self):
+        # Written then renamed so an interrupted write never loses the previous checkpoint
+        with open(f"{self.checkpoint_path}.tmp", 'w') as f:
+            json.dump(self.checkpoint, f)
+        os.replace(f"{self.checkpoint_path}.tmp", self.checkpoint_path)
+
+    def remember_touched(self):
+        self.checkpoint["run"]["touched"] = {
+            **{model.__name__: sorted(ids) for model, ids in self.touched.items()},
+            "song_albums": sorted(self.song_album_ids),
+        }
+
+    def import_table(self, source_conn, table, columns, model):
+        progress = self.checkpoint["run"].setdefault(table, {"rowid": 0, "updated_at": None, "done": False})
+        if progress["done"]:
+            self.stdout.write(f"Skipping {table}, already imported.")
+            return
+
+        watermark = self.checkpoint["watermarks"].get(table, {}) if self.incremental else {}
+        has_updated_at = any(row[1] == 'updated_at' for row in source_conn.execute(f"PRAGMA table_info({table})"))
+
+        conditions, params = ["rowid > ?"], [progress["rowid"]]
+        if has_updated_at:
+            columns = f"{columns}, updated_at"
+            if watermark.get("updated_at") is not None:
+                conditions.append("updated_at > ?")
+                params.append(watermark["updated_at"])
+        elif watermark.get("rowid"):
+            # Without updated_at only new rows can be told apart
+            conditions.append("rowid > ?")
+            params.append(watermark["rowid"])
+        where = " AND ".join(conditions)
+
+        total = source_conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}", params).fetchone()[0]
+        cursor = source_conn.execute(f"SELECT rowid, {columns} FROM {table} WHERE {where} ORDER BY rowid", params)
+
+        self.stdout.write(f"Seeding {table}...")
+        imported = skipped = 0
+        start = time.perf_counter()
+        with tqdm(total=total, desc=table, unit="row") as bar:
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                if has_updated_at:
+                    updated = [row[-1] for row in rows if row[-1] is not None]
+                    if updated:
+                        progress["updated_at"] = max([progress["updated_at"] or updated[0], *updated])
+                    rows = [row[:-1] for row in rows]
+
+                with transaction.atomic():
+                    written = self.write_rows(model, [row[1:] for row in rows])
+                imported += written
+                skipped += len(rows) - written
+
+                progress["rowid"] = rows[-1][0]
+                self.remember_touched()
+                self.save_checkpoint()
+                bar.update(len(rows))
+
+        # Keep the last completed run's watermark when nothing new arrived
+        if not progress["rowid"]:
+            progress["rowid"] = watermark.get("rowid", 0)
+        progress["updated_at"] = progress["updated_at"] or watermark.get("updated_at")
+        progress["done"] = True
+        self.save_checkpoint()
+
+        elapsed = time.perf_counter() - start
+        rate = (imported + skipped) / elapsed if elapsed else 0
+        self.stdout.write(f"  {imported} rows imported, {skipped} skipped in {elapsed:.1f}s ({rate:.0f} rows/s)")
+
+    def write_rows(self, model, rows):
+        """Upsert one batch of source rows; returns how many were written."""
+        if model is Album:
+            objs = []
+            for id, code, title, year in rows:
+                album = Album(id=id, code=code, title=title, year=year)
+                album.set_thumbnail_paths()
+                objs.append(album)
+                self.album_codes[id] = code
+        elif model is Artist:
+            objs = []
+            for id, name in rows:
+                artist = Artist(id=id, name=name)
+                artist.set_thumbnail_paths()
+                objs.append(artist)
+        elif model is Tag:
+            objs = [Tag(id=id, name=name) for id, name in rows]
+        elif model is Song:
+            objs = []
+            for id, title, url, original_name, lyrics, album_id in rows:
+                if album_id not in self.known[Album]:
+                    continue
+                song = Song(id=id, title=title, url=url, original_name=original_name, lyrics=lyrics, album_id=album_id)
+                if not url:
+                    song.set_file_paths(self.album_codes[album_id])
+                objs.append(song)
+                self.song_album_ids.add(album_id)
+        else:
+            return self.write_relations(model, rows)
+
+        model.objects.bulk_create(
+            objs, update_conflicts=True, unique_fields=['id'], update_fields=UPDATE_FIELDS[model]
+        )
+        ids = [obj.id for obj in objs]
+        self.known[model].update(ids)
+        self.touched[model].update(ids)
+        return len(objs)
+
+    def write_relations(self, model, rows):
+        # SongArtist and SongTag have no unique constraint, so existing pairs are filtered out here
+        other = Artist if model is SongArtist else Tag
+        other_field = 'artist_id' if model is SongArtist else 'tag_id'
+        pairs = {
+            (song_id, other_id) for song_id, other_id in rows
+            if song_id in self.known[Song] and other_id in self.known[other]
+        }
+        if not pairs:
+            return 0
+        existing = set(model.objects.filter(song_id__in={song_id for song_id, _ in pairs}).values_list('song_id', other_field))
+        new_pairs = sorted(pairs - existing)
+        model.objects.bulk_create([model(song_id=song_id, **{other_field: other_id}) for song_id, other_id in new_pairs])
+        self.touched[Song].update(song_id for song_id, _ in new_pairs)
+        self.touched[other].update(other_id for _, other_id in new_pairs)
+        return len(new_pairs)
+
+    def refresh_derived_data(self):
+        # Bulk writes skip the model signals that keep search and version counters in sync
+        touched = self.touched
+        if not any(touched.values()):
+            return
+        if self.incremental:
+            song_ids = set(touched[Song])
+            song_ids.update(Song.objects.filter(album_id__in=touched[Album]).values_list('id', flat=True))
+            song_ids.update(SongArtist.objects.filter(artist_id__in=touched[Artist]).values_list('song_id', flat=True))
+            song_ids.update(SongTag.objects.filter(tag_id__in=touched[Tag]).values_list('song_id', flat=True))
+            for kind, model, field in (('album', Album, 'title'), ('artist', Artist, 'name'), ('tag', Tag, 'name')):
+                for entity_id, name in model.objects.filter(id__in=touched[model]).values_list('id', field):
+                    search.index_entity(kind, entity_id, name)
+            search.index_songs(sorted(song_ids))
+            for entity, model in (('album', Album), ('artist', Artist), ('tag', Tag), ('song', Song)):
+                catalog.record_changes(entity, sorted(touched[model]))
+            # Covers follow the album's thumbnail path and each song's album
+            changed = PlaylistSummary.rebuild_for(album_ids=touched[Album], song_ids=touched[Song])
+            for playlist_id, user_id in changed.items():
+                playlist_songs_changed.send(sender=Album, playlist_id=playlist_id, user_id=user_id)
+        else:
+            if connection.vendor == 'sqlite':
+                self.stdout.write("Rebuilding the search index...")
+                try:
+                    search.rebuild()
+                except DatabaseError as e:
+                    self.stderr.write(f"Failed to rebuild the search index: {e}")
+                    self.search_failed = True
+            catalog.record_reset()
+            PlaylistSummary.rebuild_all()
+
+        bump_version(
+            CATALOG,
+            *(album_scope(id) for id in touched[Album] | self.song_album_ids),
+            *(artist_scope(id) for id in touched[Artist]),
+            *(tag_scope(id) for id in touched[Tag]),
+        )
@@ -1,17 +1,38 @@
 from django.db import models
+from django.db.models import Count, Sum, Max, F, Q, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils.timezone import now
 import urllib.parse
-from urllib.parse import unquote
-from github import Github
-from config import CONFIG
-
-class Album(models.Model):
+from .images import IMAGE_FORMATS
+
+# Whether a row's files (MP3 or thumbnails) have reached asset storage; see songs.assets
+ASSET_STATUS_CHOICES = [
+    ('Ready', 'Ready'),
+    ('Pending', 'Pending'),
+    ('Failed', 'Failed'),
+]
+
+class ThumbnailsMixin:
+    """Size ladder of an album or artist image; the model provides thumbnail_path(size, format)."""
+
+    def thumbnail_map(self):
+        """{size: URL-encoded path}, to pick the smallest image that covers the space it is shown in."""
+        if self.thumbnail_sizes and self.asset_status == 'Ready':
+            format = 'webp' if 'webp' in IMAGE_FORMATS else IMAGE_FORMATS[0]
+            return {str(size): urllib.parse.quote(self.thumbnail_path(size, format)) for size in self.thumbnail_sizes}
+        # Images from before the ladder, until backfill_thumbnails has rendered them
+        return {'300': self.thumbnail300x300, '1200': self.thumbnail1200x1200}
+
+class Album(ThumbnailsMixin, models.Model):
     code = models.CharField(max_length=255, unique=True, null=False)
     title = models.CharField(max_length=255, unique=True, null=False)
     year = models.IntegerField(null=False)
     thumbnail300x300 = models.CharField(max_length=10000, null=False)
     thumbnail1200x1200 = models.CharField(max_length=10000, null=False)
+    # Sizes rendered in every IMAGE_FORMATS encoding; empty for images that only have the two PNGs
+    thumbnail_sizes = models.JSONField(default=list, blank=True)
+    asset_status = models.CharField(max_length=7, choices=ASSET_STATUS_CHOICES, default='Ready')
 
     class Meta:
         ordering = ['-id']
@@ -19,47 +40,25 @@ class Album(models.Model):
     def __str__(self):
         return self.title
     
+    def thumbnail_path(self, size, format='png'):
+        return f'album-images/{size}x{size}/{self.code} - {self.title} ({self.year}).{format}'
+
+    def set_thumbnail_paths(self):
+        self.thumbnail300x300 = urllib.parse.quote(self.thumbnail_path(300))
+        self.thumbnail1200x1200 = urllib.parse.quote(self.thumbnail_path(1200))
+
     def save(self, *args, **kwargs):
         # Save the instance to generate the ID
-        filename = f'{self.code} - {self.title} ({self.year}).png'
-        self.thumbnail300x300 = urllib.parse.quote(f'album-images/300x300/{filename}')
-        self.thumbnail1200x1200 = urllib.parse.quote(f'album-images/1200x1200/{filename}')
+        self.set_thumbnail_paths()
         super().save(*args, **kwargs)
 
-    def delete(self, *args, **kwargs):
-        # Extract the file path from the URL field (URL-encoded)
-        file_paths = [unquote(self.thumbnail300x300), unquote(self.thumbnail1200x1200)]
-
-        # GitHub API details
-        github_token = CONFIG["GITHUB_TOKEN"]
-        branch_name = CONFIG["BRANCH_NAME"]
-        github_repo_name = CONFIG["GITHUB_REPO_NAME"]
-        github = Github(github_token)
-        repo = github.get_user().get_repo(github_repo_name)
-
-        for file_path in file_paths:
-            try:
-                # Get the file from GitHub to confirm it exists
-                file_contents = repo.get_contents(file_path, ref=branch_name)
-
-                # Delete the file from GitHub
-                repo.delete_file(
-                    file_path,  # Path of the file in the repo
-                    f"Delete PNG file {self.title}",  # Commit message
-                    file_contents.sha,  # SHA of the file to delete
-                    branch=branch_name  # Specify the branch to delete from
-                )
-                print(f"Successfully deleted {file_path} from GitHub.")
-            except Exception as e:
-                print(f"Failed to delete file {file_path} from GitHub: {e}")
-
-        # Now delete the song instance from the database
-        super().delete(*args, **kwargs)
-
-class Artist(models.Model):
+class Artist(ThumbnailsMixin, models.Model):
     name = models.CharField(max_length=255, null=False, unique=True)
     thumbnail300x300 = models.CharField(max_length=10000, null=False)
     thumbnail1200x1200 = models.CharField(max_length=10000, null=False)
+    # Sizes rendered in every IMAGE_FORMATS encoding; empty for images that only have the two PNGs
+    thumbnail_sizes = models.JSONField(default=list, blank=True)
+    asset_status = models.CharField(max_length=7, choices=ASSET_STATUS_CHOICES, default='Ready')
 
     class Meta:
         ordering = ['-id']
@@ -67,42 +66,17 @@ class Artist(models.Model):
     def __str__(self):
         return self.name
     
+    def thumbnail_path(self, size, format='png'):
+        return f'artist-images/{size}x{size}/{self.name}.{format}'
+
+    def set_thumbnail_paths(self):
+        self.thumbnail300x300 = urllib.parse.quote(self.thumbnail_path(300))
+        self.thumbnail1200x1200 = urllib.parse.quote(self.thumbnail_path(1200))
+
     def save(self, *args, **kwargs):
         # Save the instance to generate the ID
-        filename = f'{self.name}.png'
-        self.thumbnail300x300 = urllib.parse.quote(f'artist-images/300x300/{filename}')
-        self.thumbnail1200x1200 = urllib.parse.quote(f'artist-images/1200x1200/{filename}')
+        self.set_thumbnail_paths()
         super().save(*args, **kwargs)
-    
-    def delete(self, *args, **kwargs):
-        # Extract the file path from the URL field (URL-encoded)
-        file_paths = [unquote(self.thumbnail300x300), unquote(self.thumbnail1200x1200)]
-
-        # GitHub API details
-        github_token = CONFIG["GITHUB_TOKEN"]
-        branch_name = CONFIG["BRANCH_NAME"]
-        github_repo_name = CONFIG["GITHUB_REPO_NAME"]
-        github = Github(github_token)
-        repo = github.get_user().get_repo(github_repo_name)
-
-        for file_path in file_paths:
-            try:
-                # Get the file from GitHub to confirm it exists
-                file_contents = repo.get_contents(file_path, ref=branch_name)
-
-                # Delete the file from GitHub
-                repo.delete_file(
-                    file_path,  # Path of the file in the repo
-                    f"Delete PNG file {self.name}",  # Commit message
-                    file_contents.sha,  # SHA of the file to delete
-                    branch=branch_name  # Specify the branch to delete from
-                )
-                print(f"Successfully deleted {file_path} from GitHub.")
-            except Exception as e:
-                print(f"Failed to delete file {file_path} from GitHub: {e}")
-
-        # Now delete the song instance from the database
-        super().delete(*args, **kwargs)
 
 class Tag(models.Model):
     name = models.CharField(max_length=255, null=False, unique=True)
@@ -119,39 +93,15 @@ class Song(models.Model):
     count = models.PositiveBigIntegerField(default=0)
     liked_count = models.PositiveBigIntegerField(default=0)
     duration = models.FloatField(default=0, null=True, blank=True)
+    # kbit/s, the average for VBR files; read from the MP3 with duration
+    bitrate = models.PositiveIntegerField(null=True, blank=True)
+    # sha256 of the MP3, recorded when it is uploaded
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    asset_status = models.CharField(max_length=7, choices=ASSET_STATUS_CHOICES, default='Ready')
 
     class Meta:
         ordering = ['-id']
 
-    def delete(self, *args, **kwargs):
-        # Extract the file path from the URL field (URL-encoded)
-        file_path = unquote(self.url)
-
-        # GitHub API details
-        github_token = CONFIG["GITHUB_TOKEN"]
-        branch_name = CONFIG["BRANCH_NAME"]
-        github_repo_name = CONFIG["GITHUB_REPO_NAME"]
-        github = Github(github_token)
-        repo = github.get_user().get_repo(github_repo_name)
-
-        try:
-            # Get the file from GitHub to confirm it exists
-            file_contents = repo.get_contents(file_path, ref=branch_name)
-
-            # Delete the file from GitHub
-            repo.delete_file(
-                file_path,  # Path of the file in the repo
-                f"Delete MP3 file {self.title}",  # Commit message
-                file_contents.sha,  # SHA of the file to delete
-                branch=branch_name  # Specify the branch to delete from
-            )
-            print(f"Successfully deleted {file_path} from GitHub.")
-        except Exception as e:
-            print(f"Failed to delete file {file_path} from GitHub: {e}")
-
-        # Now delete the song instance from the database
-        super().delete(*args, **kwargs)
-
     def save(self, *args, **kwargs):
         if self.pk:
             original = Song.objects.get(pk=self.pk)
@@ -159,14 +109,17 @@ class Song(models.Model):
         super().save(*args, **kwargs)
         
         if not self.pk or self.url == "":
-            filename = f"{self.album.code} - {self.original_name}.mp3"
-            self.lyrics = f"lrc/{self.id}.lrc"
-            file_path = f'songs-file/{filename}'
-            encoded_url = urllib.parse.quote(file_path)
-            self.url = encoded_url
-            self.title = filename
+            self.set_file_paths()
             super().save(*args, **kwargs)
 
+    def set_file_paths(self, album_code=None):
+        filename = f"{album_code or self.album.code} - {self.original_name}.mp3"
+        self.lyrics = f"lrc/{self.id}.lrc"
+        file_path = f'songs-file/{filename}'
+        encoded_url = urllib.parse.quote(file_path)
+        self.url = encoded_url
+        self.title = filename
+
 class SongArtist(models.Model):
     song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='song_artists')
     artist = models.ForeignKey(Artist, on_delete=models.CASCADE, related_name='artist_songs')
@@ -186,6 +139,10 @@ class UserSongHistory(models.Model):
             models.UniqueConstraint(fields=['user', 'song'], name='unique_user_song_history')
         ]
         ordering = ['-accessed_at']
+        indexes = [
+            # Keyset pages of a user's history, newest first; the id tie-breaker rides along in the index
+            models.Index(fields=['user', 'accessed_at'], name='songhistory_accessed_idx'),
+        ]
 
 class UserLikedSong(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='liked_songs')
@@ -195,6 +152,9 @@ class UserLikedSong(models.Model):
     class Meta:
         unique_together = ('user', 'song')
         ordering = ['-liked_at']
+        indexes = [
+            models.Index(fields=['user', 'liked_at'], name='likedsong_liked_at_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.pk:
@@ -225,9 +185,269 @@ class Playlist(models.Model):
     class Meta:
         ordering = ['-updated_at']
 
+    def next_position(self):
+        """Position for a song appended at the end of the playlist."""
+        last = self.playlist_songs.aggregate(last=Max('position'))['last']
+        return (last or 0) + PlaylistSong.POSITION_STEP
+
+    def renumber_songs(self, ordered_ids=None):
+        """
+        Spread positions evenly, in the current order or in `ordered_ids`
+        (PlaylistSong ids), leaving room to move songs without renumbering.
+        """
+        if ordered_ids is None:
+            ordered_ids = list(self.playlist_songs.values_list('id', flat=True))
+        PlaylistSong.objects.bulk_update(
+            [
+                PlaylistSong(id=playlist_song_id, position=(index + 1) * PlaylistSong.POSITION_STEP)
+                for index, playlist_song_id in enumerate(ordered_ids)
+            ],
+            ['position'],
+            batch_size=500,
+        )
+
+    def move_song(self, playlist_song, after=None):
+        """Move `playlist_song` right after `after`, or to the top when `after` is None."""
+        for _ in range(2):
+            if after is None:
+                lower = None
+                candidates = self.playlist_songs.exclude(id=playlist_song.id)
+            else:
+                lower = after.position
+                candidates = self.playlist_songs.exclude(id=playlist_song.id).after(after)
+            upper = candidates.values_list('position', flat=True).first()
+
+            if lower is None:
+                lower = (upper if upper is not None else PlaylistSong.POSITION_STEP) - PlaylistSong.POSITION_STEP * 2
+            if upper is None:
+                upper = lower + PlaylistSong.POSITION_STEP * 2
+
+            if upper - lower > 1:
+                playlist_song.position = (lower + upper) // 2
+                playlist_song.save(update_fields=['position'])
+                return
+
+            # No gap left between the neighbours, spread positions out and retry
+            self.renumber_songs()
+            if after is not None:
+                after.refresh_from_db(fields=['position'])
+        raise RuntimeError("Could not find a free position in the playlist.")
+
+class PlaylistSongQuerySet(models.QuerySet):
+    def after(self, playlist_song):
+        """Rows that come after `playlist_song` in playlist order."""
+        return self.filter(
+            Q(position__gt=playlist_song.position) | Q(position=playlist_song.position, id__gt=playlist_song.id)
+        ).order_by('position', 'id')
+
+    def before(self, playlist_song):
+        """Rows that come before `playlist_song`, nearest first."""
+        return self.filter(
+            Q(position__lt=playlist_song.position) | Q(position=playlist_song.position, id__lt=playlist_song.id)
+        ).order_by('-position', '-id')
+
 class PlaylistSong(models.Model):
+    # Positions are sparse so a song can be moved between two others
+    # by taking the midpoint, without rewriting the rest of the playlist
+    POSITION_STEP = 1024
+
     playlist = models.ForeignKey(Playlist, on_delete=models.CASCADE, related_name='playlist_songs')
     song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='song_playlists')
+    position = models.BigIntegerField(default=0)
+
+    objects = PlaylistSongQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['playlist', 'position', 'id'], name='playlistsong_position_idx'),
+        ]
+
+class PlaylistSummary(models.Model):
+    """Denormalized song count, cover and total duration of a playlist."""
+    playlist = models.OneToOneField(Playlist, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    songs_count = models.PositiveIntegerField(default=0)
+    thumbnail = models.CharField(max_length=10000, null=True, blank=True)
+    total_duration = models.FloatField(default=0)
+
+    @classmethod
+    def for_playlist(cls, playlist):
+        """Return the playlist's summary, building it if it was never recorded."""
+        try:
+            return playlist.summary
+        except cls.DoesNotExist:
+            return cls.refresh(playlist)
+
+    @classmethod
+    def songs_added(cls, playlist, songs, created=False):
+        """
+        Account for `songs` appended to the playlist; their albums should be loaded.
+        Pass `created=True` when the playlist was just created with exactly these songs.
+        """
+        thumbnail = songs[0].album.thumbnail300x300 if songs else None
+        duration = sum(song.duration or 0 for song in songs)
+
+        if created:
+            playlist.summary = cls.objects.create(
+                playlist=playlist, songs_count=len(songs), total_duration=duration, thumbnail=thumbnail
+            )
+            return
+
+        updated = cls.objects.filter(playlist=playlist).update(
+            songs_count=F('songs_count') + len(songs),
+            total_duration=F('total_duration') + duration,
+            thumbnail=Coalesce(F('thumbnail'), Value(thumbnail)),
+        )
+        if not updated:
+            # Playlists from before summaries existed are rebuilt in full
+            cls.refresh(playlist)
+
+    @classmethod
+    def refresh(cls, playlist):
+        """Recompute the summary of one playlist from its songs."""
+        totals = playlist.playlist_songs.aggregate(
+            songs_count=Count('id'),
+            total_duration=Coalesce(Sum('song__duration'), Value(0.0)),
+        )
+        first_song = playlist.playlist_songs.select_related('song__album').first()
+        summary, _ = cls.objects.update_or_create(
+            playlist=playlist,
+            defaults={
+                'songs_count': totals['songs_count'],
+                'total_duration': totals['total_duration'],
+                'thumbnail': first_song.song.album.thumbnail300x300 if first_song else None,
+            }
+        )
+        playlist.summary = summary
+        return summary
+
+    @classmethod
+    def rebuild_all(cls, batch_size=1000, playlist_ids=None):
+        """Recompute every playlist summary, or those of `playlist_ids`, with one aggregate query per batch."""
+        first_thumbnail = PlaylistSong.objects.filter(playlist=OuterRef('pk')).values('song__album__thumbnail300x300')[:1]
+        playlists = Playlist.objects.order_by('id')
+        if playlist_ids is not None:
+            playlists = playlists.filter(id__in=playlist_ids)
+        playlists = playlists.annotate(
+            total_songs=Count('playlist_songs'),
+            duration=Coalesce(Sum('playlist_songs__song__duration'), Value(0.0)),
+            first_thumbnail=Subquery(first_thumbnail),
+        ).values_list('id', 'total_songs', 'duration', 'first_thumbnail')
+
+        rebuilt = 0
+        last_id = 0
+        while True:
+            batch = list(playlists.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                return rebuilt
+            cls.objects.bulk_create(
+                [
+                    cls(playlist_id=playlist_id, songs_count=total_songs, total_duration=duration, thumbnail=thumbnail)
+                    for playlist_id, total_songs, duration, thumbnail in batch
+                ],
+                update_conflicts=True,
+                unique_fields=['playlist'],
+                update_fields=['songs_count', 'total_duration', 'thumbnail'],
+            )
+            rebuilt += len(batch)
+            last_id = batch[-1][0]
+
+    @classmethod
+    def rebuild_for(cls, album_ids=(), song_ids=()):
+        """
+        Rebuild the summaries of the playlists holding songs of `album_ids`,
+        or any of `song_ids`. Returns {playlist id: owner id} of those whose
+        cover changed.
+        """
+        playlist_ids = list(
+            PlaylistSong.objects.filter(Q(song__album_id__in=album_ids) | Q(song_id__in=song_ids))
+            .values_list('playlist_id', flat=True).distinct()
+        )
+        if not playlist_ids:
+            return {}
+        summaries = cls.objects.filter(playlist_id__in=playlist_ids)
+        covers = dict(summaries.values_list('playlist_id', 'thumbnail'))
+        cls.rebuild_all(playlist_ids=playlist_ids)
+        return {
+            playlist_id: user_id
+            for playlist_id, thumbnail, user_id in summaries.values_list('playlist_id', 'thumbnail', 'playlist__user_id')
+            if covers.get(playlist_id) != thumbnail
+        }
+
+class RelatedSong(models.Model):
+    """Precomputed top neighbours of a song, written by the build_related_songs command."""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='neighbours')
+    related = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='neighbour_of')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
 
     class Meta:
-        ordering = ['id']
\ No newline at end of file
+        ordering = ['rank']
+        constraints = [
+            models.UniqueConstraint(fields=['song', 'rank'], name='unique_related_song_rank')
+        ]
+
+class SongLyrics(models.Model):
+    """A song's LRC lyrics, parsed by songs.lyrics into parallel lists of line times (ms) and texts."""
+    song = models.OneToOneField(Song, on_delete=models.CASCADE, primary_key=True, related_name='synced_lyrics')
+    times = models.JSONField(default=list)
+    lines = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class CatalogChange(models.Model):
+    """
+    One write to an album, artist, tag or song, recorded by songs.catalog.
+    The id is the catalog version that sync clients pass back to the changes
+    endpoint; a Reset asks them to download the snapshot again.
+    """
+    OPERATION_CHOICES = [
+        ('Upsert', 'Upsert'),
+        ('Delete', 'Delete'),
+        ('Reset', 'Reset'),
+    ]
+
+    entity = models.CharField(max_length=10, blank=True, default='')
+    object_id = models.BigIntegerField(null=True, blank=True)
+    operation = models.CharField(max_length=6, choices=OPERATION_CHOICES, default='Upsert')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+class AssetJob(models.Model):
+    """A file waiting to be written to or removed from asset storage, processed by the process_asset_uploads command."""
+    OPERATION_CHOICES = [
+        ('Upload', 'Upload'),
+        ('Delete', 'Delete'),
+    ]
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Running', 'Running'),
+        ('Done', 'Done'),
+        ('Failed', 'Failed'),
+    ]
+
+    # Row whose asset_status follows the job, e.g. ('song', 12)
+    entity = models.CharField(max_length=10)
+    object_id = models.BigIntegerField(null=True, blank=True)
+    operation = models.CharField(max_length=6, choices=OPERATION_CHOICES, default='Upload')
+    path = models.CharField(max_length=10000)
+    # Uploaded bytes waiting on disk; empty for deletions
+    spool_path = models.CharField(max_length=10000, blank=True, default='')
+    message = models.CharField(max_length=1000)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default='Pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='assetjob_due_idx'),
+            models.Index(fields=['entity', 'object_id'], name='assetjob_entity_idx'),
+        ]
+
+    def __str__(self):
+        return self.path
@@ -0,0 +1,165 @@
+import hashlib
+import struct
+
+# Reading MP3 duration and bitrate from the first frames of a file.
+#
+# VBR files written by LAME and most encoders start with a Xing/Info frame,
+# Fraunhofer encoders with a VBRI frame; both give the number of frames, so
+# the duration is exact. Without one the file is treated as CBR and the
+# duration follows from the audio size and the first frame's bitrate.
+
+# Bytes after the ID3v2 tag needed to find the first frame and its Xing/VBRI header
+HEADER_WINDOW = 16 * 1024
+
+_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Keyed by the version bits: 0 is MPEG 2.5, 2 MPEG 2, 3 MPEG 1
+_SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+
+
+class Mp3Error(ValueError):
+    pass
+
+
+class Mp3Info:
+    def __init__(self, duration, bitrate, sample_rate, vbr, audio_start):
+        self.duration = duration  # seconds
+        self.bitrate = bitrate  # kbit/s, the average for VBR files
+        self.sample_rate = sample_rate
+        self.vbr = vbr
+        self.audio_start = audio_start
+        self.content_hash = None  # sha256 hex digest, when the whole file was read
+
+    def __repr__(self):
+        return f'<Mp3Info {self.duration:.2f}s {self.bitrate}kbps{" VBR" if self.vbr else ""}>'
+
+
+def id3v2_size(data):
+    """Length of the ID3v2 tag at the start of `data` (10 bytes are enough), 0 if there is none."""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] & 0x7f) << 21 | (data[7] & 0x7f) << 14 | (data[8] & 0x7f) << 7 | (data[9] & 0x7f)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _frame_header(data, offset):
+    """(version, layer, bitrate, sample_rate, samples, length, mono) of the frame at `offset`, or None."""
+    if offset + 4 > len(data):
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xff or b1 & 0xe0 != 0xe0:
+        return None
+    version_bits, layer_bits = (b1 >> 3) & 3, (b1 >> 1) & 3
+    bitrate_index, rate_index, padding = b2 >> 4, (b2 >> 2) & 3, (b2 >> 1) & 1
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    layer = 4 - layer_bits
+    version = 1 if version_bits == 3 else 2
+    bitrate = _BITRATES[(version, layer)][bitrate_index]
+    sample_rate = _SAMPLE_RATES[version_bits][rate_index]
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == 1 else 576
+        length = samples // 8 * bitrate * 1000 // sample_rate + padding
+    return version, layer, bitrate, sample_rate, samples, length, (b3 >> 6) == 3
+
+
+def _find_first_frame(data):
+    offset = data.find(b'\xff')
+    while offset != -1:
+        header = _frame_header(data, offset)
+        # A second frame header right after the first rules out a false sync in tag padding
+        if header and (offset + header[5] + 4 > len(data) or _frame_header(data, offset + header[5])):
+            return offset, header
+        offset = data.find(b'\xff', offset + 1)
+    raise Mp3Error("No MPEG audio frame found.")
+
+
+def parse_audio(data, audio_start, total_size, has_id3v1=False):
+    """
+    Work out duration and bitrate from `data`, the bytes of the file
+    starting at `audio_start` (HEADER_WINDOW of them is plenty).
+    `total_size` is the size of the whole file.
+    """
+    offset, (version, layer, bitrate, sample_rate, samples, length, mono) = _find_first_frame(data)
+    frame_start = audio_start + offset
+    audio_bytes = total_size - frame_start - (128 if has_id3v1 else 0)
+
+    frames = vbr_bytes = None
+    vbr = False
+    side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    xing = offset + 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        vbr = data[xing:xing + 4] == b'Xing'
+        flags, = struct.unpack('>I', data[xing + 4:xing + 8])
+        position = xing + 8
+        if flags & 1:
+            frames, = struct.unpack('>I', data[position:position + 4])
+            position += 4
+        if flags & 2:
+            vbr_bytes, = struct.unpack('>I', data[position:position + 4])
+    elif data[offset + 36:offset + 40] == b'VBRI':
+        vbr = True
+        vbr_bytes, frames = struct.unpack('>II', data[offset + 46:offset + 54])
+
+    if frames:
+        duration = frames * samples / sample_rate
+        average = (vbr_bytes or audio_bytes) * 8 / duration / 1000 if duration else bitrate
+        return Mp3Info(duration, round(average), sample_rate, vbr, frame_start)
+    return Mp3Info(audio_bytes * 8 / (bitrate * 1000), bitrate, sample_rate, False, frame_start)
+
+
+def parse_header(data, total_size):
+    """
+    Parse `data`, the first bytes of a file of `total_size` bytes. Raises
+    Mp3Error when the ID3v2 tag runs past `data`; read from
+    id3v2_size(data) onwards and call parse_audio instead.
+    """
+    audio_start = id3v2_size(data)
+    if audio_start >= len(data):
+        raise Mp3Error("The ID3v2 tag is longer than the bytes read.")
+    return parse_audio(data[audio_start:], audio_start, total_size)
+
+
+class Mp3Probe:
+    """
+    Streaming reader: feed it the file in chunks with update() and call
+    finish() for the Mp3Info, with content_hash set. Only the ID3v2 header
+    and the first HEADER_WINDOW bytes of audio are kept in memory.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha256()
+        self._head = bytearray()
+        self._audio = bytearray()
+        self._tail = b''
+        self._audio_start = None
+        self.size = 0
+
+    def update(self, chunk):
+        self._hash.update(chunk)
+        start, self.size = self.size, self.size + len(chunk)
+        if self._audio_start is None:
+            self._head += chunk[:10 - len(self._head)]
+            if len(self._head) == 10:
+                self._audio_start = id3v2_size(self._head)
+        if self._audio_start is not None and len(self._audio) < HEADER_WINDOW and self.size > self._audio_start:
+            window = chunk[max(0, self._audio_start - start):]
+            self._audio += window[:HEADER_WINDOW - len(self._audio)]
+        self._tail = (self._tail + chunk)[-128:]
+
+    def finish(self):
+        if self._audio_start is None:
+            raise Mp3Error("The file is too short to be an MP3.")
+        info = parse_audio(bytes(self._audio), self._audio_start, self.size, has_id3v1=self._tail[:3] == b'TAG')
+        info.content_hash = self._hash.hexdigest()
+        return info
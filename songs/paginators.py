@@ -1,5 +1,96 @@
-from rest_framework.pagination import LimitOffsetPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 class CustomLimitOffsetPagination(LimitOffsetPagination):
     default_limit = 10  # Default limit if none is specified
-    max_limit = 25  # Maximum limit allowed
\ No newline at end of file
+    max_limit = 25  # Maximum limit allowed
+
+class KeysetPagination(BasePagination):
+    """
+    Pages through a queryset ordered by (sort key, id), both in the same
+    direction, e.g. ('-accessed_at', '-id'), ('position', 'id') or ('-id',).
+    The cursor is an opaque token of the last row's (sort key, id), and each
+    page is read as a range of the index on the sort key, with no COUNT and
+    no OFFSET.
+
+    Pass `?cursor=` (empty) for the first page and follow `next` after that.
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = CustomLimitOffsetPagination.limit_query_param
+    default_limit = CustomLimitOffsetPagination.default_limit
+    max_limit = CustomLimitOffsetPagination.max_limit
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        ordering = queryset.query.order_by
+        if not 1 <= len(ordering) <= 2 or ordering[-1].lstrip('-') != 'id':
+            raise ValueError("KeysetPagination needs a queryset ordered by (sort key, id).")
+        self.key = ordering[0].lstrip('-')
+        self.descending = ordering[0].startswith('-')
+        field = queryset.model._meta.get_field(self.key)
+
+        position = self.decode_cursor(request, field)
+        if position is not None:
+            queryset = queryset.filter(self.after(*position))
+
+        rows = list(queryset[:self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        rows = rows[:self.limit]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def after(self, key, row_id):
+        """Rows after (key, row_id); the bound on the key alone keeps the read an index range."""
+        if self.key == 'id':
+            return Q(id__lt=row_id) if self.descending else Q(id__gt=row_id)
+        if self.descending:
+            return Q(**{f'{self.key}__lte': key}) & (Q(**{f'{self.key}__lt': key}) | Q(id__lt=row_id))
+        return Q(**{f'{self.key}__gte': key}) & (Q(**{f'{self.key}__gt': key}) | Q(id__gt=row_id))
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return min(max(limit, 1), self.max_limit)
+
+    def decode_cursor(self, request, field):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            key, row_id = json.loads(urlsafe_b64decode(token.encode('ascii')))
+            return field.to_python(key), int(row_id)
+        except (TypeError, ValueError, ValidationError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row):
+        key = getattr(row, self.key)
+        position = [key.isoformat() if hasattr(key, 'isoformat') else key, row.id]
+        return urlsafe_b64encode(json.dumps(position).encode()).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+def get_paginator(request):
+    """KeysetPagination when the request has a cursor parameter, limit/offset for older clients."""
+    if KeysetPagination.cursor_query_param in request.query_params:
+        return KeysetPagination()
+    return CustomLimitOffsetPagination()
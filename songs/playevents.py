@@ -0,0 +1,217 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.utils.timezone import now
+from config import CONFIG
+
+from .models import Song, UserSongHistory
+from .versions import bump_version, user_scope
+
+logger = logging.getLogger(__name__)
+
+
+def apply_play_events(history, song_counts):
+    """
+    Write a batch of coalesced plays to the database in one transaction.
+
+    `history` maps (user_id, song_id) -> [plays, last_accessed_at] and
+    `song_counts` maps song_id -> plays. Plays of songs deleted since they
+    were recorded are dropped, and so is the history of deleted users;
+    returns the number of plays dropped.
+    """
+    with transaction.atomic():
+        live_song_ids = set(Song.objects.filter(id__in=song_counts).values_list('id', flat=True))
+        live_user_ids = set(User.objects.filter(id__in={user_id for user_id, _ in history}).values_list('id', flat=True))
+        # Rows referencing them would fail the whole batch at commit, on every retry
+        dropped = sum(plays for song_id, plays in song_counts.items() if song_id not in live_song_ids)
+        song_counts = {song_id: plays for song_id, plays in song_counts.items() if song_id in live_song_ids}
+        history = {
+            (user_id, song_id): entry for (user_id, song_id), entry in history.items()
+            if user_id in live_user_ids and song_id in live_song_ids
+        }
+
+        if history:
+            _upsert_history(history)
+
+        # Songs played the same number of times share one UPDATE
+        songs_by_increment = defaultdict(list)
+        for song_id, plays in song_counts.items():
+            songs_by_increment[plays].append(song_id)
+        for plays, song_ids in songs_by_increment.items():
+            Song.objects.filter(id__in=song_ids).update(count=F('count') + plays)
+
+    if history:
+        # The upsert skips model signals; move the listeners' versions here
+        bump_version(*{user_scope(user_id) for user_id, _ in history})
+    return dropped
+
+
+def _upsert_history(history):
+    qn = connection.ops.quote_name
+    opts = UserSongHistory._meta
+    table = qn(opts.db_table)
+    user_col = qn(opts.get_field('user').column)
+    song_col = qn(opts.get_field('song').column)
+    accessed_col = qn(opts.get_field('accessed_at').column)
+    count_col = qn(opts.get_field('count').column)
+
+    sql = (
+        f"INSERT INTO {table} ({user_col}, {song_col}, {accessed_col}, {count_col}) "
+        f"VALUES (%s, %s, %s, %s) "
+        f"ON CONFLICT ({user_col}, {song_col}) DO UPDATE SET "
+        f"{count_col} = {table}.{count_col} + excluded.{count_col}, "
+        f"{accessed_col} = excluded.{accessed_col}"
+    )
+    params = [
+        (user_id, song_id, connection.ops.adapt_datetimefield_value(accessed_at), plays)
+        for (user_id, song_id), (plays, accessed_at) in history.items()
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+class PlayEventBuffer:
+    """
+    In-process write-behind buffer for song plays.
+
+    Plays are coalesced per (user, song) and per song, then flushed as one
+    bulk upsert plus a handful of F() increments once `max_pending` plays are
+    waiting or `flush_interval` seconds have passed, whichever comes first.
+
+    A batch that fails to write is put back and retried with the next
+    flush; after `max_retries` failures in a row it is dropped, so one bad
+    batch cannot grow the buffer forever.
+
+    `mode` is the durability knob:
+    - "immediate": every play is written before the request returns.
+    - "buffered": plays are written behind; at most `flush_interval` seconds
+      of plays can be lost if the process dies without a graceful shutdown.
+    """
+
+    def __init__(self, mode="buffered", flush_interval=2.0, max_pending=500, max_retries=3):
+        self.mode = mode
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+
+        self._lock = threading.Lock()
+        self._history = {}
+        self._song_counts = defaultdict(int)
+        self._pending = 0
+        self._failures = 0
+        self._timer = None
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            mode=CONFIG.get("PLAY_EVENTS_MODE", "buffered"),
+            flush_interval=CONFIG.get("PLAY_EVENTS_FLUSH_INTERVAL", 2.0),
+            max_pending=CONFIG.get("PLAY_EVENTS_MAX_PENDING", 500),
+            max_retries=CONFIG.get("PLAY_EVENTS_MAX_RETRIES", 3),
+        )
+
+    def record(self, user_id, song_id, accessed_at=None):
+        """Record one play. `user_id` is None for anonymous listeners."""
+        accessed_at = accessed_at or now()
+
+        with self._lock:
+            self._merge(user_id, song_id, 1, accessed_at)
+            self._pending += 1
+            flush_now = self.mode == "immediate" or self._pending >= self.max_pending
+            if not flush_now:
+                self._schedule()
+
+        if flush_now:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def flush(self):
+        """Write every buffered play. Returns the number of plays written."""
+        with self._lock:
+            history, song_counts, pending = self._history, self._song_counts, self._pending
+            self._history, self._song_counts, self._pending = {}, defaultdict(int), 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if not pending:
+            return 0
+
+        try:
+            dropped = apply_play_events(history, song_counts)
+        except Exception:
+            with self._lock:
+                self._failures += 1
+                give_up = self._failures > self.max_retries
+                if give_up:
+                    self._failures = 0
+                else:
+                    # Put the plays back so the next flush, on the timer if nothing else, retries them
+                    self._restore(history, song_counts, pending)
+                    self._schedule()
+            if give_up:
+                logger.exception("Dropped %s play events after %s failed flushes", pending, self.max_retries + 1)
+            else:
+                logger.exception("Failed to flush %s play events", pending)
+            return 0
+
+        with self._lock:
+            self._failures = 0
+        if dropped:
+            logger.warning("Dropped %s play events of deleted songs", dropped)
+        return pending - dropped
+
+    def _schedule(self):
+        """Start the flush timer unless it is running. Call with the lock held."""
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _merge(self, user_id, song_id, plays, accessed_at):
+        if user_id is not None:
+            entry = self._history.get((user_id, song_id))
+            if entry is None:
+                self._history[(user_id, song_id)] = [plays, accessed_at]
+            else:
+                entry[0] += plays
+                entry[1] = max(entry[1], accessed_at)
+        self._song_counts[song_id] += plays
+
+    def _restore(self, history, song_counts, pending):
+        for (user_id, song_id), (plays, accessed_at) in history.items():
+            entry = self._history.get((user_id, song_id))
+            if entry is None:
+                self._history[(user_id, song_id)] = [plays, accessed_at]
+            else:
+                entry[0] += plays
+                entry[1] = max(entry[1], accessed_at)
+        for song_id, plays in song_counts.items():
+            self._song_counts[song_id] += plays
+        self._pending += pending
+
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            # The timer thread owns its own connection, release it
+            connections.close_all()
+
+
+play_events = PlayEventBuffer.from_config()
+atexit.register(play_events.flush)
+
+
+def record_play(user, song):
+    """Count a play of `song`, and add it to `user`'s history when signed in."""
+    play_events.record(user.id if user.is_authenticated else None, song.id)
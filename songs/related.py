@@ -0,0 +1,190 @@
+import math
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Song, SongArtist, SongTag, UserSongHistory, RelatedSong
+
+# Related songs are scored as a weighted sum of what two songs share:
+# the album, each artist, each tag, and each listener who played both.
+WEIGHTS = {
+    'album': 4.0,
+    'artist': 3.0,
+    'tag': 1.0,
+    'listener': 2.0,
+}
+
+# Only the most recent plays of each listener count towards co-listening
+MAX_HISTORY_PER_USER = 200
+
+# Bound on the block of songs scored at once, in cells of the score matrix
+BLOCK_CELLS = 1 << 22
+
+
+class Feature:
+    """
+    A song<->feature incidence (e.g. song<->artist) in compressed sparse row
+    form, in both directions, over dense song indexes 0..n_songs-1.
+    """
+
+    def __init__(self, weight, song_indexes, feature_keys, n_songs, pair_weights=None):
+        song_indexes = np.asarray(song_indexes, dtype=np.int64)
+        _, feature_indexes = np.unique(np.asarray(feature_keys, dtype=np.int64), return_inverse=True)
+        n_features = int(feature_indexes.max()) + 1 if len(feature_indexes) else 0
+        pair_weights = np.full(len(song_indexes), weight, dtype=np.float32) if pair_weights is None else (
+            np.asarray(pair_weights, dtype=np.float32) * weight
+        )
+
+        order = np.argsort(song_indexes, kind='stable')
+        self.song_indptr = np.concatenate([[0], np.cumsum(np.bincount(song_indexes, minlength=n_songs))])
+        self.song_features = feature_indexes[order]
+        self.song_weights = pair_weights[order]
+
+        order = np.argsort(feature_indexes, kind='stable')
+        self.feature_indptr = np.concatenate([[0], np.cumsum(np.bincount(feature_indexes, minlength=n_features))])
+        self.feature_songs = song_indexes[order]
+
+    def add_scores(self, scores, start, stop, n_songs):
+        """Add this feature's contribution for songs start..stop-1 to the flat `scores` block."""
+        lo, hi = self.song_indptr[start], self.song_indptr[stop]
+        if lo == hi:
+            return
+        rows = np.repeat(np.arange(stop - start), np.diff(self.song_indptr[start:stop + 1]))
+        features = self.song_features[lo:hi]
+        weights = self.song_weights[lo:hi]
+
+        # Expand every (row, feature) pair into (row, song) pairs for each song with the feature
+        counts = self.feature_indptr[features + 1] - self.feature_indptr[features]
+        total = int(counts.sum())
+        if total == 0:
+            return
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        columns = self.feature_songs[np.repeat(self.feature_indptr[features], counts) + offsets]
+        scores += np.bincount(
+            np.repeat(rows, counts) * n_songs + columns,
+            weights=np.repeat(weights, counts),
+            minlength=len(scores),
+        )
+
+
+def load_features(song_ids, album_ids):
+    """Build the album, artist, tag and co-listening features of the catalog."""
+    index_of = {song_id: index for index, song_id in enumerate(song_ids)}
+    n_songs = len(song_ids)
+    features = [Feature(WEIGHTS['album'], np.arange(n_songs), album_ids, n_songs)]
+
+    for name, model, key in (('artist', SongArtist, 'artist_id'), ('tag', SongTag, 'tag_id')):
+        pairs = [(index_of[song_id], key_id) for song_id, key_id in model.objects.values_list('song_id', key).iterator() if song_id in index_of]
+        if pairs:
+            songs, keys = zip(*pairs)
+            features.append(Feature(WEIGHTS[name], songs, keys, n_songs))
+
+    history = {}
+    for user_id, song_id in UserSongHistory.objects.order_by('user_id', '-accessed_at').values_list('user_id', 'song_id').iterator():
+        songs = history.setdefault(user_id, [])
+        if len(songs) < MAX_HISTORY_PER_USER and song_id in index_of:
+            songs.append(index_of[song_id])
+    songs, users, weights = [], [], []
+    for user_id, listened in history.items():
+        # A play by someone who listens to everything says less about two songs
+        weight = 1 / math.log2(2 + len(listened))
+        songs.extend(listened)
+        users.extend([user_id] * len(listened))
+        weights.extend([weight] * len(listened))
+    if songs:
+        features.append(Feature(WEIGHTS['listener'], songs, users, n_songs, weights))
+
+    return features
+
+
+def compute_neighbours(song_ids, features, popularity, rows, top_n):
+    """Yield (song_id, [(related_id, score), ...]) for the dense song indexes in `rows`."""
+    n_songs = len(song_ids)
+    # Popularity only breaks ties between equally related songs
+    tiebreak = np.log1p(popularity) / (np.log1p(popularity.max()) + 1) * 1e-3
+    block = max(1, min(512, BLOCK_CELLS // max(n_songs, 1)))
+    rows = np.asarray(sorted(rows), dtype=np.int64)
+
+    # Score runs of consecutive rows together so each block is one contiguous slice
+    runs = np.split(rows, np.where(np.diff(rows) != 1)[0] + 1) if len(rows) else []
+    for run in runs:
+        for start in range(int(run[0]), int(run[-1]) + 1, block):
+            stop = min(start + block, int(run[-1]) + 1)
+            scores = np.zeros((stop - start) * n_songs)
+            for feature in features:
+                feature.add_scores(scores, start, stop, n_songs)
+            scores = scores.reshape(stop - start, n_songs)
+            related = scores > 0
+            scores = np.where(related, scores + tiebreak, 0)
+            scores[np.arange(stop - start), np.arange(start, stop)] = 0
+
+            k = min(top_n, n_songs - 1)
+            if k <= 0:
+                for row in range(start, stop):
+                    yield song_ids[row], []
+                continue
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for offset, candidates in enumerate(top):
+                candidate_scores = scores[offset, candidates]
+                order = np.argsort(-candidate_scores, kind='stable')
+                yield song_ids[start + offset], [
+                    (song_ids[column], float(score))
+                    for column, score in zip(candidates[order], candidate_scores[order]) if score > 0
+                ]
+
+
+def build_related_songs(song_ids=None, top_n=24, batch_size=1000):
+    """
+    Recompute the neighbour lists of `song_ids`, or of the whole catalog when
+    None. Returns the number of songs whose lists were written.
+    """
+    catalog = list(Song.objects.order_by('id').values_list('id', 'album_id', 'count'))
+    if not catalog:
+        return 0
+    all_ids = [song_id for song_id, _, _ in catalog]
+    popularity = np.asarray([count for _, _, count in catalog], dtype=np.float64)
+    features = load_features(all_ids, [album_id for _, album_id, _ in catalog])
+
+    if song_ids is None:
+        rows = range(len(all_ids))
+    else:
+        index_of = {song_id: index for index, song_id in enumerate(all_ids)}
+        rows = [index_of[song_id] for song_id in song_ids if song_id in index_of]
+
+    written = 0
+    pending_ids, pending_rows = [], []
+
+    def flush():
+        with transaction.atomic():
+            RelatedSong.objects.filter(song_id__in=pending_ids).delete()
+            RelatedSong.objects.bulk_create(pending_rows, batch_size=1000)
+        pending_ids.clear()
+        pending_rows.clear()
+
+    for song_id, neighbours in compute_neighbours(all_ids, features, popularity, rows, top_n):
+        pending_ids.append(song_id)
+        pending_rows.extend(
+            RelatedSong(song_id=song_id, related_id=related_id, rank=rank, score=score)
+            for rank, (related_id, score) in enumerate(neighbours)
+        )
+        written += 1
+        if len(pending_ids) >= batch_size:
+            flush()
+    if pending_ids:
+        flush()
+    return written
+
+
+def affected_songs(song_ids):
+    """`song_ids` plus the songs sharing an album or artist with them, whose lists they may enter."""
+    songs = Song.objects.filter(id__in=song_ids)
+    artist_ids = SongArtist.objects.filter(song_id__in=song_ids).values('artist_id')
+    neighbours = Song.objects.filter(
+        Q(album_id__in=songs.values('album_id')) | Q(song_artists__artist_id__in=artist_ids)
+    ).values_list('id', flat=True).distinct()
+    return set(song_ids) | set(neighbours)
+
+
+def update_related_songs(song_ids, top_n=24):
+    """Incrementally refresh neighbour lists after `song_ids` were added or changed."""
+    return build_related_songs(affected_songs(song_ids), top_n=top_n)
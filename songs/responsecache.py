@@ -0,0 +1,124 @@
+import hashlib
+import threading
+from functools import wraps
+from django.core.cache import cache
+from rest_framework.response import Response
+from config import CONFIG
+from arsongsapi.instrumentation import register_collector
+
+from .versions import CATALOG, get_versions
+
+# Shared cache of serialized catalog responses.
+#
+# A cached response is the `data` of a 200 response, stored under the route,
+# the host, path and query parameters of the request, and the versions it
+# was built from. The signals that bump those versions (songs.signals)
+# invalidate every response built from the old ones, and the TTL bounds how
+# stale play and like counters get, since counter updates do not bump them.
+#
+# Only responses that are the same for every user may be cached. Data
+# carrying a USER_FIELDS key is never stored, whatever the view.
+
+# Seconds a response stays cached, by route ('<basename>-<action>'); 0 turns a route off
+RESPONSE_CACHE_TTLS = {
+    'album-list': 300,
+    'album-retrieve': 300,
+    'album-songs': 120,
+    'artist-list': 300,
+    'artist-retrieve': 300,
+    'artist-songs': 120,
+    'tag-list': 600,
+    'tag-retrieve': 600,
+    'song-list': 60,
+    **CONFIG.get("RESPONSE_CACHE_TTLS", {}),
+}
+RESPONSE_CACHE_DEFAULT_TTL = CONFIG.get("RESPONSE_CACHE_DEFAULT_TTL", 60)
+
+# Keys added to serialized data for the requesting user
+USER_FIELDS = {'liked', 'contains_song'}
+
+
+class ResponseCacheMetrics:
+    """Hits, misses and bypasses (responses not cacheable) per route, for /metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def count(self, route, result):
+        with self._lock:
+            self._counts[(route, result)] = self._counts.get((route, result), 0) + 1
+
+    def collect(self):
+        with self._lock:
+            samples = [
+                ('response_cache_requests_total', {'route': route, 'result': result}, count)
+                for (route, result), count in sorted(self._counts.items())
+            ]
+        yield 'response_cache_requests_total', 'counter', "Cacheable requests by route and cache result.", samples
+
+
+response_cache_metrics = ResponseCacheMetrics()
+register_collector(response_cache_metrics.collect)
+
+
+def has_user_fields(data):
+    """Whether serialized data, a page of rows or a single object, carries per-user keys."""
+    if isinstance(data, dict):
+        if USER_FIELDS & data.keys():
+            return True
+        rows = data.get('results')
+        return isinstance(rows, list) and bool(rows) and has_user_fields(rows[0])
+    if isinstance(data, list):
+        return bool(data) and has_user_fields(data[0])
+    return False
+
+
+def _cache_key(route, request, versions):
+    params = sorted((key, value) for key, values in request.query_params.lists() for value in values)
+    request_id = repr((request.get_host(), request.path, params, sorted(versions.items())))
+    return f"response:{route}:{hashlib.md5(request_id.encode()).hexdigest()}"
+
+
+def cached_response(scopes=None):
+    """
+    Decorate a viewset method whose response is the same for every user so
+    its 200 responses are served from the cache until one of `scopes`
+    (CATALOG by default) moves or the route's TTL runs out.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            route = f'{self.basename}-{self.action}'
+            ttl = RESPONSE_CACHE_TTLS.get(route, RESPONSE_CACHE_DEFAULT_TTL)
+            if not ttl:
+                return handler(self, request, *args, **kwargs)
+
+            versions = get_versions(*(scopes(self, request, *args, **kwargs) if scopes else [CATALOG]))
+            key = _cache_key(route, request, versions)
+            data = cache.get(key)
+            if data is not None:
+                response_cache_metrics.count(route, 'hit')
+                return Response(data)
+
+            response = handler(self, request, *args, **kwargs)
+            if response.status_code != 200 or has_user_fields(response.data):
+                response_cache_metrics.count(route, 'bypass')
+                return response
+            cache.set(key, response.data, ttl)
+            response_cache_metrics.count(route, 'miss')
+            return response
+        return wrapper
+    return decorator
+
+
+class CachedResponseMixin:
+    """Cached list and retrieve for the read-only catalog viewsets."""
+
+    @cached_response()
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response()
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
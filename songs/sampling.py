@@ -0,0 +1,98 @@
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from config import CONFIG
+
+from .models import Song, SongArtist, SongTag, PlaylistSong
+from .versions import CATALOG, get_version
+
+
+def _load_ids(scope):
+    kind, _, scope_id = scope.partition(':')
+    if kind == CATALOG:
+        ids = Song.objects.order_by('-id').values_list('id', flat=True)
+    elif kind == 'album':
+        ids = Song.objects.filter(album_id=scope_id).order_by('-id').values_list('id', flat=True)
+    elif kind == 'artist':
+        ids = SongArtist.objects.filter(artist_id=scope_id).order_by('-song_id').values_list('song_id', flat=True).distinct()
+    elif kind == 'tag':
+        ids = SongTag.objects.filter(tag_id=scope_id).order_by('-song_id').values_list('song_id', flat=True).distinct()
+    elif kind == 'playlist':
+        ids = PlaylistSong.objects.filter(playlist_id=scope_id).values_list('id', flat=True)
+    else:
+        raise ValueError(f"Unknown sampling scope {scope}")
+    return array('q', ids.iterator())
+
+
+class SamplingIndex:
+    """
+    In-memory id arrays for picking a random row in constant time.
+
+    Each scope (the catalog, an album, artist, tag or playlist, see
+    songs.versions) keeps the ids of its rows in an array tagged with the
+    scope's version. A pick compares versions, reloads the array when rows
+    changed, and indexes it at random. Arrays older than `max_age` seconds are
+    reloaded as well, which bounds staleness when the cache holding versions
+    is not shared between processes. At most `max_scopes` arrays are kept,
+    least recently used first out.
+    """
+
+    def __init__(self, max_scopes=256, max_age=300):
+        self.max_scopes = max_scopes
+        self.max_age = max_age
+        self._arrays = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ids(self, scope):
+        version = get_version(scope)
+        with self._lock:
+            entry = self._arrays.get(scope)
+            if entry and entry[0] == version and time.monotonic() - entry[1] < self.max_age:
+                self._arrays.move_to_end(scope)
+                return entry[2]
+
+        ids = _load_ids(scope)
+        with self._lock:
+            self._arrays[scope] = (version, time.monotonic(), ids)
+            self._arrays.move_to_end(scope)
+            while len(self._arrays) > self.max_scopes:
+                self._arrays.popitem(last=False)
+        return ids
+
+    def pick(self, scope):
+        """Return (index, id) of a random row in `scope`, or None when it is empty."""
+        ids = self.ids(scope)
+        if not ids:
+            return None
+        index = random.randrange(len(ids))
+        return index, ids[index]
+
+    def discard(self, scope):
+        with self._lock:
+            self._arrays.pop(scope, None)
+
+
+sampling_index = SamplingIndex(
+    max_scopes=CONFIG.get("SAMPLING_INDEX_MAX_SCOPES", 256),
+    max_age=CONFIG.get("SAMPLING_INDEX_MAX_AGE", 300),
+)
+
+
+def pick_random(scope, queryset):
+    """
+    Pick a random row of `scope` and fetch it from `queryset` by primary key.
+    Returns (index, obj) or None when the scope is empty.
+    """
+    for _ in range(2):
+        picked = sampling_index.pick(scope)
+        if picked is None:
+            return None
+        index, pk = picked
+        obj = queryset.filter(pk=pk).first()
+        if obj is not None:
+            return index, obj
+        # The row is gone but this process has not seen the version bump yet
+        sampling_index.discard(scope)
+    return None
@@ -0,0 +1,357 @@
+import logging
+import re
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .models import Album, Artist, Tag, Song, SongLyrics
+
+# Full-text search over the catalog with SQLite FTS5.
+#
+# songs_song_fts holds one row per song, keyed by the song id as rowid, with
+# the song's name, album, artist names and tag names as columns.
+# songs_entity_fts holds album titles, artist names and tag names for the
+# entity sections of the global search; its rowid packs the kind and the id.
+# songs_lyrics_fts holds one row per synced lyric line, timestamps stripped,
+# with the line's start time in an unindexed column; its rowid packs the song
+# id and the line index, so a song's lines are a rowid range.
+#
+# The tables are built by the rebuild_search_index command, and by migrate
+# on a database that has none, and kept in sync by songs.signals. Until they
+# exist, and on databases without FTS5, every search function returns None
+# and callers fall back to icontains filters.
+
+SONG_TABLE = 'songs_song_fts'
+ENTITY_TABLE = 'songs_entity_fts'
+LYRICS_TABLE = 'songs_lyrics_fts'
+TABLES = (SONG_TABLE, ENTITY_TABLE, LYRICS_TABLE)
+
+SONG_COLUMNS = ['name', 'album', 'artists', 'tags']
+# bm25 weight of a match in each song column: a hit in the song name ranks
+# above a hit in an artist name, which ranks above album and tag hits
+SONG_COLUMN_WEIGHTS = [10.0, 3.0, 5.0, 1.0]
+
+# The rowid of an entity is id * len(ENTITY_KINDS) + kind - 1
+ENTITY_KINDS = {'album': 1, 'artist': 2, 'tag': 3}
+
+# Lines of a song that are indexed; the rowid of a line is song_id * LYRICS_MAX_LINES + index
+LYRICS_MAX_LINES = 4096
+# Words of context around the matched words in a lyric snippet, and the marks around them
+LYRICS_SNIPPET_TOKENS = 12
+LYRICS_SNIPPET_MARKS = ('<b>', '</b>')
+
+TOKENIZE = "tokenize='unicode61 remove_diacritics 2', prefix='2 3'"
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+logger = logging.getLogger(__name__)
+
+# Set once the tables are seen; until then every call looks for them again
+_tables_ready = False
+
+
+def is_available():
+    global _tables_ready
+    if connection.vendor != 'sqlite':
+        return False
+    if not _tables_ready:
+        _tables_ready = _tables_exist()
+    return _tables_ready
+
+
+def _tables_exist():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE name IN (%s, %s, %s)", list(TABLES))
+        return {row[0] for row in cursor.fetchall()} == set(TABLES)
+
+
+def build_missing_tables(using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_migrate receiver: build the index of a database that has none yet, e.g. a new one."""
+    if using != DEFAULT_DB_ALIAS or connection.vendor != 'sqlite' or _tables_exist():
+        return
+    try:
+        rebuild()
+    except DatabaseError as e:
+        logger.warning("Full-text search is unavailable: %s", e)
+
+
+def _create_tables(cursor):
+    for table in TABLES:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute(f"CREATE VIRTUAL TABLE {SONG_TABLE} USING fts5({', '.join(SONG_COLUMNS)}, {TOKENIZE})")
+    cursor.execute(
+        f"INSERT INTO {SONG_TABLE}({SONG_TABLE}, rank) VALUES ('rank', %s)",
+        [f"bm25({', '.join(str(weight) for weight in SONG_COLUMN_WEIGHTS)})"]
+    )
+    cursor.execute(f"CREATE VIRTUAL TABLE {ENTITY_TABLE} USING fts5(name, {TOKENIZE})")
+    cursor.execute(f"CREATE VIRTUAL TABLE {LYRICS_TABLE} USING fts5(line, time UNINDEXED, {TOKENIZE})")
+
+
+def build_match(text, columns=None):
+    """
+    Turn user input into an FTS5 query: every word must match as a prefix,
+    optionally only within `columns`. Returns None when there is no word.
+    """
+    tokens = TOKEN_RE.findall(text.lower())
+    if not tokens:
+        return None
+    terms = ' '.join(f'"{token}"*' for token in tokens)
+    if columns:
+        return f"{{{' '.join(columns)}}} : ({terms})"
+    return terms
+
+
+def _song_document(song):
+    return (
+        song.id,
+        song.original_name,
+        f"{song.album.title} {song.album.code}",
+        ' '.join(song_artist.artist.name for song_artist in song.song_artists.all()),
+        ' '.join(song_tag.tag.name for song_tag in song.song_tags.all()),
+    )
+
+
+def _entity_rowid(kind, entity_id):
+    return entity_id * len(ENTITY_KINDS) + ENTITY_KINDS[kind] - 1
+
+
+def _lyrics_rows(song_id, times, lines):
+    base = song_id * LYRICS_MAX_LINES
+    return [
+        (base + index, line, time)
+        for index, (time, line) in enumerate(zip(times[:LYRICS_MAX_LINES], lines))
+        if line
+    ]
+
+
+def _delete_lyrics(cursor, song_ids):
+    cursor.executemany(
+        f"DELETE FROM {LYRICS_TABLE} WHERE rowid >= %s AND rowid < %s",
+        [(song_id * LYRICS_MAX_LINES, (song_id + 1) * LYRICS_MAX_LINES) for song_id in song_ids]
+    )
+
+
+def index_lyrics(songs_lyrics):
+    """Replace the indexed lines of each song in {song_id: Lyrics}."""
+    if not songs_lyrics or not is_available():
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        _delete_lyrics(cursor, songs_lyrics)
+        cursor.executemany(
+            f"INSERT INTO {LYRICS_TABLE}(rowid, line, time) VALUES (%s, %s, %s)",
+            [row for song_id, lyrics in songs_lyrics.items() for row in _lyrics_rows(song_id, lyrics.times, lyrics.lines)]
+        )
+
+
+def index_songs(song_ids, batch_size=500):
+    """Re-index `song_ids`; ids of songs that no longer exist are dropped from the index."""
+    if not is_available():
+        return
+    song_ids = list(song_ids)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(song_ids), batch_size):
+            batch = song_ids[start:start + batch_size]
+            songs = Song.objects.filter(id__in=batch).select_related('album').prefetch_related(
+                'song_artists__artist', 'song_tags__tag'
+            )
+            cursor.executemany(f"DELETE FROM {SONG_TABLE} WHERE rowid = %s", [(song_id,) for song_id in batch])
+            cursor.executemany(
+                f"INSERT INTO {SONG_TABLE}(rowid, {', '.join(SONG_COLUMNS)}) VALUES (%s, %s, %s, %s, %s)",
+                [_song_document(song) for song in songs]
+            )
+
+
+def remove_song(song_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SONG_TABLE} WHERE rowid = %s", [song_id])
+        _delete_lyrics(cursor, [song_id])
+
+
+def index_entity(kind, entity_id, name):
+    if not is_available():
+        return
+    rowid = _entity_rowid(kind, entity_id)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {ENTITY_TABLE} WHERE rowid = %s", [rowid])
+        cursor.execute(f"INSERT INTO {ENTITY_TABLE}(rowid, name) VALUES (%s, %s)", [rowid, name])
+
+
+def remove_entity(kind, entity_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {ENTITY_TABLE} WHERE rowid = %s", [_entity_rowid(kind, entity_id)])
+
+
+def rebuild(batch_size=2000):
+    """Drop and rebuild every table from the catalog. Returns the number of songs indexed."""
+    indexed = 0
+    # One transaction, or every inserted row pays for its own commit
+    with transaction.atomic(), connection.cursor() as cursor:
+        _create_tables(cursor)
+
+        for kind, model, field in (('album', Album, 'title'), ('artist', Artist, 'name'), ('tag', Tag, 'name')):
+            cursor.executemany(
+                f"INSERT INTO {ENTITY_TABLE}(rowid, name) VALUES (%s, %s)",
+                [(_entity_rowid(kind, entity_id), name) for entity_id, name in model.objects.values_list('id', field).iterator()]
+            )
+
+        songs = Song.objects.order_by('id').select_related('album').prefetch_related('song_artists__artist', 'song_tags__tag')
+        last_id = 0
+        while True:
+            batch = list(songs.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            cursor.executemany(
+                f"INSERT INTO {SONG_TABLE}(rowid, {', '.join(SONG_COLUMNS)}) VALUES (%s, %s, %s, %s, %s)",
+                [_song_document(song) for song in batch]
+            )
+            indexed += len(batch)
+            last_id = batch[-1].id
+
+        song_lyrics = SongLyrics.objects.order_by('song_id').values_list('song_id', 'times', 'lines')
+        last_id = 0
+        while True:
+            batch = list(song_lyrics.filter(song_id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            cursor.executemany(
+                f"INSERT INTO {LYRICS_TABLE}(rowid, line, time) VALUES (%s, %s, %s)",
+                [row for song_id, times, lines in batch for row in _lyrics_rows(song_id, times, lines)]
+            )
+            last_id = batch[-1][0]
+
+        for table in TABLES:
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES ('optimize')")
+    return indexed
+
+
+def search_song_ids(text, columns=None, limit=100, offset=0):
+    """Ids of the songs matching `text`, best match first."""
+    match = build_match(text, columns)
+    if match is None or not is_available():
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {SONG_TABLE} WHERE {SONG_TABLE} MATCH %s ORDER BY rank LIMIT %s OFFSET %s",
+            [match, limit, offset]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def count_songs(text, columns=None):
+    match = build_match(text, columns)
+    if match is None or not is_available():
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM {SONG_TABLE} WHERE {SONG_TABLE} MATCH %s", [match])
+        return cursor.fetchone()[0]
+
+
+def song_ids_subquery(text, columns=None):
+    """A subquery of every matching song id, for `id__in` filters. None when unavailable."""
+    match = build_match(text, columns)
+    if match is None or not is_available():
+        return None
+    return RawSQL(f"SELECT rowid FROM {SONG_TABLE} WHERE {SONG_TABLE} MATCH %s", [match])
+
+
+def search_entity_ids(kind, text, limit=10):
+    """Ids of the albums, artists or tags whose name matches `text`, best match first."""
+    match = build_match(text)
+    if match is None or not is_available():
+        return None
+    kinds = len(ENTITY_KINDS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {ENTITY_TABLE} WHERE {ENTITY_TABLE} MATCH %s AND rowid %% {kinds} = %s ORDER BY rank LIMIT %s",
+            [match, ENTITY_KINDS[kind] - 1, limit]
+        )
+        return [divmod(row[0], kinds)[0] for row in cursor.fetchall()]
+
+
+class LyricMatch:
+    __slots__ = ('song_id', 'line', 'time', 'snippet')
+
+    def __init__(self, song_id, line, time, snippet):
+        self.song_id = song_id
+        self.line = line  # index of the matched line
+        self.time = time  # start of the matched line, in ms
+        self.snippet = snippet
+
+
+def build_lyrics_match(text):
+    """
+    Like build_match, but only the last word is a prefix: the index holds
+    many more lines than songs, and a short prefix expands to most of it.
+    """
+    tokens = TOKEN_RE.findall(text.lower())
+    if not tokens:
+        return None
+    *words, last = tokens
+    return ' '.join([f'"{word}"' for word in words] + [f'"{last}"*'])
+
+
+def search_lyrics(text, limit=10):
+    """
+    Songs whose lyrics match `text`, best match first, as LyricMatch objects
+    for the best matching line of each song. Every word of `text` has to be
+    on that line.
+    """
+    match = build_lyrics_match(text)
+    if match is None or not is_available():
+        return None
+    with connection.cursor() as cursor:
+        # With min(), SQLite takes the bare rowid from the best ranked line of each song
+        cursor.execute(
+            f"SELECT rowid, min(rank) AS best FROM {LYRICS_TABLE} WHERE {LYRICS_TABLE} MATCH %s "
+            f"GROUP BY rowid / {LYRICS_MAX_LINES} ORDER BY best LIMIT %s",
+            [match, limit]
+        )
+        rowids = [row[0] for row in cursor.fetchall()]
+        if not rowids:
+            return []
+        # Snippets only for the lines returned
+        cursor.execute(
+            f"SELECT rowid, time, snippet({LYRICS_TABLE}, 0, %s, %s, '…', %s) FROM {LYRICS_TABLE} "
+            f"WHERE {LYRICS_TABLE} MATCH %s AND rowid IN ({', '.join(['%s'] * len(rowids))})",
+            [*LYRICS_SNIPPET_MARKS, LYRICS_SNIPPET_TOKENS, match, *rowids]
+        )
+        matches = {
+            rowid: LyricMatch(rowid // LYRICS_MAX_LINES, rowid % LYRICS_MAX_LINES, time, snippet)
+            for rowid, time, snippet in cursor.fetchall()
+        }
+    return [matches[rowid] for rowid in rowids if rowid in matches]
+
+
+def in_rank_order(objects, ranked_ids, key=lambda obj: obj.id):
+    """Sort `objects` by the position of key(obj) in `ranked_ids`; unranked objects keep their order at the end."""
+    positions = {object_id: position for position, object_id in enumerate(ranked_ids)}
+    return sorted(objects, key=lambda obj: positions.get(key(obj), len(positions)))
+
+
+class RankedSongs:
+    """
+    Songs matching a full-text query in rank order, sliced lazily so it can be
+    handed to a paginator in place of a queryset.
+    """
+
+    def __init__(self, text, columns=None, queryset=None):
+        self.text = text
+        self.columns = columns
+        self.queryset = queryset if queryset is not None else Song.objects.all()
+
+    def count(self):
+        return count_songs(self.text, self.columns)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step:
+            raise TypeError("RankedSongs only supports slicing.")
+        start = item.start or 0
+        stop = item.stop if item.stop is not None else start + 100
+        ids = search_song_ids(self.text, self.columns, limit=max(stop - start, 0), offset=start)
+        return in_rank_order(self.queryset.filter(id__in=ids), ids)
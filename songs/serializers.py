@@ -1,18 +1,21 @@
 from rest_framework import serializers
-from .models import Album, Artist, Tag, Song, UserSongHistory, UserLikedSong, Playlist, PlaylistSong, SongArtist
+from django.db.models import Prefetch
+from .models import Album, Artist, Tag, Song, UserSongHistory, UserLikedSong, Playlist, PlaylistSong, PlaylistSummary, SongArtist, SongTag
 
 class AlbumSerializer(serializers.ModelSerializer):
+    thumbnails = serializers.DictField(source='thumbnail_map', read_only=True)
 
     class Meta:
         model = Album
-        fields = ['id', 'code', 'title', 'year', 'thumbnail300x300', 'thumbnail1200x1200']
+        fields = ['id', 'code', 'title', 'year', 'thumbnail300x300', 'thumbnail1200x1200', 'thumbnails']
 
 
 class ArtistSerializer(serializers.ModelSerializer):
+    thumbnails = serializers.DictField(source='thumbnail_map', read_only=True)
 
     class Meta:
         model = Artist
-        fields = ['id', 'name', 'thumbnail300x300', 'thumbnail1200x1200']
+        fields = ['id', 'name', 'thumbnail300x300', 'thumbnail1200x1200', 'thumbnails']
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -30,6 +33,22 @@ class SongSerializer(serializers.ModelSerializer):
         model = Song
         fields = ['id', 'title', 'url', 'original_name', 'lyrics', 'album', 'tags', 'artists', 'count', 'liked_count', 'duration']
 
+    @classmethod
+    def setup_eager_loading(cls, queryset, prefix=''):
+        """
+        Load everything `to_representation` touches in a fixed number of queries.
+        `prefix` is the lookup path to the song, e.g. 'song__' for PlaylistSong rows.
+        """
+        return queryset.select_related(f'{prefix}album').prefetch_related(*cls.song_prefetches(prefix))
+
+    @classmethod
+    def song_prefetches(cls, prefix=''):
+        """The prefetches of `setup_eager_loading`, for use with prefetch_related_objects."""
+        return [
+            Prefetch(f'{prefix}song_tags', queryset=SongTag.objects.select_related('tag')),
+            Prefetch(f'{prefix}song_artists', queryset=SongArtist.objects.select_related('artist')),
+        ]
+
     # To add tags and artists, we need to get them through the related models
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -44,14 +63,21 @@ class SongSerializer(serializers.ModelSerializer):
         
         return representation
 
-class UserSongHistorySerializer(serializers.ModelSerializer):
+class SongRelationSerializerMixin:
+    """Eager loading for serializers that nest a SongSerializer under `song`."""
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, prefix=''):
+        return SongSerializer.setup_eager_loading(queryset, f'{prefix}song__')
+
+class UserSongHistorySerializer(SongRelationSerializerMixin, serializers.ModelSerializer):
     song = SongSerializer()
 
     class Meta:
         model = UserSongHistory
         fields = ['id', 'song', 'accessed_at', 'count']
 
-class UserLikedSongSerializer(serializers.ModelSerializer):
+class UserLikedSongSerializer(SongRelationSerializerMixin, serializers.ModelSerializer):
     song = SongSerializer()
 
     class Meta:
@@ -61,21 +87,26 @@ class UserLikedSongSerializer(serializers.ModelSerializer):
 class PlaylistSerializer(serializers.ModelSerializer):
     songs_count = serializers.SerializerMethodField()
     thumbnail = serializers.SerializerMethodField()
+    total_duration = serializers.SerializerMethodField()
     contains_song = serializers.BooleanField(default=False)  # Default to False if not annotated
     author = serializers.SerializerMethodField()
 
     class Meta:
         model = Playlist
-        fields = ['id', 'name', 'privacy_type', 'songs_count', 'thumbnail', 'contains_song', 'author']
+        fields = ['id', 'name', 'privacy_type', 'songs_count', 'thumbnail', 'total_duration', 'contains_song', 'author']
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, prefix=''):
+        return queryset.select_related(f'{prefix}user', f'{prefix}summary')
 
     def get_songs_count(self, obj):
-        return obj.playlist_songs.count()
+        return PlaylistSummary.for_playlist(obj).songs_count
 
     def get_thumbnail(self, obj):
-        first_song = obj.playlist_songs.first()
-        if first_song:
-            return first_song.song.album.thumbnail300x300
-        return None
+        return PlaylistSummary.for_playlist(obj).thumbnail
+
+    def get_total_duration(self, obj):
+        return PlaylistSummary.for_playlist(obj).total_duration
     
     def get_author(self, obj):
         return {
@@ -84,14 +115,14 @@ class PlaylistSerializer(serializers.ModelSerializer):
         }
 
 
-class PlaylistSongSerializer(serializers.ModelSerializer):
+class PlaylistSongSerializer(SongRelationSerializerMixin, serializers.ModelSerializer):
     song = SongSerializer()
 
     class Meta:
         model = PlaylistSong
         fields = ['id', 'song']
 
-class SongArtistSerializer(serializers.ModelSerializer):
+class SongArtistSerializer(SongRelationSerializerMixin, serializers.ModelSerializer):
     song = SongSerializer()
 
     class Meta:
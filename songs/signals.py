@@ -0,0 +1,123 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver, Signal
+from .models import Album, Artist, Tag, Song, SongArtist, SongTag, Playlist, PlaylistSong, PlaylistSummary, UserLikedSong, UserSongHistory
+from . import search, assets, catalog
+from .versions import CATALOG, bump_version, album_scope, artist_scope, tag_scope, playlist_scope, user_scope
+
+# Sent after songs are added to, removed from or reordered in a playlist.
+# Bulk writes skip the model signals, so views send this one explicitly.
+# The owner's version moves only when user_id is given.
+playlist_songs_changed = Signal()
+
+# Saves that only touch these play/like counters do not change the catalog
+COUNTER_FIELDS = {'count', 'liked_count'}
+
+
+def is_counter_update(update_fields):
+    return update_fields is not None and set(update_fields) <= COUNTER_FIELDS
+
+
+@receiver(post_save, sender=Song)
+def song_saved(sender, instance, update_fields=None, **kwargs):
+    if is_counter_update(update_fields):
+        return
+    bump_version(CATALOG, album_scope(instance.album_id))
+    search.index_songs([instance.id])
+    catalog.record_change('song', instance.id)
+
+@receiver(pre_delete, sender=Song)
+def song_deleting(sender, instance, **kwargs):
+    # The PlaylistSong rows go with the song; note their playlists, and owners, while they exist
+    instance._playlist_owners = dict(
+        PlaylistSong.objects.filter(song=instance).values_list('playlist_id', 'playlist__user_id')
+    )
+
+@receiver(post_delete, sender=Song)
+def song_deleted(sender, instance, **kwargs):
+    bump_version(CATALOG, album_scope(instance.album_id))
+    search.remove_song(instance.id)
+    catalog.record_change('song', instance.id, 'Delete')
+    playlist_owners = getattr(instance, '_playlist_owners', None)
+    if playlist_owners:
+        # Counts, durations and covers of the playlists the song was in
+        PlaylistSummary.rebuild_all(playlist_ids=list(playlist_owners))
+        for playlist_id, user_id in playlist_owners.items():
+            playlist_songs_changed.send(sender=Song, playlist_id=playlist_id, user_id=user_id)
+
+@receiver(post_save, sender=SongArtist)
+@receiver(post_delete, sender=SongArtist)
+def song_artist_changed(sender, instance, **kwargs):
+    bump_version(CATALOG, artist_scope(instance.artist_id))
+    search.index_songs([instance.song_id])
+    catalog.record_change('song', instance.song_id)
+
+@receiver(post_save, sender=SongTag)
+@receiver(post_delete, sender=SongTag)
+def song_tag_changed(sender, instance, **kwargs):
+    bump_version(CATALOG, tag_scope(instance.tag_id))
+    search.index_songs([instance.song_id])
+    catalog.record_change('song', instance.song_id)
+
+@receiver(post_save, sender=Album)
+def album_saved(sender, instance, **kwargs):
+    bump_version(CATALOG, album_scope(instance.id))
+    search.index_entity('album', instance.id, instance.title)
+    catalog.record_change('album', instance.id)
+    search.index_songs(instance.songs.values_list('id', flat=True))
+    # Playlist covers are copies of the thumbnail path, which follows the code, title and year
+    for playlist_id, user_id in PlaylistSummary.rebuild_for(album_ids=[instance.id]).items():
+        playlist_songs_changed.send(sender=Album, playlist_id=playlist_id, user_id=user_id)
+
+@receiver(post_save, sender=Artist)
+def artist_saved(sender, instance, **kwargs):
+    bump_version(CATALOG, artist_scope(instance.id))
+    search.index_entity('artist', instance.id, instance.name)
+    catalog.record_change('artist', instance.id)
+    search.index_songs(instance.artist_songs.values_list('song_id', flat=True))
+
+@receiver(post_save, sender=Tag)
+def tag_saved(sender, instance, **kwargs):
+    bump_version(CATALOG, tag_scope(instance.id))
+    search.index_entity('tag', instance.id, instance.name)
+    catalog.record_change('tag', instance.id)
+    search.index_songs(instance.tag_songs.values_list('song_id', flat=True))
+
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Tag)
+def catalog_entity_deleted(sender, instance, **kwargs):
+    bump_version(CATALOG)
+    search.remove_entity(sender._meta.model_name, instance.id)
+    catalog.record_change(sender._meta.model_name, instance.id, 'Delete')
+
+@receiver(post_delete, sender=Song)
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Artist)
+def asset_owner_deleted(sender, instance, **kwargs):
+    # Files are removed by the process_asset_uploads worker after the deletion commits
+    assets.queue_deletion(instance)
+
+@receiver(post_save, sender=PlaylistSong)
+@receiver(post_delete, sender=PlaylistSong)
+def playlist_song_changed(sender, instance, **kwargs):
+    # Without a query per row; the owner is known only when the playlist is already loaded
+    user_id = instance.playlist.user_id if PlaylistSong.playlist.is_cached(instance) else None
+    playlist_songs_changed.send(sender=PlaylistSong, playlist_id=instance.playlist_id, user_id=user_id)
+
+@receiver(playlist_songs_changed)
+def bump_playlist_version(sender, playlist_id, user_id=None, **kwargs):
+    # The owner's playlist list shows song counts and covers
+    bump_version(playlist_scope(playlist_id), *([user_scope(user_id)] if user_id is not None else []))
+
+@receiver(post_save, sender=Playlist)
+@receiver(post_delete, sender=Playlist)
+def playlist_changed(sender, instance, **kwargs):
+    bump_version(playlist_scope(instance.id), user_scope(instance.user_id))
+
+# Deletes bump the owner's version where they happen (views, admin, cascades
+# through CATALOG): a post_delete receiver would take single-row deletes off
+# Django's fast path and wrap each one in its own transaction
+@receiver(post_save, sender=UserLikedSong)
+@receiver(post_save, sender=UserSongHistory)
+def user_song_changed(sender, instance, **kwargs):
+    bump_version(user_scope(instance.user_id))
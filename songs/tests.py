@@ -1,3 +1,359 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.utils.timezone import now
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from . import catalog, search
+from .assets import refresh_asset_status
+from .playevents import PlayEventBuffer
+from .models import Album, Artist, Tag, Song, SongArtist, SongTag, Playlist, PlaylistSong, PlaylistSummary, RelatedSong, UserLikedSong, UserSongHistory, AssetJob
+
+
+class CatalogTestCase(APITestCase):
+    """Two albums of three songs, an artist and a tag per album, and a user signed in by token."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('listener', 'listener@example.com', 'Listen-pass-1')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+
+        self.albums, self.artists, self.tags, self.songs = [], [], [], []
+        for album_index, (title, artist_name, tag_name) in enumerate([
+            ('Morning Tides', 'Harbor Lights', 'ambient'),
+            ('Night Circuits', 'Neon Drift', 'synthwave'),
+        ]):
+            album = Album(code=f'A{album_index}', title=title, year=2020 + album_index)
+            album.save()
+            artist = Artist(name=artist_name)
+            artist.save()
+            tag = Tag.objects.create(name=tag_name)
+            self.albums.append(album)
+            self.artists.append(artist)
+            self.tags.append(tag)
+            for song_index in range(3):
+                song = Song(
+                    original_name=f'{title.split()[0]} Song {song_index}', lyrics='', url='',
+                    album=album, duration=100 + song_index,
+                )
+                song.save()
+                SongArtist.objects.create(song=song, artist=artist)
+                SongTag.objects.create(song=song, tag=tag)
+                self.songs.append(song)
+
+    def make_playlist(self, songs, user=None, privacy_type='Private'):
+        playlist = Playlist.objects.create(user=user or self.user, name='Mix', privacy_type=privacy_type)
+        PlaylistSong.objects.bulk_create([
+            PlaylistSong(playlist=playlist, song=song, position=(index + 1) * PlaylistSong.POSITION_STEP)
+            for index, song in enumerate(songs)
+        ])
+        PlaylistSummary.refresh(playlist)
+        return playlist
+
+
+class PlaylistSummaryTests(CatalogTestCase):
+    def test_deleting_a_song_refreshes_the_playlists_it_was_in(self):
+        playlist = self.make_playlist(self.songs[:3])
+        self.songs[0].delete()
+
+        summary = PlaylistSummary.objects.get(playlist=playlist)
+        self.assertEqual(summary.songs_count, 2)
+        self.assertEqual(summary.total_duration, self.songs[1].duration + self.songs[2].duration)
+
+    def test_renaming_an_album_moves_the_playlist_cover(self):
+        playlist = self.make_playlist(self.songs[:3])
+        album = self.albums[0]
+        old_cover = album.thumbnail300x300
+        album.title = 'Evening Tides'
+        album.save()
+
+        summary = PlaylistSummary.objects.get(playlist=playlist)
+        self.assertNotEqual(summary.thumbnail, old_cover)
+        self.assertEqual(summary.thumbnail, album.thumbnail300x300)
+
+    def test_deleting_an_album_empties_the_summary(self):
+        playlist = self.make_playlist(self.songs[:3])
+        self.albums[0].delete()
+
+        summary = PlaylistSummary.objects.get(playlist=playlist)
+        self.assertEqual(summary.songs_count, 0)
+        self.assertIsNone(summary.thumbnail)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Full-text search needs SQLite with FTS5.")
+class SearchTests(CatalogTestCase):
+    def test_index_is_kept_in_sync_by_signals(self):
+        self.assertTrue(search.is_available())
+        self.assertEqual(search.search_song_ids('night song 1'), [self.songs[4].id])
+
+    def test_entity_ids_decode_to_the_matching_row(self):
+        for kind, rows, field in (('album', self.albums, 'title'), ('artist', self.artists, 'name'), ('tag', self.tags, 'name')):
+            for row in rows:
+                self.assertEqual(search.search_entity_ids(kind, getattr(row, field)), [row.id])
+
+    def test_global_search_tag_section(self):
+        response = self.client.get('/content/global-search', {'q': 'synthwave'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([tag['id'] for tag in response.data['tags']], [self.tags[1].id])
+        self.assertEqual({song['id'] for song in response.data['songs']}, {song.id for song in self.songs[3:]})
+
+    def test_renamed_tag_is_found_by_its_new_name(self):
+        tag = self.tags[0]
+        tag.name = 'drone'
+        tag.save()
+        self.assertEqual(search.search_entity_ids('tag', 'drone'), [tag.id])
+        self.assertEqual(search.search_entity_ids('tag', 'ambient'), [])
+
+
+class RelatedSongsTests(CatalogTestCase):
+    def test_precomputed_neighbours_in_rank_order(self):
+        song = self.songs[0]
+        RelatedSong.objects.bulk_create([
+            RelatedSong(song=song, related=self.songs[4], rank=0, score=0.9),
+            RelatedSong(song=song, related=self.songs[1], rank=1, score=0.5),
+        ])
+        response = self.client.get(f'/content/songs/{song.id}/related_songs/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data], [self.songs[4].id, self.songs[1].id])
+
+    def test_songs_without_neighbours_fall_back_to_album_artist_and_tag(self):
+        response = self.client.get(f'/content/songs/{self.songs[0].id}/related_songs/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({row['id'] for row in response.data}, {self.songs[1].id, self.songs[2].id})
+
+    def test_unknown_song_is_not_found(self):
+        for pk in ('999999', 'abc'):
+            self.assertEqual(self.client.get(f'/content/songs/{pk}/related_songs/').status_code, 404)
+
+
+class ConditionalGetTests(CatalogTestCase):
+    def assertRevalidates(self, path):
+        """Fetch `path`, check a repeat with its ETag is a 304, and return the ETag."""
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        return etag
+
+    def test_album_list_changes_with_the_catalog(self):
+        etag = self.assertRevalidates('/content/albums/')
+        album = self.albums[0]
+        album.year = 1999
+        with self.captureOnCommitCallbacks(execute=True):
+            album.save()
+            # Not before the write commits, or a request in between would cache the old rows
+            self.assertEqual(self.client.get('/content/albums/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get('/content/albums/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(next(row['year'] for row in response.data if row['id'] == album.id), 1999)
+
+    def test_unlike_changes_the_liked_songs_etag(self):
+        UserLikedSong(user=self.user, song=self.songs[0]).save()
+        etag = self.assertRevalidates('/content/liked-songs')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/content/liked-songs', {'song_id': self.songs[0].id}, format='json')
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get('/content/liked-songs', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+    def test_history_delete_changes_the_history_etag(self):
+        history = UserSongHistory.objects.create(user=self.user, song=self.songs[0], count=1)
+        etag = self.assertRevalidates('/content/songs-history/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/content/songs-history/', {'id': history.id}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/content/songs-history/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etags_are_per_user(self):
+        etag = self.assertRevalidates('/content/liked-songs')
+        other = User.objects.create_user('other', 'other@example.com', 'Other-pass-1')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=other).key}')
+        self.assertEqual(self.client.get('/content/liked-songs', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class AssetStatusTests(CatalogTestCase):
+    def set_jobs(self, *jobs):
+        album = self.albums[0]
+        AssetJob.objects.bulk_create([
+            AssetJob(entity='album', object_id=album.id, path=path, message=path, status=status) for path, status in jobs
+        ])
+        refresh_asset_status('album', album.id)
+        album.refresh_from_db()
+        return album.asset_status
+
+    def test_a_later_upload_of_a_path_supersedes_its_failed_job(self):
+        self.assertEqual(self.set_jobs(('a.png', 'Failed'), ('a.png', 'Done')), 'Ready')
+
+    def test_pending_while_a_retry_is_queued(self):
+        self.assertEqual(self.set_jobs(('a.png', 'Failed'), ('a.png', 'Pending')), 'Pending')
+
+    def test_failed_while_another_path_still_failed(self):
+        self.assertEqual(self.set_jobs(('a.png', 'Done'), ('b.png', 'Failed'), ('c.png', 'Pending')), 'Failed')
+
+
+class KeysetPaginationTests(CatalogTestCase):
+    def follow(self, path, limit):
+        """Every row of `path`, walking its cursor pages of `limit` rows."""
+        rows, url = [], f'{path}?cursor=&limit={limit}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            rows += response.data['results']
+            url = response.data['next']
+        return rows
+
+    def test_history_pages_by_access_time_then_id(self):
+        accessed_at = now()
+        # Two pairs share an access time, so the id breaks the tie across pages
+        UserSongHistory.objects.bulk_create([
+            UserSongHistory(user=self.user, song=song, count=1, accessed_at=accessed_at - timedelta(minutes=index // 2))
+            for index, song in enumerate(self.songs[:5])
+        ])
+        expected = list(self.user.song_history.order_by('-accessed_at', '-id').values_list('id', flat=True))
+        self.assertEqual([row['id'] for row in self.follow('/content/songs-history/', 2)], expected)
+
+    def test_playlist_songs_page_in_position_order(self):
+        playlist = self.make_playlist(list(reversed(self.songs)))
+        rows = self.follow(f'/content/playlists/{playlist.id}/songs/', 4)
+        self.assertEqual([row['song']['id'] for row in rows], [song.id for song in reversed(self.songs)])
+
+    def test_limit_offset_is_kept_without_a_cursor(self):
+        playlist = self.make_playlist(self.songs)
+        response = self.client.get(f'/content/playlists/{playlist.id}/songs/', {'limit': 2, 'offset': 4})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 6)
+        self.assertEqual([row['song']['id'] for row in response.data['results']], [song.id for song in self.songs[4:]])
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ('garbage', 'WyJ4IiwgMV0='):
+            self.assertEqual(self.client.get('/content/songs-history/', {'cursor': cursor}).status_code, 404)
+
+
+class CatalogSyncTests(CatalogTestCase):
+    def test_snapshot_revalidates_until_the_catalog_changes(self):
+        response = self.client.get('/content/catalog/snapshot')
+        self.assertEqual(response.status_code, 200)
+        snapshot = json.loads(response.content)
+        self.assertEqual(snapshot['version'], catalog.current_version())
+        self.assertEqual(sorted(row[0] for row in snapshot['songs']), sorted(song.id for song in self.songs))
+
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/content/catalog/snapshot', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.albums[0].save()
+        self.assertEqual(self.client.get('/content/catalog/snapshot', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_changes_since_a_version(self):
+        version = catalog.current_version()
+        album = self.albums[0]
+        album.title = 'Evening Tides'
+        album.save()
+        deleted_id = self.songs[5].id
+        self.songs[5].delete()
+
+        response = self.client.get('/content/catalog/changes', {'since': version})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], catalog.current_version())
+        title = catalog.FIELDS['albums'].index('title')
+        self.assertEqual([row[title] for row in response.data['changed']['albums']], ['Evening Tides'])
+        self.assertEqual(response.data['deleted'], {'songs': [deleted_id]})
+
+        response = self.client.get('/content/catalog/changes', {'since': response.data['version']})
+        self.assertEqual((response.data['changed'], response.data['deleted']), ({}, {}))
+
+    def test_bad_or_stale_versions(self):
+        self.assertEqual(self.client.get('/content/catalog/changes', {'since': 'x'}).status_code, 400)
+        version = catalog.current_version()
+        catalog.record_reset()
+        self.assertEqual(self.client.get('/content/catalog/changes', {'since': version}).status_code, 410)
+
+
+class PlaylistPositionTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.playlist = self.make_playlist(self.songs[:4])
+        self.entries = list(self.playlist.playlist_songs.order_by('position'))
+
+    def order(self):
+        return list(self.playlist.playlist_songs.order_by('position', 'id').values_list('id', flat=True))
+
+    def post(self, name, data):
+        return self.client.post(f'/content/playlists/{self.playlist.id}/{name}/', data, format='json')
+
+    def test_move_to_top_and_after_a_song(self):
+        first, second, third, fourth = [entry.id for entry in self.entries]
+        self.assertEqual(self.post('move', {'playlistsong_id': third, 'after_id': None}).status_code, 200)
+        self.assertEqual(self.order(), [third, first, second, fourth])
+        self.assertEqual(self.post('move', {'playlistsong_id': third, 'after_id': fourth}).status_code, 200)
+        self.assertEqual(self.order(), [first, second, fourth, third])
+
+    def test_repeated_moves_into_the_same_gap_renumber(self):
+        first, second = self.entries[0].id, self.entries[1].id
+        for entry in self.entries[2:] * 20:
+            self.assertEqual(self.post('move', {'playlistsong_id': entry.id, 'after_id': first}).status_code, 200)
+        self.assertEqual(self.order()[0], first)
+        self.assertEqual(self.order()[-1], second)
+
+    def test_reorder_sets_the_whole_order(self):
+        ids = [entry.id for entry in reversed(self.entries)]
+        self.assertEqual(self.post('reorder', {'playlistsong_ids': ids}).status_code, 200)
+        self.assertEqual(self.order(), ids)
+        self.assertEqual(self.post('reorder', {'playlistsong_ids': ids[:3]}).status_code, 400)
+
+    def test_invalid_moves(self):
+        entry = self.entries[0].id
+        self.assertEqual(self.post('move', {'playlistsong_id': entry, 'after_id': entry}).status_code, 400)
+        self.assertEqual(self.post('move', {'playlistsong_id': entry, 'after_id': 999999}).status_code, 404)
+
+        other = User.objects.create_user('other', 'other@example.com', 'Other-pass-1')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=other).key}')
+        # Other users' playlists are outside the viewset's queryset
+        self.assertEqual(self.post('move', {'playlistsong_id': entry, 'after_id': None}).status_code, 404)
+
+
+class PlayEventBufferTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.buffer = PlayEventBuffer(mode="buffered", flush_interval=60, max_retries=2)
+        self.addCleanup(lambda: self.buffer._timer and self.buffer._timer.cancel())
+
+    def test_plays_are_coalesced_into_history_and_counts(self):
+        for _ in range(3):
+            self.buffer.record(self.user.id, self.songs[0].id)
+        self.buffer.record(None, self.songs[1].id)
+        self.assertEqual(self.buffer.flush(), 4)
+
+        self.assertEqual(UserSongHistory.objects.get(user=self.user, song=self.songs[0]).count, 3)
+        self.assertEqual(Song.objects.get(pk=self.songs[1].pk).count, 1)
+
+    def test_plays_of_deleted_songs_and_users_are_dropped(self):
+        other = User.objects.create_user('other', 'other@example.com', 'Other-pass-1')
+        self.buffer.record(self.user.id, self.songs[0].id)
+        self.buffer.record(self.user.id, self.songs[1].id)
+        self.buffer.record(other.id, self.songs[1].id)
+        self.songs[0].delete()
+        other.delete()
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.buffer.pending(), 0)
+        self.assertEqual(list(UserSongHistory.objects.values_list('user_id', 'song_id')), [(self.user.id, self.songs[1].id)])
+        self.assertEqual(Song.objects.get(pk=self.songs[1].pk).count, 2)
+
+    def test_failed_batches_are_retried_then_dropped(self):
+        self.buffer.record(self.user.id, self.songs[0].id)
+        with mock.patch('songs.playevents.apply_play_events', side_effect=RuntimeError), \
+                self.assertLogs('songs.playevents', 'ERROR'):
+            for _ in range(self.buffer.max_retries):
+                self.assertEqual(self.buffer.flush(), 0)
+                self.assertEqual(self.buffer.pending(), 1)
+                # The timer retries the batch even if no other play arrives
+                self.assertIsNotNone(self.buffer._timer)
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.pending(), 0)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AlbumViewSet, ArtistViewSet, TagViewSet, SongViewSet, UserSongHistoryView, HeroSlidesViewSet, UserLikedSongView, LatestUserPlaylists, GlobalSearchAPIView, SongSearchView, PlaylistViewSet, PlaylistSeekerViewSet
+from .views import AlbumViewSet, ArtistViewSet, TagViewSet, SongViewSet, UserSongHistoryView, HeroSlidesViewSet, UserLikedSongView, LatestUserPlaylists, GlobalSearchAPIView, SongSearchView, PlaylistViewSet, PlaylistSeekerViewSet, HomeFeedView, CatalogSnapshotView, CatalogChangesView
 
 router = DefaultRouter()
 router.register(r'albums', AlbumViewSet)
@@ -17,7 +17,10 @@ urlpatterns = [
     path('liked-songs', UserLikedSongView.as_view(), name='liked-songs'),
     path('liked-songs/<int:id>', UserLikedSongView.as_view(), name='liked-song-detail'),
     path('songs-history/', UserSongHistoryView.as_view(), name='songs-history'),
+    path('home', HomeFeedView.as_view(), name='home'),
     path('latest-playlists', LatestUserPlaylists.as_view(), name='latest-playlists'),
     path('global-search', GlobalSearchAPIView.as_view(), name='global-search'),
     path('filter', SongSearchView.as_view(), name='global-search'),
+    path('catalog/snapshot', CatalogSnapshotView.as_view(), name='catalog-snapshot'),
+    path('catalog/changes', CatalogChangesView.as_view(), name='catalog-changes'),
 ]
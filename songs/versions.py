@@ -0,0 +1,102 @@
+import time
+from django.core.cache import cache, caches, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+from django.db import transaction
+
+# Version counters for cached data derived from the database.
+#
+# A version is a millisecond timestamp that only moves forward, so a counter
+# evicted from the cache comes back larger than any value handed out before it.
+# Bumps wait for the writer's transaction to commit: a request reading the
+# new version before then would see the old rows, and cache them under it.
+#
+# The counters only invalidate what every worker derived when they live in a
+# cache all workers share; see CACHES in the settings.
+
+CATALOG = 'catalog'
+
+
+def is_shared():
+    """Whether a bump reaches every process, i.e. the default cache is not kept per process."""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if is_shared():
+        return []
+    return [Warning(
+        "The default cache is kept per process, so version bumps do not reach other workers.",
+        hint="Set CACHES in the config to a backend every worker shares, e.g. Redis, Memcached or the database cache.",
+        id='songs.W001',
+    )]
+
+
+def album_scope(album_id):
+    return f'album:{album_id}'
+
+
+def artist_scope(artist_id):
+    return f'artist:{artist_id}'
+
+
+def tag_scope(tag_id):
+    return f'tag:{tag_id}'
+
+
+def playlist_scope(playlist_id):
+    return f'playlist:{playlist_id}'
+
+
+def lyrics_scope(song_id):
+    return f'lyrics:{song_id}'
+
+
+def user_scope(user_id):
+    """A user's likes, history and playlists."""
+    return f'user:{user_id}'
+
+
+def auth_scope(user_id):
+    """A user's tokens and account state, as cached by accounts.authentication."""
+    return f'auth:{user_id}'
+
+
+def _key(scope):
+    return f'version:{scope}'
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def get_versions(*scopes):
+    """Return {scope: version} for every scope in one cache round trip."""
+    keys = {_key(scope): scope for scope in scopes}
+    found = cache.get_many(list(keys))
+    missing = {key: _now_ms() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        found.update(missing)
+    return {scope: found[key] for key, scope in keys.items()}
+
+
+def get_version(scope):
+    return get_versions(scope)[scope]
+
+
+def bump_version(*scopes):
+    """
+    Move every scope to a new version, invalidating whatever was derived
+    from it, once the current transaction commits; right away outside one.
+    """
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def _bump(scopes):
+    keys = [_key(scope) for scope in scopes]
+    current = cache.get_many(keys)
+    now_ms = _now_ms()
+    cache.set_many({key: max(now_ms, current.get(key, 0) + 1) for key in keys}, timeout=None)
@@ -2,54 +2,90 @@ from rest_framework import viewsets, permissions
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Album, Artist, Tag, Song, UserSongHistory, UserLikedSong, Playlist, PlaylistSong
+from .models import Album, Artist, Tag, Song, SongLyrics, UserSongHistory, UserLikedSong, Playlist, PlaylistSong, PlaylistSummary
 from .serializers import AlbumSerializer, ArtistSerializer, TagSerializer, SongSerializer, UserSongHistorySerializer, UserLikedSongSerializer, PlaylistSerializer, PlaylistSongSerializer, SongArtistSerializer
 from django_filters.rest_framework import DjangoFilterBackend
 from .filters import SongFilter, ArtistFilter, AlbumFilter, TagFilter
-from django.utils.timezone import now
-from .functions import get_slides
+from .functions import get_slides, get_latest_playlists, get_top_songs
+from .playevents import record_play
+from .sampling import pick_random
+from .lyrics import get_lyrics
+from . import search, catalog
+from .signals import playlist_songs_changed
+from .conditional import ConditionalGetMixin, conditional_get
+from .responsecache import CachedResponseMixin, cached_response
+from .versions import CATALOG, bump_version, album_scope, artist_scope, tag_scope, playlist_scope, user_scope
 from django.shortcuts import get_object_or_404
-from .paginators import CustomLimitOffsetPagination
-from django.db.models import Q, Exists, OuterRef
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.db import transaction
+from .paginators import CustomLimitOffsetPagination, get_paginator
+from django.db.models import Q, Exists, OuterRef, prefetch_related_objects
 from rest_framework.decorators import action
-from random import randint
+import gzip
+import re
 from config import CONFIG
+from accounts.helpers import get_account_config
 
-class AlbumViewSet(viewsets.ReadOnlyModelViewSet):
+# Most upcoming songs PlaylistSeekerViewSet.seek returns in one call
+MAX_SEEK_WINDOW = 50
+
+# Recent history and top songs HomeFeedView returns
+HOME_HISTORY_LIMIT = 10
+HOME_TOP_SONGS_LIMIT = 12
+
+# Most lines SongViewSet.lyrics returns on either side of the current one
+MAX_LYRICS_CONTEXT = 50
+
+# Accept-Encoding values that get the catalog snapshot as it is cached
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
+# SongSearchView searchby values answered by the full-text index ('0' is every column)
+SONG_SEARCH_COLUMNS = {'0': None, '1': 'name', '2': 'artists', '3': 'album', '4': 'tags'}
+
+def user_data_scopes(view, request, *args, **kwargs):
+    """Versions behind responses built from the catalog and the user's likes, history or playlists."""
+    return [CATALOG, user_scope(request.user.pk)]
+
+class AlbumViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Album.objects.all()
     serializer_class = AlbumSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = AlbumFilter
 
     @action(detail=True, methods=['get'])
+    @conditional_get()
+    @cached_response()
     def songs(self, request, pk=None):
         album = self.get_object()
 
-        paginator = CustomLimitOffsetPagination()
-        paginated_songs = paginator.paginate_queryset(album.songs.all(), request)
+        paginator = get_paginator(request)
+        paginated_songs = paginator.paginate_queryset(SongSerializer.setup_eager_loading(album.songs.order_by('-id')), request)
         serializer = SongSerializer(paginated_songs, many=True)
         paginated_response = paginator.get_paginated_response(serializer.data)
         paginated_response.data["album"] = AlbumSerializer(album).data
         return paginated_response
 
-class ArtistViewSet(viewsets.ReadOnlyModelViewSet):
+class ArtistViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Artist.objects.all()
     serializer_class = ArtistSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = ArtistFilter
 
     @action(detail=True, methods=['get'])
+    @conditional_get()
+    @cached_response()
     def songs(self, request, pk=None):
         artist = self.get_object()
 
-        paginator = CustomLimitOffsetPagination()
-        paginated_songs = paginator.paginate_queryset(artist.artist_songs.all(), request)
+        paginator = get_paginator(request)
+        paginated_songs = paginator.paginate_queryset(SongArtistSerializer.setup_eager_loading(artist.artist_songs.order_by('-id')), request)
         serializer = SongArtistSerializer(paginated_songs, many=True)
         paginated_response = paginator.get_paginated_response(serializer.data)
         paginated_response.data["artist"] = ArtistSerializer(artist).data
         return paginated_response
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     filter_backends = (DjangoFilterBackend,)
@@ -61,6 +97,13 @@ class SongViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend,)
     filterset_class = SongFilter
 
+    def get_queryset(self):
+        return SongSerializer.setup_eager_loading(super().get_queryset())
+
+    @cached_response()
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     def retrieve(self, request, *args, **kwargs):
         user = request.user
         song = self.get_object()
@@ -69,24 +112,14 @@ class SongViewSet(viewsets.ReadOnlyModelViewSet):
 
         just_get = request.query_params.get('justget') == 'true'
 
-        if user.is_authenticated and not just_get:
-            user_song_history, created = UserSongHistory.objects.update_or_create(
-                user=user,
-                song=song,
-                defaults={'accessed_at': now()}
-            )
-            if not created:
-                user_song_history.count += 1
-            else:
-                user_song_history.count = 1
-            user_song_history.save()
+        if not just_get:
+            record_play(user, song)
 
+        if user.is_authenticated and not just_get:
             liked = user.liked_songs.filter(song=song).exists()
 
-        if not just_get:
-            song.count += 1
-            song.save()
-        response = super().retrieve(request, *args, **kwargs)
+        serializer = self.get_serializer(song)
+        response = Response(serializer.data)
         
         if liked is not None:
             response.data['liked'] = liked
@@ -95,33 +128,30 @@ class SongViewSet(viewsets.ReadOnlyModelViewSet):
     
     @action(detail=False, methods=['get'])
     def random(self, request):
-        count = self.queryset.count()
-        if count == 0:
+        """A random song from the catalog, or from one album, artist or tag."""
+        scope = CATALOG
+        for param, make_scope in (('album', album_scope), ('artist', artist_scope), ('tag', tag_scope)):
+            scope_id = request.query_params.get(param)
+            if scope_id is not None:
+                if not scope_id.isdigit():
+                    return Response({"detail": f"{param} must be an id"}, status=400)
+                scope = make_scope(int(scope_id))
+                break
+
+        picked = pick_random(scope, self.get_queryset())
+        if picked is None:
             return Response({"detail": "No songs available"}, status=404)
         
         user = request.user
-        index = randint(0, count - 1)
-        song = self.queryset.only('id')[index]
+        index, song = picked
         
         liked = None
 
-        if user.is_authenticated:
-            user_song_history, created = UserSongHistory.objects.update_or_create(
-                user=user,
-                song=song,
-                defaults={'accessed_at': now()}
-            )
-            if not created:
-                user_song_history.count += 1
-            else:
-                user_song_history.count = 1
-            user_song_history.save()
+        record_play(user, song)
 
+        if user.is_authenticated:
             liked = user.liked_songs.filter(song=song).exists()
-            
-        song.count += 1
-        song.save()
-        
+
         serializer = self.get_serializer(song)
 
         response = serializer.data
@@ -132,8 +162,47 @@ class SongViewSet(viewsets.ReadOnlyModelViewSet):
         
         return Response(response)
 
+    @action(detail=True, methods=['get'])
+    def lyrics(self, request, pk=None):
+        """
+        The song's synced lyrics. With `t`, a playback position in seconds,
+        only the line playing then and `before`/`after` lines around it.
+        """
+        lyrics = get_lyrics(pk) if pk.isdigit() else None
+        if lyrics is None:
+            return Response({"detail": "No lyrics for this song."}, status=status.HTTP_404_NOT_FOUND)
+
+        position = request.query_params.get('t')
+        if position is None:
+            return Response(lyrics.to_dict())
+
+        try:
+            position_ms = int(float(position) * 1000)
+            before = int(request.query_params.get('before', 2))
+            after = int(request.query_params.get('after', 5))
+        except (ValueError, OverflowError):
+            return Response({"error": "t, before and after must be numbers."}, status=status.HTTP_400_BAD_REQUEST)
+        if not (0 <= before <= MAX_LYRICS_CONTEXT and 0 <= after <= MAX_LYRICS_CONTEXT):
+            return Response(
+                {"error": f"before and after must be between 0 and {MAX_LYRICS_CONTEXT}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(lyrics.around(position_ms, before, after))
+
     @action(detail=True, methods=['get'])
     def related_songs(self, request, pk=None):
+        if not pk.isdigit():
+            return Response({"detail": "No Song matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+
+        # Precomputed by the build_related_songs command, one indexed read
+        related_songs = list(
+            self.get_queryset().filter(neighbour_of__song_id=pk).order_by('neighbour_of__rank')[:24]
+        )
+        if related_songs:
+            serializer = self.get_serializer(related_songs, many=True)
+            return Response(serializer.data)
+
+        # Songs added since the last build fall back to live queries
         song = self.get_object()
 
         related_songs = Song.objects.filter(album=song.album).exclude(id=song.id)
@@ -147,20 +216,20 @@ class SongViewSet(viewsets.ReadOnlyModelViewSet):
             if tag_ids:
                 related_songs = related_songs | Song.objects.filter(song_tags__tag_id__in=tag_ids).exclude(id=song.id)
 
-        related_songs = related_songs.distinct().order_by('-count')[:24]
+        related_songs = SongSerializer.setup_eager_loading(related_songs.distinct().order_by('-count'))[:24]
 
         serializer = self.get_serializer(related_songs, many=True)
         return Response(serializer.data)
 
 
-class PlaylistViewSet(viewsets.ModelViewSet):
+class PlaylistViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = PlaylistSerializer
 
     def get_queryset(self):
         if not self.request.user.is_authenticated:
             return Playlist.objects.none()  # Return an empty queryset if user is not authenticated
 
-        playlists = self.request.user.playlists.all()
+        playlists = PlaylistSerializer.setup_eager_loading(self.request.user.playlists.all())
 
         # Check if a song_id is provided in the query params
         song_id = self.request.query_params.get('song_id')
@@ -173,6 +242,10 @@ class PlaylistViewSet(viewsets.ModelViewSet):
 
         return playlists
 
+    def version_scopes(self, request, *args, **kwargs):
+        # Playlist and playlist song writes move their owner's version
+        return user_data_scopes(self, request)
+
     def create(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response({"error": "Authentication required."}, status=status.HTTP_401_UNAUTHORIZED)
@@ -193,7 +266,7 @@ class PlaylistViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        songs = Song.objects.filter(id__in=songs_id)
+        songs = Song.objects.filter(id__in=songs_id).select_related('album')
         songs_ordered = sorted(songs, key=lambda song: songs_id.index(song.id))
         if songs.count() != len(songs_id):
             return Response(
@@ -201,20 +274,25 @@ class PlaylistViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        playlist = Playlist.objects.create(
-            user=request.user,
-            name=name,
-            privacy_type=privacy_type
-        )
+        with transaction.atomic():
+            playlist = Playlist.objects.create(
+                user=request.user,
+                name=name,
+                privacy_type=privacy_type
+            )
 
-        PlaylistSong.objects.bulk_create([
-            PlaylistSong(playlist=playlist, song=song) for song in songs_ordered
-        ])
+            PlaylistSong.objects.bulk_create([
+                PlaylistSong(playlist=playlist, song=song, position=(index + 1) * PlaylistSong.POSITION_STEP)
+                for index, song in enumerate(songs_ordered)
+            ])
+            PlaylistSummary.songs_added(playlist, songs_ordered, created=True)
+            playlist_songs_changed.send(sender=Playlist, playlist_id=playlist.id, user_id=playlist.user_id)
 
         serializer = self.get_serializer(playlist)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['get'])
+    @conditional_get()
     def songs(self, request, pk=None):
         playlist = self.get_object()
 
@@ -222,8 +300,8 @@ class PlaylistViewSet(viewsets.ModelViewSet):
             if not request.user.is_authenticated or playlist.user != request.user:
                 return Response({"error": "Access denied."}, status=status.HTTP_403_FORBIDDEN)
 
-        paginator = CustomLimitOffsetPagination()
-        paginated_songs = paginator.paginate_queryset(playlist.playlist_songs.all(), request)
+        paginator = get_paginator(request)
+        paginated_songs = paginator.paginate_queryset(PlaylistSongSerializer.setup_eager_loading(playlist.playlist_songs.order_by('position', 'id')), request)
         serializer = PlaylistSongSerializer(paginated_songs, many=True)
         paginated_response = paginator.get_paginated_response(serializer.data)
         paginated_response.data["playlist"] = PlaylistSerializer(playlist).data
@@ -244,7 +322,7 @@ class PlaylistViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        songs = Song.objects.filter(id__in=songs_id)
+        songs = Song.objects.filter(id__in=songs_id).select_related('album')
         songs_ordered = sorted(songs, key=lambda song: songs_id.index(song.id))
 
         if songs.count() != len(songs_id):
@@ -254,9 +332,14 @@ class PlaylistViewSet(viewsets.ModelViewSet):
             )
 
         # Add songs without checking for duplicates
-        PlaylistSong.objects.bulk_create([
-            PlaylistSong(playlist=playlist, song=song) for song in songs_ordered
-        ])
+        with transaction.atomic():
+            start = playlist.next_position()
+            PlaylistSong.objects.bulk_create([
+                PlaylistSong(playlist=playlist, song=song, position=start + index * PlaylistSong.POSITION_STEP)
+                for index, song in enumerate(songs_ordered)
+            ])
+            PlaylistSummary.songs_added(playlist, songs_ordered)
+            playlist_songs_changed.send(sender=Playlist, playlist_id=playlist.id, user_id=playlist.user_id)
         return Response({"message": "Songs added successfully."}, status=status.HTTP_200_OK)
 
     @action(detail=True, methods=['post'])
@@ -273,13 +356,77 @@ class PlaylistViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        deleted_count, _ = PlaylistSong.objects.filter(playlist=playlist, song_id__in=songs_id).delete()
+        with transaction.atomic():
+            deleted_count, _ = PlaylistSong.objects.filter(playlist=playlist, song_id__in=songs_id).delete()
+            if deleted_count:
+                PlaylistSummary.refresh(playlist)
+                playlist_songs_changed.send(sender=Playlist, playlist_id=playlist.id, user_id=playlist.user_id)
 
         if deleted_count == 0:
             return Response({"error": "No matching songs found in the playlist."}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({"message": "Songs removed successfully."}, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=['post'])
+    def move(self, request, pk=None):
+        """Moves one song right after `after_id`, or to the top when `after_id` is null"""
+        playlist = self.get_object()
+
+        if playlist.user != request.user:
+            return Response({"error": "You do not have permission to modify this playlist."}, status=status.HTTP_403_FORBIDDEN)
+
+        playlistsong_id = request.data.get('playlistsong_id')
+        after_id = request.data.get('after_id')
+        if not isinstance(playlistsong_id, int) or (after_id is not None and not isinstance(after_id, int)):
+            return Response(
+                {"error": "playlistsong_id is required and after_id must be a playlist song ID or null."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if playlistsong_id == after_id:
+            return Response({"error": "A song cannot be moved after itself."}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            try:
+                playlist_song = playlist.playlist_songs.get(id=playlistsong_id)
+                after = playlist.playlist_songs.get(id=after_id) if after_id is not None else None
+            except PlaylistSong.DoesNotExist:
+                return Response({"error": "Song not found in playlist."}, status=status.HTTP_404_NOT_FOUND)
+
+            playlist.move_song(playlist_song, after)
+            PlaylistSummary.refresh(playlist)
+            playlist_songs_changed.send(sender=Playlist, playlist_id=playlist.id, user_id=playlist.user_id)
+
+        return Response({"message": "Song moved successfully."}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'])
+    def reorder(self, request, pk=None):
+        """Sets the full order of a playlist from a list of every playlist song ID"""
+        playlist = self.get_object()
+
+        if playlist.user != request.user:
+            return Response({"error": "You do not have permission to modify this playlist."}, status=status.HTTP_403_FORBIDDEN)
+
+        playlistsong_ids = request.data.get('playlistsong_ids')
+        if not playlistsong_ids or not isinstance(playlistsong_ids, list):
+            return Response(
+                {"error": "playlistsong_ids is required and must list every song of the playlist."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            current_ids = set(playlist.playlist_songs.values_list('id', flat=True))
+            if len(playlistsong_ids) != len(current_ids) or set(playlistsong_ids) != current_ids:
+                return Response(
+                    {"error": "playlistsong_ids must list every song of the playlist exactly once."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            playlist.renumber_songs(playlistsong_ids)
+            PlaylistSummary.refresh(playlist)
+            playlist_songs_changed.send(sender=Playlist, playlist_id=playlist.id, user_id=playlist.user_id)
+
+        return Response({"message": "Playlist reordered successfully."}, status=status.HTTP_200_OK)
+
 class PlaylistSeekerViewSet(viewsets.ModelViewSet):
     serializer_class = PlaylistSerializer
 
@@ -288,7 +435,14 @@ class PlaylistSeekerViewSet(viewsets.ModelViewSet):
             return Playlist.objects.none()  # Return an empty queryset if user is not authenticated
 
         playlists = Playlist.objects.filter(Q(privacy_type='Public') | Q(user=self.request.user))
-        return playlists
+        return PlaylistSerializer.setup_eager_loading(playlists)
+
+    def version_scopes(self, request, pk=None):
+        return [CATALOG, playlist_scope(pk)]
+
+    @conditional_get()
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     @action(detail=True, methods=['get'])
     def random(self, request, pk=None):
@@ -298,36 +452,30 @@ class PlaylistSeekerViewSet(viewsets.ModelViewSet):
         if playlist.privacy_type == "Private" and playlist.user != request.user:
             return Response({"error": "Access denied."}, status=status.HTTP_403_FORBIDDEN)
 
-        count = playlist.playlist_songs.count()
-        index = randint(0, count - 1)
-        playlist_song = playlist.playlist_songs.only('id')[index]
+        picked = pick_random(
+            playlist_scope(playlist.id),
+            PlaylistSongSerializer.setup_eager_loading(playlist.playlist_songs.all())
+        )
+        if picked is None:
+            return Response({"error": "Playlist has no songs."}, status=status.HTTP_404_NOT_FOUND)
+
+        _, playlist_song = picked
         song = playlist_song.song
         serializer = PlaylistSongSerializer(playlist_song)
 
         liked = None
 
-        if user.is_authenticated:
-            user_song_history, created = UserSongHistory.objects.update_or_create(
-                user=user,
-                song=song,
-                defaults={'accessed_at': now()}
-            )
-            if not created:
-                user_song_history.count += 1
-            else:
-                user_song_history.count = 1
-            user_song_history.save()
+        record_play(user, song)
 
+        if user.is_authenticated:
             liked = user.liked_songs.filter(song=song).exists()
-        
-        song.count += 1
-        song.save()
 
         if liked is not None:
             serializer.data["song"]["liked"] = liked
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
+    @conditional_get()
     def songs(self, request, pk=None):
         playlist = self.get_object()
 
@@ -335,8 +483,8 @@ class PlaylistSeekerViewSet(viewsets.ModelViewSet):
             if not request.user.is_authenticated or playlist.user != request.user:
                 return Response({"error": "Access denied."}, status=status.HTTP_403_FORBIDDEN)
 
-        paginator = CustomLimitOffsetPagination()
-        paginated_songs = paginator.paginate_queryset(playlist.playlist_songs.all(), request)
+        paginator = get_paginator(request)
+        paginated_songs = paginator.paginate_queryset(PlaylistSongSerializer.setup_eager_loading(playlist.playlist_songs.order_by('position', 'id')), request)
         serializer = PlaylistSongSerializer(paginated_songs, many=True)
         paginated_response = paginator.get_paginated_response(serializer.data)
         paginated_response.data["playlist"] = PlaylistSerializer(playlist).data
@@ -344,44 +492,60 @@ class PlaylistSeekerViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def seek(self, request, pk=None):
-        """Efficiently get the next and previous songs in a playlist."""
+        """
+        Efficiently get the previous and next songs in a playlist.
+        `window` also returns up to that many upcoming songs in `next_songs`,
+        so a client can fill its play queue in one call.
+        """
         playlist = self.get_object()
         playlistsong_id = request.query_params.get('playlistsong_id')
         loop = request.query_params.get('loop')
 
+        try:
+            window = int(request.query_params.get('window', 1))
+        except ValueError:
+            window = 0
+        if window < 1 or window > MAX_SEEK_WINDOW:
+            return Response({"error": f"window must be between 1 and {MAX_SEEK_WINDOW}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        playlist_songs = playlist.playlist_songs.select_related('song__album')
         current_playlistsong = None
-        next_song = None
         prev_song = None
 
         if (playlistsong_id):
             try:
-                current_playlistsong = playlist.playlist_songs.get(id=playlistsong_id)
-            except PlaylistSong.DoesNotExist:
+                current_playlistsong = playlist_songs.get(id=playlistsong_id)
+            except (PlaylistSong.DoesNotExist, ValueError):
                 return Response({"error": "Song not found in playlist."}, status=status.HTTP_404_NOT_FOUND)
 
         if (current_playlistsong):
-            next_song = playlist.playlist_songs.filter(id__gt=current_playlistsong.id).order_by('id').first()
-            prev_song = playlist.playlist_songs.filter(id__lt=current_playlistsong.id).order_by('-id').first()
+            next_songs = list(playlist_songs.after(current_playlistsong)[:window])
+            prev_song = playlist_songs.before(current_playlistsong).first()
         else:
-            next_song = playlist.playlist_songs.first()
+            next_songs = list(playlist_songs[:window])
 
         if (loop):
             if (prev_song == None):
-                prev_song = playlist.playlist_songs.last()
-            if (next_song == None):
-                next_song = playlist.playlist_songs.first()
+                prev_song = playlist_songs.last()
+            if (current_playlistsong and len(next_songs) < window):
+                next_songs += list(playlist_songs[:window - len(next_songs)])
+
+        # One round of prefetches for every song in the response
+        prefetch_related_objects(
+            [ps for ps in [prev_song, current_playlistsong, *next_songs] if ps],
+            *SongSerializer.song_prefetches('song__')
+        )
 
         data = {
             "previous_song": PlaylistSongSerializer(prev_song).data if prev_song else None,
             "current_song": PlaylistSongSerializer(current_playlistsong).data if current_playlistsong else None,
-            "next_song": PlaylistSongSerializer(next_song).data if next_song else None
+            "next_song": PlaylistSongSerializer(next_songs[0]).data if next_songs else None,
+            "next_songs": PlaylistSongSerializer(next_songs, many=True).data,
         }
 
         return Response(data, status=status.HTTP_200_OK)
 
 
-
-
 class HeroSlidesViewSet(APIView):
     def get(self, request):
         return Response(get_slides(request), status=status.HTTP_200_OK)
@@ -389,10 +553,11 @@ class HeroSlidesViewSet(APIView):
 class UserLikedSongView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
+    @conditional_get(user_data_scopes)
     def get(self, request, id=None):
         if id:
             try:
-                liked_song = request.user.liked_songs.get(id=int(id))
+                liked_song = UserLikedSongSerializer.setup_eager_loading(request.user.liked_songs.all()).get(id=int(id))
                 serializer = UserLikedSongSerializer(liked_song)
                 return Response(serializer.data)
             except ValueError:
@@ -400,8 +565,8 @@ class UserLikedSongView(APIView):
             except UserLikedSong.DoesNotExist:
                 return Response({"detail": "liked song not found!"}, status=status.HTTP_404_NOT_FOUND)
 
-        paginator = CustomLimitOffsetPagination()
-        paginated_liked_songs = paginator.paginate_queryset(request.user.liked_songs.all(), request)
+        paginator = get_paginator(request)
+        paginated_liked_songs = paginator.paginate_queryset(UserLikedSongSerializer.setup_eager_loading(request.user.liked_songs.order_by('-liked_at', '-id')), request)
         serializer = UserLikedSongSerializer(paginated_liked_songs, many=True)
         return paginator.get_paginated_response(serializer.data)
 
@@ -425,6 +590,7 @@ class UserLikedSongView(APIView):
             song = get_object_or_404(Song, id=song_id)
             likedSongRecord = request.user.liked_songs.get(song=song)
             likedSongRecord.delete()
+            bump_version(user_scope(request.user.pk))
             return Response({"detail": "Song removed from liked songs."}, status=status.HTTP_204_NO_CONTENT)
         except ValueError:
             return Response({"detail": "id is required!"}, status=status.HTTP_404_NOT_FOUND)
@@ -434,9 +600,10 @@ class UserLikedSongView(APIView):
 class UserSongHistoryView(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
+    @conditional_get(user_data_scopes)
     def get(self, request):
-        paginator = CustomLimitOffsetPagination()
-        paginated_history_songs = paginator.paginate_queryset(request.user.song_history.all(), request)
+        paginator = get_paginator(request)
+        paginated_history_songs = paginator.paginate_queryset(UserLikedSongSerializer.setup_eager_loading(request.user.song_history.order_by('-accessed_at', '-id')), request)
         serializer = UserLikedSongSerializer(paginated_history_songs, many=True)
         return paginator.get_paginated_response(serializer.data)
 
@@ -445,6 +612,7 @@ class UserSongHistoryView(APIView):
             id = int(request.data.get('id'))
             historySongRecord = request.user.song_history.get(id=id)
             historySongRecord.delete()
+            bump_version(user_scope(request.user.pk))
             return Response({"detail": "Song removed from history songs."}, status=status.HTTP_204_NO_CONTENT)
         except ValueError:
             return Response({"detail": "id is required!"}, status=status.HTTP_404_NOT_FOUND)
@@ -455,36 +623,33 @@ class LatestUserPlaylists(APIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get(self, request):
-        limit = 12
+        return Response(get_latest_playlists(request.user))
 
-        response_data = []
+class HomeFeedView(APIView):
+    """
+    Everything the app shows on start in one call: slides, latest playlists,
+    recent history, top songs and the account config. Slides and top songs
+    are shared and cached, so a signed-in user costs a fixed handful of
+    queries (token, liked songs count and cover, playlists, history with its
+    two prefetches) whatever the size of their library.
+    """
+
+    def get(self, request):
+        user = request.user if request.user.is_authenticated else None
+        latest_playlists, history = [], []
+        if user:
+            latest_playlists = get_latest_playlists(user)
+            recent_history = UserSongHistorySerializer.setup_eager_loading(user.song_history.all())[:HOME_HISTORY_LIMIT]
+            history = UserSongHistorySerializer(recent_history, many=True).data
+
+        return Response({
+            "slides": get_slides(request),
+            "latest_playlists": latest_playlists,
+            "history": history,
+            "top_songs": get_top_songs(HOME_TOP_SONGS_LIMIT),
+            "config": get_account_config(user),
+        }, status=status.HTTP_200_OK)
 
-        user = request.user
-        liked_songs_count = user.liked_songs.count()
-        if (liked_songs_count):
-            response_data.append({
-                "id": "liked_songs",
-                "name": "Liked Songs",
-                "privacy_type": "Private",
-                "songs_count": liked_songs_count,
-                "thumbnail": user.liked_songs.first().song.album.thumbnail300x300
-            })
-            limit-=1
-
-        playlists = user.playlists.all()[:limit]
-
-        for playlist in playlists:
-            total_songs = playlist.playlist_songs.count()
-            if (total_songs):
-                response_data.append({
-                    "id": playlist.id,
-                    "name": playlist.name,
-                    "privacy_type": playlist.privacy_type,
-                    "songs_count": playlist.playlist_songs.count(),
-                    "thumbnail": playlist.playlist_songs.first().song.album.thumbnail300x300,
-                })
-        return Response(response_data)
-    
 class GlobalSearchAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -496,6 +661,95 @@ class GlobalSearchAPIView(APIView):
         if not query:
             return Response({'error': 'Query parameter "q" is required.'}, status=400)
 
+        song_ids = search.song_ids_subquery(query)
+        if song_ids is None:
+            user_histories, songs, user_liked_songs, artists, albums, tags = self.icontains_search(user, query, limit)
+            lyric_matches = self.icontains_lyrics(query, limit)
+        else:
+            user_histories, songs, user_liked_songs, artists, albums, tags = self.full_text_search(user, query, limit, song_ids)
+            lyric_matches = search.search_lyrics(query, limit)
+
+        # Search for playlists
+        playlists = PlaylistSerializer.setup_eager_loading(Playlist.objects.filter(Q(name__icontains=query) & (Q(privacy_type='Public') | Q(user=user))).distinct())[:limit]
+
+        # Serialize results
+        data = {
+            'user_history': UserSongHistorySerializer(user_histories, many=True).data,
+            'songs': SongSerializer(songs, many=True).data,
+            'user_liked_songs': UserLikedSongSerializer(user_liked_songs, many=True).data,
+            'artists': ArtistSerializer(artists, many=True).data,
+            'albums': AlbumSerializer(albums, many=True).data,
+            'playlists': PlaylistSerializer(playlists, many=True).data,
+            'tags': TagSerializer(tags, many=True).data,
+            'lyrics': self.lyric_results(lyric_matches),
+        }
+
+        return Response(data)
+
+    def lyric_results(self, lyric_matches):
+        """Each matching song with its best matching line: index, start time in ms and a highlighted snippet."""
+        songs = SongSerializer.setup_eager_loading(Song.objects.filter(id__in=[match.song_id for match in lyric_matches]))
+        songs = {song.id: song for song in songs}
+        return [
+            {
+                'song': SongSerializer(songs[match.song_id]).data,
+                'line': match.line,
+                'time': match.time,
+                'snippet': match.snippet,
+            }
+            for match in lyric_matches if match.song_id in songs
+        ]
+
+    def full_text_search(self, user, query, limit, song_ids):
+        # Best matches across the catalog, enough to fill every song section
+        ranked_ids = search.search_song_ids(query, limit=limit * 3 + 1)
+        used_song_ids = set()
+
+        # Search in user history and get unique song IDs
+        user_histories = self.top_ranked(
+            user.song_history.filter(song_id__in=song_ids), ranked_ids, limit+1, UserSongHistorySerializer
+        )
+        used_song_ids.update(history.song_id for history in user_histories)
+
+        # Search in songs, excluding already used song IDs
+        top_ids = [song_id for song_id in ranked_ids if song_id not in used_song_ids][:limit]
+        songs = search.in_rank_order(SongSerializer.setup_eager_loading(Song.objects.filter(id__in=top_ids)), top_ids)
+        used_song_ids.update(top_ids)
+
+        # Search in user liked songs, excluding already used song IDs
+        user_liked_songs = self.top_ranked(
+            user.liked_songs.filter(song_id__in=song_ids).exclude(song_id__in=used_song_ids),
+            ranked_ids, limit, UserLikedSongSerializer
+        )
+
+        # Search for artists, albums and tags
+        entities = []
+        for kind, model in (('artist', Artist), ('album', Album), ('tag', Tag)):
+            entity_ids = search.search_entity_ids(kind, query, limit)
+            entities.append(search.in_rank_order(model.objects.filter(id__in=entity_ids), entity_ids))
+        artists, albums, tags = entities
+
+        return user_histories, songs, user_liked_songs, artists, albums, tags
+
+    def top_ranked(self, queryset, ranked_ids, count, serializer_class):
+        """The `count` best ranked rows of a user's history or liked songs, loaded for `serializer_class`."""
+        rows = search.in_rank_order(queryset.values_list('id', 'song_id'), ranked_ids, key=lambda row: row[1])
+        top_ids = [row_id for row_id, _ in rows[:count]]
+        return search.in_rank_order(
+            serializer_class.setup_eager_loading(queryset.model.objects.filter(id__in=top_ids)), top_ids
+        )
+
+    def icontains_lyrics(self, query, limit):
+        lyric_matches = []
+        folded = query.casefold()
+        for song_id, times, lines in SongLyrics.objects.filter(lines__icontains=query).values_list('song_id', 'times', 'lines')[:limit]:
+            for index, line in enumerate(lines):
+                if folded in line.casefold():
+                    lyric_matches.append(search.LyricMatch(song_id, index, times[index], line))
+                    break
+        return lyric_matches
+
+    def icontains_search(self, user, query, limit):
         # Initialize an empty set to track used song IDs
         used_song_ids = set()
 
@@ -505,17 +759,18 @@ class GlobalSearchAPIView(APIView):
             Q(song__album__title__icontains=query) |
             Q(song__song_artists__artist__name__icontains=query) |
             Q(song__song_tags__tag__name__icontains=query)
-        ).select_related('song__album').prefetch_related('song__song_artists__artist').distinct()[:limit+1]
+        ).distinct()[:limit+1]
+        user_histories = UserSongHistorySerializer.setup_eager_loading(user_histories)
         used_song_ids.update(user_histories.values_list('song_id', flat=True))
 
         # Search in songs, excluding already used song IDs
         songs = Song.objects.filter(
             Q(title__icontains=query) |
-            Q(lyrics__icontains=query) |
             Q(album__title__icontains=query) |
             Q(song_artists__artist__name__icontains=query) | 
             Q(song_tags__tag__name__icontains=query) 
-        ).exclude(id__in=used_song_ids).select_related('album').prefetch_related('song_artists__artist').distinct()[:limit]
+        ).exclude(id__in=used_song_ids).distinct()[:limit]
+        songs = SongSerializer.setup_eager_loading(songs)
         used_song_ids.update(songs.values_list('id', flat=True))
 
         # Search in user liked songs, excluding already used song IDs
@@ -524,8 +779,8 @@ class GlobalSearchAPIView(APIView):
             Q(song__album__title__icontains=query) |
             Q(song__song_artists__artist__name__icontains=query) |
             Q(song__song_tags__tag__name__icontains=query)
-        ).exclude(song_id__in=used_song_ids).select_related('song__album').prefetch_related('song__song_artists__artist').distinct()[:limit]
-        used_song_ids.update(user_liked_songs.values_list('song_id', flat=True))
+        ).exclude(song_id__in=used_song_ids).distinct()[:limit]
+        user_liked_songs = UserLikedSongSerializer.setup_eager_loading(user_liked_songs)
 
         # Search for artists
         artists = Artist.objects.filter(Q(name__icontains=query)).distinct()[:limit]
@@ -533,34 +788,76 @@ class GlobalSearchAPIView(APIView):
         # Search for albums
         albums = Album.objects.filter(Q(title__icontains=query)).distinct()[:limit]
 
-        # Search for playlists
-        playlists = Playlist.objects.filter(Q(name__icontains=query) & (Q(privacy_type='Public') | Q(user=user))).distinct()[:limit]
-        
         # search for tags
         tags = Tag.objects.filter(Q(name__icontains=query)).distinct()[:limit]
 
-        # Serialize results
-        data = {
-            'user_history': UserSongHistorySerializer(user_histories, many=True).data,
-            'songs': SongSerializer(songs, many=True).data,
-            'user_liked_songs': UserLikedSongSerializer(user_liked_songs, many=True).data,
-            'artists': ArtistSerializer(artists, many=True).data,
-            'albums': AlbumSerializer(albums, many=True).data,
-            'playlists': PlaylistSerializer(playlists, many=True).data,
-            'tags': TagSerializer(tags, many=True).data,
-        }
-
-        return Response(data)
+        return user_histories, songs, user_liked_songs, artists, albums, tags
     
+class CatalogSnapshotView(APIView):
+    """The whole catalog at its current version, gzipped when the client accepts it."""
+
+    def get(self, request):
+        version = catalog.current_version()
+        etag = f'"catalog-{version}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            payload = catalog.get_snapshot(version)
+            if ACCEPTS_GZIP_RE.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+                response = HttpResponse(payload, content_type='application/json')
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = HttpResponse(gzip.decompress(payload), content_type='application/json')
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
+class CatalogChangesView(APIView):
+    """Rows added, changed and deleted since `since`, a version from the snapshot or a previous call."""
+
+    def get(self, request):
+        since = request.query_params.get('since', '')
+        if not since.isdigit():
+            return Response({"error": "since must be a catalog version."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            changes = catalog.changes_since(int(since))
+        except catalog.ResyncRequired:
+            return Response(
+                {"error": "The change log no longer covers this version; download the snapshot again."},
+                status=status.HTTP_410_GONE
+            )
+        return Response(changes)
+
 class SongSearchView(APIView):
     def get(self, request, *args, **kwargs):
         q = request.query_params.get('q', '').strip()
         searchby = request.query_params.get('searchby', '1')
         sortby = request.query_params.get('sortby', '1')
         songs = Song.objects.all()
+        paginator = CustomLimitOffsetPagination()
 
-        if q:
-            if searchby == '1':
+        song_ids = None
+        if q and searchby in SONG_SEARCH_COLUMNS:
+            columns = [SONG_SEARCH_COLUMNS[searchby]] if SONG_SEARCH_COLUMNS[searchby] else None
+            if sortby == '0':
+                # Relevance order comes straight from the full-text index
+                ranked_songs = search.RankedSongs(q, columns, SongSerializer.setup_eager_loading(songs))
+                if ranked_songs.count() is not None:
+                    paginated_songs = paginator.paginate_queryset(ranked_songs, request)
+                    serializer = SongSerializer(paginated_songs, many=True)
+                    return paginator.get_paginated_response(serializer.data)
+            song_ids = search.song_ids_subquery(q, columns)
+
+        if song_ids is not None:
+            songs = songs.filter(id__in=song_ids)
+        elif q:
+            if searchby == '0':
+                songs = songs.filter(
+                    Q(original_name__icontains=q) |
+                    Q(album__title__icontains=q) |
+                    Q(song_artists__artist__name__icontains=q) |
+                    Q(song_tags__tag__name__icontains=q)
+                ).distinct()
+            elif searchby == '1':
                 songs = songs.filter(original_name__icontains=q)
             elif searchby == '2':
                 songs = songs.filter(song_artists__artist__name__icontains=q).distinct()
@@ -582,8 +879,7 @@ class SongSearchView(APIView):
         elif sortby == '3':
             songs = songs.order_by('-album__year')
 
-        paginator = CustomLimitOffsetPagination()
-        paginated_songs = paginator.paginate_queryset(songs, request)
+        paginated_songs = paginator.paginate_queryset(SongSerializer.setup_eager_loading(songs), request)
 
         serializer = SongSerializer(paginated_songs, many=True)
         return paginator.get_paginated_response(serializer.data)